@@ -19,6 +19,7 @@ import os
 import shutil
 from hdmi import HDMI
 from terminal import Terminal
+from video_timing import video_timings, pixels_per_clock, VideoTimingGenerator, Genlock, video_mode_rom
 
 
 
@@ -36,7 +37,7 @@ from litex.build.generic_platform import *
 from litex.boards.platforms import versa_ecp5
 
 from litex.soc.cores.clock import *
-from ecp5_dynamic_pll import ECP5PLL, period_ns
+from ecp5_dynamic_pll import ECP5PLL, ECP5MultiModePLL, period_ns
 from litex.soc.integration.soc_core import *
 from litex.soc.integration.soc import SoCRegion
 from litex.soc.integration.builder import *
@@ -48,7 +49,7 @@ from litex.soc.cores.gpio import GPIOOut, GPIOIn
 from rgb_led import RGB
 from reboot import Reboot
 
-from streamable_hyperram import StreamableHyperRAM
+from streamable_hyperram import StreamableHyperRAM, hyperram_budget
 
 from wishbone_stream import StreamReader, StreamWriter, dummySink, dummySource
 
@@ -60,7 +61,7 @@ from litex.soc.interconnect.stream import Endpoint, EndpointDescription, SyncFIF
 from migen.genlib.cdc import MultiReg, PulseSynchronizer
 
 from boson import Boson
-from YCrCb import YCrCbConvert
+from YCrCb import ColourMatrix
 
 from sw_i2c import I2C
 
@@ -71,15 +72,24 @@ from migen.genlib.misc import timeline
 
 from sim import Platform
 
-from edge_detect import EdgeDetect
+from edge_detect import EdgeDetect, FrameCommit
 from prbs_stream import PRBSSink, PRBSSource
 
 from simulated_video import SimulatedVideo
 from video_debug import VideoDebug
 from video_stream import VideoStream
 from framer import Framer
+from compositor import Compositor
+from palette import Palette
+from histogram import Histogram
+from agc import AGC
+from tnr import TemporalFilter
+from spatial import SpatialFilter
 from scaler import ScalerWidth
 from scaler import ScalerHeight
+from scaler import PolyphaseScaler
+from scaler import ScalerInteger
+from dsp import multiplier_estimate, nextpnr_utilisation, DSP_BLOCKS, LUT4S
 
 #from hyperRAM.hyperbus_fast import HyperRAM
 #from dma.dma import StreamWriter, StreamReader, dummySink, dummySource
@@ -89,7 +99,7 @@ from scaler import ScalerHeight
 from litex.soc.interconnect.csr import *
 
 class _CRG(Module, AutoCSR):
-    def __init__(self, platform, sys_clk_freq):
+    def __init__(self, platform, sys_clk_freq, pixel_clks=[40e6], ppc=1):
         self.clock_domains.cd_sys = ClockDomain()
         self.clock_domains.cd_video = ClockDomain()
         self.clock_domains.cd_video_shift = ClockDomain()
@@ -122,18 +132,52 @@ class _CRG(Module, AutoCSR):
         self.comb += self.cd_sys.clk.eq(self.cd_hr.clk)
         self.comb += self.cd_init.clk.eq(clk48)
 
-        pixel_clk = 40e6
         #pixel_clk = sys_clk_freq
 
         self.clock_domains.cd_usb_12 = ClockDomain()
         self.clock_domains.cd_usb_48 = ClockDomain()
 
-        self.submodules.video_pll = video_pll = ECP5PLL()
+        # The first pixel clock is used at power up, the others can be switched to at runtime
+        pixel_clk = pixel_clks[0]
+        if len(pixel_clks) > 1:
+            assert ppc == 2
+            self.submodules.video_pll = video_pll = ECP5MultiModePLL([f / pixel_clk for f in pixel_clks])
+            self._video_mode = CSRStorage(len(video_pll.mode))
+            self._video_locked = CSRStatus()
+            self.comb += video_pll.mode.eq(self._video_mode.storage)
+            self.specials += MultiReg(video_pll.locked, self._video_locked.status)
+        else:
+            self.submodules.video_pll = video_pll = ECP5PLL()
         video_pll.register_clkin(clk48, 48e6)
-        video_pll.create_clkout(self.cd_video,    pixel_clk,  margin=0)
-        video_pll.create_clkout(self.cd_video_shift,  pixel_clk*5, margin=0)
-        video_pll.create_clkout(self.cd_usb_12,    12e6,  margin=0)
-
+        if ppc == 1:
+            video_pll.create_clkout(self.cd_video,    pixel_clk,  margin=0)
+            video_pll.create_clkout(self.cd_video_shift,  pixel_clk*5, margin=0)
+            video_pll.create_clkout(self.cd_usb_12,    12e6,  margin=0)
+        else:
+            # Two pixels per video clock. The ODDRX2F edge clock runs at 5x pixel_clk, which is
+            # 742.5MHz for 1080p60, past the ECP5 ECLK spec. 720p60 and 1080p30 are within spec.
+            self.clock_domains.cd_video_shift2x = ClockDomain()
+            video_pll.create_clkout(self.cd_video_shift2x,  pixel_clk*5)
+            video_pll.create_clkout(self.cd_video,    pixel_clk/2)
+            pll.create_clkout(self.cd_usb_12,    12e6,  margin=0)
+
+            self.specials += Instance("CLKDIVF",
+                p_DIV     = "2.0",
+                i_ALIGNWD = 0,
+                i_CLKI    = self.cd_video_shift2x.clk,
+                i_RST     = ~video_pll.locked,
+                o_CDIVX   = self.cd_video_shift.clk)
+
+        # Pixel clock and reference divider the video PLL actually gives each mode
+        config = video_pll.compute_config()
+        video_div = config["clko{}_div".format(0 if ppc == 1 else 1)]
+        if len(pixel_clks) > 1:
+            self.pll_ref_divs = [config["ref_div{}".format(n)] for n in range(len(pixel_clks))]
+            vcos = [config["vco{}".format(n)] for n in range(len(pixel_clks))]
+        else:
+            self.pll_ref_divs = [config["clki_div"]]
+            vcos = [config["vco"]]
+        self.pixel_clks = [vco / video_div * ppc for vco in vcos]
 
         self.comb += self.cd_usb_48.clk.eq(clk48)
 
@@ -142,8 +186,11 @@ class _CRG(Module, AutoCSR):
         platform.add_period_constraint(self.cd_usb_48.clk, period_ns(48e6))
         platform.add_period_constraint(self.cd_sys.clk, period_ns(sys_clk_freq))
         platform.add_period_constraint(clk48, period_ns(48e6))
-        platform.add_period_constraint(self.cd_video.clk, period_ns(pixel_clk))
-        platform.add_period_constraint(self.cd_video_shift.clk, period_ns(pixel_clk * 5))
+        pixel_clk_max = max(pixel_clks)
+        platform.add_period_constraint(self.cd_video.clk, period_ns(pixel_clk_max / ppc))
+        platform.add_period_constraint(self.cd_video_shift.clk, period_ns(pixel_clk_max * 5 / ppc))
+        if ppc == 2:
+            platform.add_period_constraint(self.cd_video_shift2x.clk, period_ns(pixel_clk_max * 5))
 
         self._slip_hr2x = CSRStorage()
         self._slip_hr2x90 = CSRStorage()
@@ -213,12 +260,30 @@ class DiVA_SoC(SoCCore):
         "framer"     :  27,
         "scaler"     :  28,
         "boson"      :  29,
+        "integer_scaler": 30,
+        "video_timing":  31,
+        "genlock"    :  32,
+        "writer2"    :  33,
+        "framer_osd" :  34,
+        "compositor" :  35,
+        "palette"    :  36,
+        "histogram"  :  37,
+        "agc"        :  38,
+        "csc"        :  39,
+        "writer3"    :  40,
+        "tnr"        :  41,
+        "spatial"    :  42,
+        "crop"       :  43,
     }
     csr_map.update(SoCCore.csr_map)
 
     mem_map = {
         "hyperram"  : 0x10000000,
         "terminal"  : 0x30000000,
+        "video_modes": 0x31000000,
+        "palette"   : 0x32000000,
+        "histogram" : 0x33000000,
+        "boson_command": 0x34000000,
     }
     mem_map.update(SoCCore.mem_map)
 
@@ -227,7 +292,7 @@ class DiVA_SoC(SoCCore):
     }
     interrupt_map.update(SoCCore.interrupt_map)
 
-    def __init__(self, sim=False):
+    def __init__(self, sim=False, scaler_engine="linear", video_modes=["800x600@60Hz"]):
 
         if sim:
             self.platform = platform = Platform()
@@ -235,9 +300,17 @@ class DiVA_SoC(SoCCore):
             self.platform = platform = bosonHDMI_r0d3.Platform()
         
         sys_clk_freq = 82.5e6
+
+        # The first mode is used at power up
+        modes = [video_timings[m] for m in video_modes]
+        timings = modes[0]
+        ppc = max(pixels_per_clock(t) for t in modes)
+        if len(modes) > 1:
+            # Retuning the video PLL leaves no spare clkout for usb_12, that is the 2ppc clocking
+            ppc = 2
         SoCCore.__init__(self, platform, clk_freq=sys_clk_freq,
                           cpu_type='serv', with_uart=True, uart_name='stream',
-                          csr_data_width=32,
+                          csr_data_width=32, csr_address_width=15,
                           ident="HyperRAM Test SoC", ident_version=True, wishbone_timeout_cycles=512,
                           integrated_rom_size=16*1024)
 
@@ -256,10 +329,21 @@ class DiVA_SoC(SoCCore):
             self.comb += self.cd_sys.rst.eq(rst)            
 
         else:
-            self.submodules.crg = _CRG(platform, sys_clk_freq)
+            self.submodules.crg = _CRG(platform, sys_clk_freq, [t["pix_clk"] for t in modes], ppc)
      
+        ## Video timing, drives the terminal, framer and HDMI output
+        self.submodules.video_timing = video_timing = ClockDomainsRenamer({"sys":"video"})(VideoTimingGenerator(timings, ppc))
+
+        ## Supported output modes, the firmware picks one to suit the monitor's EDID
+        if sim:
+            mode_rom = video_mode_rom(modes, [t["pix_clk"] for t in modes], [1]*len(modes))
+        else:
+            mode_rom = video_mode_rom(modes, self.crg.pixel_clks, self.crg.pll_ref_divs)
+        self.submodules.video_modes = wishbone.SRAM(4*len(mode_rom), read_only=True, init=mode_rom)
+        self.register_mem("video_modes", self.mem_map["video_modes"], self.video_modes.bus, size=0x1000)
+
         ## Create VGA terminal
-        self.submodules.terminal = terminal = ClockDomainsRenamer({'vga':'video'})(Terminal())
+        self.submodules.terminal = terminal = ClockDomainsRenamer({'vga':'video'})(Terminal(video_timing, ppc=ppc))
         self.register_mem("terminal", self.mem_map["terminal"], terminal.bus, size=0x100000)
 
         # User inputs
@@ -272,19 +356,66 @@ class DiVA_SoC(SoCCore):
         # HyperRAM
         hyperram_pads = None if sim else platform.request("hyperRAM")
         self.submodules.writer = writer = StreamWriter(external_sync=True)
-        self.submodules.reader = reader = StreamReader(external_sync=True)
+        self.submodules.reader = reader = StreamReader(sync_first=True)
 
         self.submodules.writer1 = writer1 = StreamWriter()
         self.submodules.reader1 = reader1 = StreamReader()
 
-        self.submodules.hyperram = hyperram = StreamableHyperRAM(hyperram_pads, devices=[reader, writer, reader1, writer1], sim=sim)
+        # OSD graphics, read out of HyperRAM each frame
+        self.submodules.writer2 = writer2 = StreamWriter(external_sync=True)
+
+        # Previous frame for the temporal filter
+        self.submodules.writer3 = writer3 = StreamWriter(external_sync=True)
+
+        self.submodules.hyperram = hyperram = StreamableHyperRAM(hyperram_pads, devices=[reader, writer, reader1, writer1, writer2, writer3], sim=sim)
         self.register_mem("hyperram", self.mem_map['hyperram'], hyperram.bus, size=0x800000)
 
+        # Worst case frame buffer traffic, a 640x512 Boson frame at 60Hz in, back out for the temporal
+        # filter and for display without genlock, and a 320x240 OSD
+        boson_rate = 640*512*60
+        hyperram_budget(sys_clk_freq, {
+            "capture": (boson_rate, 512),
+            "tnr": (boson_rate, 256),
+            "display": (boson_rate, 512),
+            "osd": (320*240*60, 256),
+        })
+
         # Dummy video stream
         #self.submodules.simulated_video = simulated_video = ClockDomainsRenamer({"pixel":"oscg_38M"})(SimulatedVideo())
         # Boson video stream
         self.submodules.boson = boson = Boson(platform, platform.request("boson"), sys_clk_freq)
-        self.submodules.YCrCb = ycrcb = ClockDomainsRenamer({"sys":"boson_rx"})(YCrCbConvert())
+        self.register_mem("boson_command", self.mem_map["boson_command"], boson.command.bus, size=0x4000)
+        self.submodules.csc = ycrcb = ClockDomainsRenamer({"pixel":"boson_rx"})(ColourMatrix())
+
+        # False colour from the Boson's luminance, replaces the YCrCb conversion while enabled
+        self.submodules.palette = palette = ClockDomainsRenamer({"pixel":"boson_rx"})(Palette())
+        self.register_mem("palette", self.mem_map["palette"], palette.bus, size=0x1000)
+        rgb = Endpoint([("data", 24)])
+
+        # Luminance statistics for each Boson frame, counted by the AGC. 1024 bins keep the detail of raw frames
+        self.submodules.histogram = histogram = ClockDomainsRenamer({"pixel":"boson_rx"})(Histogram(bits=10))
+        self.register_mem("histogram", self.mem_map["histogram"], histogram.bus, size=0x1000)
+
+        # Contrast stretch on the luminance, from the histogram of the frame before
+        self.submodules.agc = agc = ClockDomainsRenamer({"pixel":"boson_rx"})(AGC(histogram))
+
+        # Sharpen, edge or denoise kernels on the luminance, ahead of both colour paths
+        self.submodules.spatial = spatial = ClockDomainsRenamer({"pixel":"boson_rx"})(SpatialFilter())
+        self.comb += [
+            palette.vsync.eq(boson.vsync),
+            histogram.vsync.eq(boson.vsync),
+            agc.raw.eq(boson.raw_active),
+            boson.source.connect(agc.sink),
+            agc.source.connect(spatial.sink),
+            spatial.source.connect(palette.sink, omit={"ready"}),
+            # The Boson can't be held off
+            ycrcb.source.ready.eq(1),
+            If(palette.enabled,
+                palette.source.connect(rgb),
+            ).Else(
+                ycrcb.source.connect(rgb, omit={"ready"}),
+            )
+        ]
         
         fifo = AsyncFIFO([("data", 32)], depth=512)
         fifo = ResetInserter(["read","write"])(fifo)
@@ -295,18 +426,131 @@ class DiVA_SoC(SoCCore):
         
         scaler_enable = Signal()
 
-        self.submodules.framer = framer = Framer()
+        self.submodules.framer = framer = Framer(video_timing, ppc)
 
-        self.submodules.scaler = scaler = ClockDomainsRenamer({"sys":"video"})((ScalerWidth()))
-        self.submodules.fifo2 = fifo2 = ClockDomainsRenamer({"sys":"video"})(ResetInserter()(SyncFIFO([("data", 32)], depth=16)))
-        self.submodules.scaler0 = scaler0 = ClockDomainsRenamer({"sys":"video"})(ScalerHeight(800))
+        fifo0 = ClockDomainsRenamer({"read":"video","write":"sys"})(AsyncFIFO([("data", 32)], depth=512))
+        self.submodules += fifo0
+
+        # OSD layer, positioned by its own framer
+        self.submodules.framer_osd = framer_osd = Framer(video_timing, ppc)
+        fifo_osd = ClockDomainsRenamer({"read":"video","write":"sys"})(AsyncFIFO([("data", 32)], depth=512))
+        self.submodules += fifo_osd
+        self.comb += writer2.source.connect(fifo_osd.sink)
+        if ppc == 1:
+            self.comb += fifo_osd.source.connect(framer_osd.sink)
+        else:
+            self.submodules.osd_converter = osd_converter = ClockDomainsRenamer({"sys":"video"})(stream.Converter(32, 32*ppc))
+            self.comb += [
+                fifo_osd.source.connect(osd_converter.sink),
+                osd_converter.source.connect(framer_osd.sink),
+            ]
+
+        # Layers bottom to top: video, terminal, OSD. The terminal is keyed per pixel, only glyphs and cells
+        # with a background colour cover the video, at layer1_alpha. Black is transparent in the OSD by default
+        self.submodules.compositor = compositor = ClockDomainsRenamer({"sys":"video"})(
+            Compositor(3, ppc, key_enable=[0, 0, 1]))
+        layer_valid = [Replicate(framer.data_valid, ppc), terminal.opaque, Replicate(framer_osd.data_valid, ppc)]
+        for layer, src, valid in zip(compositor.layers, [framer, terminal, framer_osd], layer_valid):
+            self.comb += [
+                layer.r.eq(src.red),
+                layer.g.eq(src.green),
+                layer.b.eq(src.blue),
+                layer.valid.eq(valid),
+            ]
+        self.comb += [
+            compositor.hsync.eq(video_timing.hsync),
+            compositor.vsync.eq(video_timing.vsync),
+            compositor.blank.eq(video_timing.blank),
+        ]
+
+        # Genlocked, the output races the Boson through HyperRAM: the output frame, and the writer, start
+        # genlock_delay lines after the Boson's and the writer's reads are held behind the reader's writes.
+        # Falls back to the free running HyperRAM frame buffer whenever genlock isn't locked.
+        # Setting genlock_passthrough is opt-in: the Boson stream skips HyperRAM and only a few lines are
+        # buffered in BRAM, but the full 640x512 frame goes to the scaler, without the crop, zoom,
+        # integer scaling or TNR, which all work on the frame buffer.
+        # Raw frames go to HyperRAM as 16 bit values, so while they're captured the passthrough shows the
+        # AGC's preview of them.
+        self.submodules.genlock = genlock = Genlock(video_timing)
+        passthrough = Signal()
+        race = Signal()
+        race_video = Signal()
+        raw_video = Signal()
+        passthrough_video = Signal()
+        self.specials += [
+            MultiReg(boson.raw_active, raw_video, "video"),
+            MultiReg(genlock.passthrough.storage, passthrough_video, "video"),
+        ]
+        self.comb += passthrough.eq(genlock.locked & (passthrough_video | raw_video))
+        # Registered in the video domain, then resynchronised to the writer
+        self.sync.video += race_video.eq(genlock.locked & ~passthrough_video & ~raw_video)
+        self.specials += MultiReg(race_video, race)
+        passthrough_fifo = AsyncFIFO([("data", 32)], depth=2048)
+        passthrough_fifo = ResetInserter(["read","write"])(passthrough_fifo)
+        self.submodules.passthrough_fifo = passthrough_fifo = ClockDomainsRenamer({"read":"video","write":"boson_rx"})(passthrough_fifo)
+
+        video_in = Endpoint([("data", 32)])
+        self.comb += [
+            If(passthrough,
+                passthrough_fifo.source.connect(video_in),
+                fifo0.source.ready.eq(1),
+            ).Else(
+                fifo0.source.connect(video_in),
+                passthrough_fifo.source.ready.eq(1),
+            )
+        ]
+
+        if ppc == 1:
+            scaler_width, scaler_height = 800, 600
+        else:
+            # Keep the Boson's 5:4 aspect ratio, the linear and integer scalers only run at 1ppc
+            scaler_engine = "polyphase"
+            # Sized to fit the smallest mode
+            scaler_height = min(min(t["v_active"], t["h_active"] * 4 // 5) for t in modes)
+            scaler_width = (scaler_height * 5 // 4) & ~(2*ppc - 1)
+
+        if scaler_engine == "polyphase":
+            # 4-tap Lanczos, ScalerWidth/fifo2/ScalerHeight in one block. The colour matrix takes 9
+            # MULT18X18D, the filters that don't fit the rest multiply in LUTs
+            self.submodules.scaler = scaler = ClockDomainsRenamer({"sys":"video"})(
+                PolyphaseScaler(640, 512, scaler_width, scaler_height, ppc=ppc, dsp=DSP_BLOCKS - 9))
+            scaler_path = [
+                video_in.connect(scaler.sink),
+                scaler.source.connect(framer.sink),
+            ]
+            scaler_reset = [scaler.reset]
+        else:
+            self.submodules.scaler = scaler = ClockDomainsRenamer({"sys":"video"})((ScalerWidth()))
+            self.submodules.fifo2 = fifo2 = ClockDomainsRenamer({"sys":"video"})(ResetInserter()(SyncFIFO([("data", 32)], depth=16)))
+            self.submodules.scaler0 = scaler0 = ClockDomainsRenamer({"sys":"video"})(ScalerHeight(800))
+            scaler_path = [
+                video_in.connect(scaler.sink),
+                scaler.source.connect(fifo2.sink),
+                fifo2.source.connect(scaler0.sink),
+                scaler0.source.connect(framer.sink)
+            ]
+            scaler_reset = [scaler.reset, fifo2.reset, scaler0.reset]
+
+        if ppc == 1:
+            # Blocky integer zoom when the interpolating scaler is off, factor 1 is a passthrough
+            self.submodules.integer_scaler = integer_scaler = ClockDomainsRenamer({"sys":"video"})(ScalerInteger(640, 800, 600, max_factor=4))
+            self.add_constant("INTEGER_SCALER_MAX_FACTOR", 4)
+            scaler_reset += [integer_scaler.reset]
+            scaler_mux = If(scaler_enable,
+                scaler_path
+            ).Else(
+                video_in.connect(integer_scaler.sink),
+                integer_scaler.source.connect(framer.sink),
+            )
+        else:
+            scaler_mux = scaler_path
 
 
         self.comb += [
             video_debug.vsync.eq(boson.vsync),
             video_debug.hsync.eq(boson.hsync),
 
-            boson.source.connect(ycrcb.sink),
+            spatial.source.connect(ycrcb.sink),
 
             #fifo.reset_write.eq(boson.vsync),
 
@@ -316,8 +560,6 @@ class DiVA_SoC(SoCCore):
             #video_stream.red.eq(boson.red),
             #video_stream.green.eq(boson.green),
             #video_stream.blue.eq(boson.blue),
-
-            boson.next_mode.eq(btn.b)
         ]
 
         # connect something to these streams
@@ -328,9 +570,25 @@ class DiVA_SoC(SoCCore):
         self.submodules += fifo
         self.comb += [
         
-            ycrcb.source.connect(fifo.sink),
+            If(boson.raw_active,
+                boson.raw_source.connect(fifo.sink),
+            ).Else(
+                rgb.connect(fifo.sink),
+            ),
+            passthrough_fifo.sink.valid.eq(rgb.valid),
+            passthrough_fifo.sink.data.eq(rgb.data),
         #    ds.source.connect(fifo.sink),
-            fifo.source.connect(reader.sink),
+        ]
+
+        # Temporal noise reduction between the capture FIFO and the frame buffer, raw frames pass through
+        self.submodules.tnr = tnr = TemporalFilter(burst=256)
+        self.specials += MultiReg(boson.raw_active, tnr.bypass)
+        self.comb += [
+            fifo.source.connect(tnr.sink),
+            tnr.source.connect(reader.sink),
+            writer3.source.connect(tnr.prev),
+            writer3.start.eq(tnr.prev_start),
+            writer3.flush.eq(tnr.prev_flush),
         ]
 
 
@@ -338,7 +596,7 @@ class DiVA_SoC(SoCCore):
         ## HDMI output 
         if not sim:
             hdmi_pins = platform.request('hdmi')
-            self.submodules.hdmi = hdmi =  HDMI(platform, hdmi_pins)
+            self.submodules.hdmi = hdmi =  HDMI(platform, hdmi_pins, ppc)
             self.submodules.hdmi_i2c = I2C(platform.request("hdmi_i2c"))
 
 
@@ -350,21 +608,9 @@ class DiVA_SoC(SoCCore):
 
 
 
-        fifo0 = ClockDomainsRenamer({"read":"video","write":"sys"})(AsyncFIFO([("data", 32)], depth=512))
-        self.submodules += fifo0
         self.comb += [
             writer.source.connect(fifo0.sink),
-
-
-            If(scaler_enable,
-                fifo0.source.connect(scaler.sink),
-                scaler.source.connect(fifo2.sink),
-                fifo2.source.connect(scaler0.sink),
-                scaler0.source.connect(framer.sink)
-            ).Else(
-
-                fifo0.source.connect(framer.sink),
-            )
+            scaler_mux,
         ]
 
 
@@ -379,21 +625,48 @@ class DiVA_SoC(SoCCore):
 
         # enable
         self.submodules.vsync_rise = vsync_rise = EdgeDetect(mode="rise", input_cd="video", output_cd="sys")
-        self.comb += vsync_rise.i.eq(terminal.vsync)
+        self.comb += vsync_rise.i.eq(video_timing.vsync)
 
         self.submodules.vsync_rise_term = vsync_rise_term = EdgeDetect(mode="rise", input_cd="video", output_cd="video")
-        self.comb += vsync_rise_term.i.eq(terminal.vsync)
+        self.comb += vsync_rise_term.i.eq(video_timing.vsync)
 
 
         self.submodules.vsync_boson = vsync_boson = EdgeDetect(mode="fall", input_cd="boson_rx", output_cd="sys")
         self.comb += vsync_boson.i.eq(boson.vsync)
 
+        # Each Boson frame restarts the passthrough buffer and, some lines later, the output frame
+        self.submodules.vsync_boson_rx = vsync_boson_rx = EdgeDetect(mode="fall", input_cd="boson_rx", output_cd="boson_rx")
+        self.submodules.vsync_boson_video = vsync_boson_video = EdgeDetect(mode="fall", input_cd="boson_rx", output_cd="video")
+        self.comb += [
+            vsync_boson_rx.i.eq(boson.vsync),
+            vsync_boson_video.i.eq(boson.vsync),
+            passthrough_fifo.reset_write.eq(vsync_boson_rx.o),
+            passthrough_fifo.reset_read.eq(vsync_boson_video.o),
+            genlock.ref.eq(vsync_boson_video.o),
+        ]
+
+
+        # The crop fetched from HyperRAM and the scaler's matching geometry change together, on the
+        # first vsync after a commit
+        self.submodules.crop = crop = FrameCommit(output_cd="video")
+        self.comb += [
+            crop.frame.eq(vsync_rise.o),
+            writer.load.eq(crop.load),
+        ]
+        if scaler_engine == "polyphase":
+            self.comb += scaler.load.eq(crop.load_out)
+        if ppc == 1:
+            self.comb += integer_scaler.load.eq(crop.load_out)
 
         self.comb += [
             writer.start.eq(vsync_rise.o),
-            scaler.reset.eq(vsync_rise_term.o),
-            fifo2.reset.eq(vsync_rise_term.o),
-            scaler0.reset.eq(vsync_rise_term.o),
+            writer2.start.eq(vsync_rise.o),
+            # Between the reader's frames `frame` is the one it writes next, so a writer that started
+            # reading it waits for it
+            writer.guard.eq(race & reader.busy),
+            writer.limit.eq(reader.address),
+            writer.frame.eq(reader.frame + ~reader.busy),
+            [r.eq(vsync_rise_term.o) for r in scaler_reset],
         ]
         #self.comb += reader.start.eq(vsync_boson.o)
         
@@ -402,43 +675,29 @@ class DiVA_SoC(SoCCore):
 
 
 
-        # delay vsync pulse from boson by 500 clocks, then use it to reset the fifo
-        fifo_rst = Signal()
-        self.sync += [
-             timeline(vsync_boson.o, [
-                (501,  [fifo_rst.eq(1)]),   # Reset FIFO
-                (550,  [fifo_rst.eq(0), scaler_enable.eq(scaler.enable.storage)]),  # Clear Reset
-                (621,  [reader.start.eq(1)]),
-                (622,  [reader.start.eq(0)])
-            ])
+        # The reader syncs on the frame markers from the Boson, the scaler setting follows each frame
+        self.sync += If(vsync_boson.o, scaler_enable.eq(scaler.enable.storage))
+
+        # A glitch on the Boson link flushes the capture FIFO and the reader, capture restarts at the next frame
+        self.submodules.resync_sys = resync_sys = PulseSynchronizer("boson_rx", "sys")
+        self.comb += [
+            resync_sys.i.eq(boson.resync),
+            fifo.reset_write.eq(boson.resync),
+            fifo.reset_read.eq(resync_sys.o),
+            reader.flush.eq(resync_sys.o),
         ]
-        self.specials += MultiReg(fifo_rst, fifo.reset_write, odomain="boson_rx")
-        self.comb += fifo.reset_read.eq(fifo_rst)
        
         #self.comb += writer.start.eq(vsync_rise.o)
 
         ## Connect VGA pins
         if not sim:
             self.comb += [
-                fifo.reset_read.eq(vsync_boson.o),
-
-                # attach framer to video generator
-                framer.vsync.eq(terminal.vsync),
-                framer.hsync.eq(terminal.hsync),
-                
-
-                hdmi.vsync.eq(terminal.vsync),
-                hdmi.hsync.eq(terminal.hsync),
-                hdmi.blank.eq(terminal.blank),
-                If(framer.data_valid,
-                    hdmi.r.eq(framer.red),
-                    hdmi.g.eq(framer.green),
-                    hdmi.b.eq(framer.blue),
-                ).Else(
-                    hdmi.r.eq(terminal.red),
-                    hdmi.g.eq(terminal.green),
-                    hdmi.b.eq(terminal.blue),  
-                )
+                hdmi.vsync.eq(compositor.out.vsync),
+                hdmi.hsync.eq(compositor.out.hsync),
+                hdmi.blank.eq(compositor.out.blank),
+                hdmi.r.eq(compositor.out.r),
+                hdmi.g.eq(compositor.out.g),
+                hdmi.b.eq(compositor.out.b),
             ]
 
         
@@ -481,6 +740,14 @@ class DiVA_SoC(SoCCore):
             return r
         self.add_constant("DIVA_GIT_SHA1", get_git_revision())
 
+        # Video mode at power up
+        self.add_constant("VIDEO_H_ACTIVE", timings["h_active"])
+        self.add_constant("VIDEO_V_ACTIVE", timings["v_active"])
+        self.add_constant("VIDEO_PPC", ppc)
+        self.add_constant("VIDEO_MODES", len(modes))
+        self.add_constant("SCALER_WIDTH", scaler_width)
+        self.add_constant("SCALER_HEIGHT", scaler_height)
+
     def do_exit(self, vns):
         if hasattr(self, "analyzer"):
             self.analyzer.export_csv(vns, "test/analyzer.csv")
@@ -524,9 +791,19 @@ def main():
         "--sim", default=False, action='store_true',
         help="simulate"
     )
+    parser.add_argument(
+        "--scaler", default="linear", choices=["linear", "polyphase"],
+        help="video scaler engine"
+    )
+    parser.add_argument(
+        "--video-mode", default=["800x600@60Hz"], choices=list(video_timings.keys()), nargs="+",
+        help="HDMI output mode, any further modes can be switched to at runtime"
+    )
     args = parser.parse_args()
 
-    soc = DiVA_SoC()
+    soc = DiVA_SoC(scaler_engine=args.scaler, video_modes=args.video_mode)
+    blocks, lut4 = multiplier_estimate(soc)
+    print(f"Multiplier estimate: {blocks}/{DSP_BLOCKS} MULT18X18D, {lut4}/{LUT4S} LUT4")
     builder = Builder(soc, output_dir="build", csr_csv="build/csr.csv")
 
     # Build firmware
@@ -585,6 +862,12 @@ clang++ -I obj_dir -flto -I/usr/local/share/verilator/include -I/usr/include/SDL
             vns = builder.build(nowidelut=True)
             soc.do_exit(vns)    
 
+            # What nextpnr placed, against the estimate above
+            cells = nextpnr_utilisation(os.path.join(builder.output_dir, "gateware", f"{soc.platform.name}.log"))
+            for cell in ["MULT18X18D", "TRELLIS_COMB", "TRELLIS_SLICE"]:
+                if cell in cells:
+                    print(f"{cell}: {cells[cell][0]}/{cells[cell][1]}")
+
 
         # Insert Firmware into Gateware
         os.system(f"ecpbram  --input {input_config} --output {output_config} --from {rand_rom} --to {firmware_init}")
@@ -1,18 +1,19 @@
 #!/usr/bin/env python3
 import sys
 import os
+import unittest
 
 from migen import *
 from migen.genlib.cdc import MultiReg
 
 from boson import *
-from liteeth.common import *
 from litex.soc.cores.clock import *
 
 from pycrc.algorithms import Crc
 
 from litex.soc.cores.uart import RS232PHYTX
 from litex.soc.interconnect.stream import AsyncFIFO
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage
 
 
 def clamp(i):
@@ -54,15 +55,160 @@ class YCrCbConvert(Module):
 
         self.sync += [
             source.valid.eq(valid),
-            source.data.eq(rgb)
+            source.data.eq(rgb),
+            source.first.eq(sink.first),
+            source.last.eq(sink.last),
         ]
 
 
-        
-
-
-
-
-
-     
-        
\ No newline at end of file
+# Coefficients are signed with CSC_FRAC fractional bits
+CSC_FRAC = 14
+
+def csc_matrix(kr=0.299, kb=0.114, full_range=True):
+    """YCbCr to RGB coefficients, rows R, G, B and columns Y, Cb, Cr, and the offsets added to Y, Cb, Cr
+       before the multiply. BT.601 by default, kr=0.2126, kb=0.0722 for BT.709."""
+    kg = 1 - kr - kb
+    m = [
+        [1, 0, 2*(1 - kr)],
+        [1, -2*kb*(1 - kb)/kg, -2*kr*(1 - kr)/kg],
+        [1, 2*(1 - kb), 0],
+    ]
+    if full_range:
+        offsets = [0, -128, -128]
+    else:
+        scale = [255/219, 255/224, 255/224]
+        m = [[c*s for c, s in zip(row, scale)] for row in m]
+        offsets = [-16, -128, -128]
+    return [[round(c*2**CSC_FRAC) for c in row] for row in m], offsets
+
+CSC_PRESETS = {
+    "bt601_full":    csc_matrix(0.299, 0.114, True),
+    "bt601_limited": csc_matrix(0.299, 0.114, False),
+    "bt709_full":    csc_matrix(0.2126, 0.0722, True),
+    "bt709_limited": csc_matrix(0.2126, 0.0722, False),
+}
+
+class ColourMatrix(Module, AutoCSR):
+    """Pipelined YCbCr to RGB conversion of a `pixel` domain stream, `ppc` pixels per word with Y, Cb, Cr in
+       each 24 bits in, R, G, B out. out = clamp(sum(coef*(in + in_offset)) >> CSC_FRAC + out_offset), with
+       `round` set the result is rounded to nearest rather than truncated. Coefficient and offset CSRs
+       reset to BT.601 full range, see CSC_PRESETS for the others. Three register stages: multiply, sum,
+       clamp. The pipeline stalls with `source.ready`."""
+    def __init__(self, ppc=1):
+        self.sink = sink = stream.Endpoint(EndpointDescription([("data", 24*ppc)]))
+        self.source = source = stream.Endpoint(EndpointDescription([("data", 24*ppc)]))
+
+        coefs, offsets = CSC_PRESETS["bt601_full"]
+        self.round = CSRStorage(reset=1)
+
+        # # #
+
+        coef = [[Signal((18, True)) for j in range(3)] for i in range(3)]
+        in_offset = [Signal((9, True)) for j in range(3)]
+        out_offset = [Signal((9, True)) for i in range(3)]
+        rnd = Signal()
+        self.specials += MultiReg(self.round.storage, rnd, "pixel")
+        for i in range(3):
+            for j in range(3):
+                csr = CSRStorage(18, reset=coefs[i][j] & 0x3FFFF, name="coef{}{}".format(i, j))
+                setattr(self, "coef{}{}".format(i, j), csr)
+                self.specials += MultiReg(csr.storage, coef[i][j], "pixel")
+        for j in range(3):
+            csr = CSRStorage(9, reset=offsets[j] & 0x1FF, name="in_offset{}".format(j))
+            setattr(self, "in_offset{}".format(j), csr)
+            self.specials += MultiReg(csr.storage, in_offset[j], "pixel")
+        for i in range(3):
+            csr = CSRStorage(9, name="out_offset{}".format(i))
+            setattr(self, "out_offset{}".format(i), csr)
+            self.specials += MultiReg(csr.storage, out_offset[i], "pixel")
+
+        # Advance while the output is free or being taken
+        ce = Signal()
+        valid = Signal(3)
+        first = Signal(3)
+        last = Signal(3)
+        self.comb += [
+            ce.eq(~source.valid | source.ready),
+            sink.ready.eq(ce),
+            source.valid.eq(valid[2]),
+            source.first.eq(first[2]),
+            source.last.eq(last[2]),
+        ]
+        self.sync.pixel += If(ce,
+            valid.eq(Cat(sink.valid, valid[:2])),
+            first.eq(Cat(sink.first, first[:2])),
+            last.eq(Cat(sink.last, last[:2])),
+        )
+
+        half = Signal(CSC_FRAC)
+        self.comb += half.eq(Mux(rnd, 1 << (CSC_FRAC - 1), 0))
+
+        for p in range(ppc):
+            x = [Signal((10, True)) for j in range(3)]
+            product = [[Signal((28, True)) for j in range(3)] for i in range(3)]
+            total = [Signal((31, True)) for i in range(3)]
+            self.comb += [x[j].eq(sink.data[24*p + 8*j:24*p + 8*(j + 1)] + in_offset[j]) for j in range(3)]
+            self.sync.pixel += If(ce,
+                # Stage 1: 18x18 multiplies
+                [product[i][j].eq(coef[i][j] * x[j]) for i in range(3) for j in range(3)],
+                # Stage 2: sum, offset and round
+                [total[i].eq(product[i][0] + product[i][1] + product[i][2] + (out_offset[i] << CSC_FRAC) + half) for i in range(3)],
+                # Stage 3: clamp
+                [source.data[24*p + 8*i:24*p + 8*(i + 1)].eq(
+                    Mux(total[i] < 0, 0, Mux(total[i] >= (256 << CSC_FRAC), 255, total[i][CSC_FRAC:CSC_FRAC + 8]))) for i in range(3)],
+            )
+
+
+## Unit tests
+
+class TestColourMatrix(unittest.TestCase):
+
+    def reference(self, preset, y, cb, cr, rnd):
+        coefs, offsets = CSC_PRESETS[preset]
+        out = []
+        for row in coefs:
+            t = sum(c*(v + o) for c, v, o in zip(row, [y, cb, cr], offsets))
+            t = (t + ((1 << (CSC_FRAC - 1)) if rnd else 0)) >> CSC_FRAC
+            out.append(min(max(t, 0), 255))
+        return out[0] | (out[1] << 8) | (out[2] << 16)
+
+    def test_convert(self):
+        pixels = [(0, 128, 128), (255, 128, 128), (81, 90, 240), (145, 54, 34), (41, 240, 110), (16, 16, 240), (200, 10, 200)]
+
+        def generator(dut, preset, rnd):
+            coefs, offsets = CSC_PRESETS[preset]
+            for i in range(3):
+                for j in range(3):
+                    yield getattr(dut, "coef{}{}".format(i, j)).storage.eq(coefs[i][j] & 0x3FFFF)
+                yield getattr(dut, "in_offset{}".format(i)).storage.eq(offsets[i] & 0x1FF)
+            yield dut.round.storage.eq(rnd)
+            for _ in range(4):
+                yield
+            for y, cb, cr in pixels:
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(y | (cb << 8) | (cr << 16))
+                yield
+                while not (yield dut.sink.ready):
+                    yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver(dut, results):
+            # Stall once, part way through
+            for n in range(30):
+                yield dut.source.ready.eq(n != 12)
+                yield
+                if (yield dut.source.valid) & (yield dut.source.ready):
+                    results.append((yield dut.source.data))
+
+        for preset, rnd in [("bt601_full", 1), ("bt709_limited", 1), ("bt601_full", 0)]:
+            results = []
+            dut = ColourMatrix()
+            run_simulation(dut, {"pixel": [generator(dut, preset, rnd), receiver(dut, results)]}, clocks={"pixel": 10, "sys": 10})
+            self.assertEqual(results, [self.reference(preset, *p, rnd) for p in pixels])
+
+        # Rounded BT.601 full range is within half a count of floating point
+        for (y, cb, cr), rgb in zip(pixels, [self.reference("bt601_full", *p, 1) for p in pixels]):
+            r = y + 1.402*(cr - 128)
+            b = y + 1.772*(cb - 128)
+            self.assertLessEqual(abs((rgb & 0xFF) - min(max(r, 0), 255)), 0.5 + 1e-3)
+            self.assertLessEqual(abs((rgb >> 16) - min(max(b, 0), 255)), 0.5 + 1e-3)
@@ -0,0 +1,576 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import unittest
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect.stream import Endpoint
+from litex.soc.interconnect.csr import AutoCSR, CSRStatus, CSRStorage
+
+from histogram import Histogram
+
+class Divider(Module):
+    """Sequential unsigned divider, `dividend` and `divisor` are taken on `start`. `quotient` is valid once
+       `done` is set, `width` clocks later."""
+    def __init__(self, width=32):
+        self.start = Signal()
+        self.dividend = Signal(width)
+        self.divisor = Signal(width)
+        self.quotient = Signal(width)
+        self.done = Signal(reset=1)
+
+        # # #
+
+        divisor = Signal(width)
+        remainder = Signal(width + 1)
+        count = Signal(max=width + 1)
+        trial = Signal(width + 1)
+        self.comb += trial.eq(Cat(self.quotient[-1], remainder[:width]) - divisor)
+
+        self.sync += [
+            If(self.start,
+                divisor.eq(self.divisor),
+                self.quotient.eq(self.dividend),
+                remainder.eq(0),
+                count.eq(width),
+                self.done.eq(0),
+            ).Elif(~self.done,
+                # Shift the next dividend bit into the remainder, keep the difference if it fits
+                If(trial[width],
+                    remainder.eq(Cat(self.quotient[-1], remainder[:width])),
+                    self.quotient.eq(Cat(0, self.quotient[:-1])),
+                ).Else(
+                    remainder.eq(trial),
+                    self.quotient.eq(Cat(1, self.quotient[:-1])),
+                ),
+                count.eq(count - 1),
+                If(count == 1,
+                    self.done.eq(1)
+                )
+            )
+        ]
+
+class Multiplier(Module):
+    """Sequential unsigned multiplier, `a` and `b` are taken on `start`. `product` is valid once `done`
+       is set, a clock for each bit of `a` up to its highest set bit, at most `width` clocks later."""
+    def __init__(self, width=32, b_width=32):
+        self.start = Signal()
+        self.a = Signal(width)
+        self.b = Signal(b_width)
+        self.product = Signal(width + b_width)
+        self.done = Signal(reset=1)
+
+        # # #
+
+        a = Signal(width)
+        b = Signal(width + b_width)
+
+        self.sync += [
+            If(self.start,
+                a.eq(self.a),
+                b.eq(self.b),
+                self.product.eq(0),
+                self.done.eq(0),
+            ).Elif(~self.done,
+                # Add in b at each set bit of a
+                If(a[0],
+                    self.product.eq(self.product + b)
+                ),
+                a.eq(a[1:]),
+                b.eq(b << 1),
+                If(a[1:] == 0,
+                    self.done.eq(1)
+                )
+            )
+        ]
+
+class AGC(Module, AutoCSR):
+    """Automatic contrast on the luminance of a `pixel` domain stream, from the statistics of `histogram`,
+       which the AGC feeds. With 2**bits bins in `histogram` the LUT has 2**bits entries: the luminance in
+       data[0:8] indexes it in steps of 2**(bits - 8), or with `raw` set, the 14 bit raw value in data[0:14]
+       indexes it through a window over the range of the frame before, 2**bits levels from its minimum.
+       After each frame the low/high clip points are found at the `low`/`high` fractions (in 1/1024) of the
+       frame's pixels, and a LUT is built in the background: a linear stretch between the clip points, or
+       with `equalize` set, histogram equalization. The LUT is double buffered, the new one replaces the
+       old at the end of the frame it was built in, along with the window it was counted in, so a frame
+       is mapped through one LUT. Disabled, the luminance passes through, raw values as the top 8 bits of
+       their window. Raw pixels come out with neutral chroma. Latency is one clock."""
+    def __init__(self, histogram):
+        self.sink = sink = Endpoint([("data", 24)])
+        self.source = source = Endpoint([("data", 24)])
+        self.raw = Signal()
+
+        bits = len(histogram.scan_adr)
+
+        self.enable = CSRStorage()
+        self.equalize = CSRStorage()
+        self.low = CSRStorage(11, reset=10)
+        self.high = CSRStorage(11, reset=1014)
+        self.clip_low = CSRStatus(bits)
+        self.clip_high = CSRStatus(bits)
+
+        # # #
+
+        count_width = len(histogram.total)
+        top = 2**bits - 1
+
+        lut = Memory(width=8, depth=2*2**bits)
+        self.specials += lut
+        rdport = lut.get_port(clock_domain="pixel")
+        wrport = lut.get_port(write_capable=True, clock_domain="pixel")
+        self.specials += rdport, wrport
+
+        enable = Signal()
+        equalize = Signal()
+        low = Signal(11)
+        high = Signal(11)
+        self.specials += [
+            MultiReg(self.enable.storage, enable, "pixel"),
+            MultiReg(self.equalize.storage, equalize, "pixel"),
+            MultiReg(self.low.storage, low, "pixel"),
+            MultiReg(self.high.storage, high, "pixel"),
+        ]
+
+        # Raw windows: `win` for the frame being counted, `built` for the LUT being built and `cur` for
+        # the LUT in use, each a base and a shift
+        value = sink.data[0:14]
+        win = [Signal(14), Signal(max=15 - bits)]
+        built = [Signal(14), Signal(max=15 - bits)]
+        cur = [Signal(14), Signal(max=15 - bits)]
+
+        def index(window):
+            diff = Signal((15, True))
+            level = Signal(14)
+            adr = Signal(bits)
+            self.comb += [
+                diff.eq(value - window[0]),
+                level.eq(Mux(diff < 0, 0, diff[:14]) >> window[1]),
+                adr.eq(Mux(self.raw, Mux(level > top, top, level), sink.data[0:8] << (bits - 8))),
+            ]
+            return adr
+
+        # Range of the raw values in this frame, the next window covers it in the fewest shifts
+        raw_min = Signal(14, reset=2**14 - 1)
+        raw_max = Signal(14)
+        raw_span = Signal(14)
+        shift = Signal(max=15 - bits)
+        self.comb += raw_span.eq(Mux(raw_max > raw_min, raw_max - raw_min, 0))
+        for n in range(1, 15 - bits):
+            self.comb += If(raw_span[bits + n - 1:] != 0, shift.eq(n))
+        self.sync.pixel += [
+            If(histogram.done,
+                built[0].eq(win[0]),
+                built[1].eq(win[1]),
+                win[0].eq(Mux(raw_max > raw_min, raw_min, 0)),
+                win[1].eq(shift),
+                raw_min.eq(2**14 - 1),
+                raw_max.eq(0),
+            ).Elif(sink.valid & self.raw,
+                If(value < raw_min,
+                    raw_min.eq(value),
+                ),
+                If(value > raw_max,
+                    raw_max.eq(value),
+                ),
+            )
+        ]
+
+        # Count the frame, apply the LUT
+        bank = Signal()
+        i_lut = index(cur)
+        data = Signal(24)
+        preview = Signal(8)
+        raw = Signal()
+        self.comb += [
+            sink.ready.eq(1),
+            histogram.sink.valid.eq(sink.valid),
+            histogram.sink.data.eq(index(win)),
+            rdport.adr.eq(Cat(i_lut, bank)),
+            source.data.eq(Cat(Mux(enable, rdport.dat_r, Mux(raw, preview, data[0:8])),
+                Mux(raw, C(0x8080, 16), data[8:24]))),
+        ]
+        self.sync.pixel += [
+            data.eq(sink.data),
+            preview.eq(i_lut[bits - 8:]),
+            raw.eq(self.raw),
+            source.valid.eq(sink.valid),
+            source.first.eq(sink.first),
+            source.last.eq(sink.last),
+        ]
+
+        # Build the next LUT, the multiplies take turns on one sequential multiplier
+        self.submodules.divider = divider = ClockDomainsRenamer("pixel")(Divider(32))
+        self.submodules.multiplier = multiplier = ClockDomainsRenamer("pixel")(Multiplier(count_width, 32))
+        self.submodules.fsm = fsm = ClockDomainsRenamer("pixel")(FSM(reset_state="IDLE"))
+
+        total = Signal(count_width)
+        low_thresh = Signal(count_width)
+        high_thresh = Signal(count_width)
+        scale = Signal(32)
+        i = Signal(bits)
+        cdf = Signal(count_width)
+        cdf_next = Signal(count_width)
+        clip_low = Signal(bits)
+        clip_high = Signal(bits)
+        found_low = Signal()
+        found_high = Signal()
+        offset = Signal((bits + 1, True))
+        stretched = Signal(count_width + 16)
+        span = Signal(bits)
+
+        self.comb += [
+            histogram.scan_adr.eq(i),
+            cdf_next.eq(cdf + histogram.scan_dat),
+            offset.eq(i - clip_low),
+            span.eq(Mux(clip_high > clip_low, clip_high - clip_low, 1)),
+            stretched.eq(multiplier.product >> 16),
+        ]
+
+        fsm.act("IDLE",
+            If(histogram.done,
+                NextValue(total, histogram.total),
+                NextState("LOW"),
+            )
+        )
+        fsm.act("LOW",
+            multiplier.start.eq(1),
+            multiplier.a.eq(low),
+            multiplier.b.eq(total),
+            NextState("LOW_WAIT"),
+        )
+        fsm.act("LOW_WAIT",
+            If(multiplier.done,
+                NextValue(low_thresh, multiplier.product >> 10),
+                multiplier.start.eq(1),
+                multiplier.a.eq(high),
+                multiplier.b.eq(total),
+                NextState("HIGH_WAIT"),
+            )
+        )
+        fsm.act("HIGH_WAIT",
+            If(multiplier.done,
+                NextValue(high_thresh, multiplier.product >> 10),
+                divider.start.eq(1),
+                divider.dividend.eq(255 << 24),
+                divider.divisor.eq(Mux(total == 0, 1, total)),
+                NextValue(i, 0),
+                NextValue(cdf, 0),
+                NextValue(found_low, 0),
+                NextValue(found_high, 0),
+                NextValue(clip_low, 0),
+                NextValue(clip_high, top),
+                NextState("SCALE"),
+            )
+        )
+        fsm.act("SCALE",
+            If(divider.done,
+                NextValue(scale, divider.quotient),
+                NextState("SCAN"),
+            )
+        )
+
+        next_bin = [
+            NextValue(i, i + 1),
+            If(i == top,
+                If(equalize,
+                    NextState("SWAP")
+                ).Else(
+                    NextState("GAIN")
+                )
+            ).Else(
+                NextState("SCAN")
+            )
+        ]
+        # Bin i arrives a clock after it was requested
+        fsm.act("SCAN",
+            NextState("BIN"),
+        )
+        fsm.act("BIN",
+            NextValue(cdf, cdf_next),
+            If(~found_low & (cdf_next > low_thresh),
+                NextValue(found_low, 1),
+                NextValue(clip_low, i),
+            ),
+            If(~found_high & (cdf_next >= high_thresh),
+                NextValue(found_high, 1),
+                NextValue(clip_high, i),
+            ),
+            If(equalize,
+                multiplier.start.eq(1),
+                multiplier.a.eq(cdf_next),
+                multiplier.b.eq(scale),
+                NextState("EQUALIZE"),
+            ).Else(
+                next_bin
+            )
+        )
+        # Histogram equalization, cdf*255/total
+        fsm.act("EQUALIZE",
+            If(multiplier.done,
+                wrport.adr.eq(Cat(i, ~bank)),
+                wrport.dat_w.eq(multiplier.product >> 24),
+                wrport.we.eq(1),
+                next_bin
+            )
+        )
+        fsm.act("GAIN",
+            divider.start.eq(1),
+            # Rounded up, so clip_high lands on 255
+            divider.dividend.eq((255 << 16) + span - 1),
+            divider.divisor.eq(span),
+            NextValue(i, 0),
+            NextState("GAIN_WAIT"),
+        )
+        fsm.act("GAIN_WAIT",
+            If(divider.done,
+                NextValue(scale, divider.quotient),
+                NextState("STRETCH"),
+            )
+        )
+        # Entries at or below clip_low are 0
+        fsm.act("STRETCH",
+            If(offset > 0,
+                multiplier.start.eq(1),
+                multiplier.a.eq(offset),
+                multiplier.b.eq(scale),
+                NextState("STRETCH_WAIT"),
+            ).Else(
+                wrport.adr.eq(Cat(i, ~bank)),
+                wrport.dat_w.eq(0),
+                wrport.we.eq(1),
+                NextValue(i, i + 1),
+                If(i == top,
+                    NextState("SWAP")
+                )
+            )
+        )
+        fsm.act("STRETCH_WAIT",
+            If(multiplier.done,
+                wrport.adr.eq(Cat(i, ~bank)),
+                wrport.dat_w.eq(Mux(stretched > 255, 255, stretched)),
+                wrport.we.eq(1),
+                NextValue(i, i + 1),
+                If(i == top,
+                    NextState("SWAP")
+                ).Else(
+                    NextState("STRETCH")
+                )
+            )
+        )
+        # Between frames, and the frame just ended starts the next LUT
+        fsm.act("SWAP",
+            If(histogram.done,
+                NextValue(bank, ~bank),
+                NextValue(cur[0], built[0]),
+                NextValue(cur[1], built[1]),
+                NextValue(total, histogram.total),
+                NextState("LOW"),
+            )
+        )
+
+        self.specials += [
+            MultiReg(clip_low, self.clip_low.status),
+            MultiReg(clip_high, self.clip_high.status),
+        ]
+
+
+## Unit tests
+
+class TestAGC(unittest.TestCase):
+
+    def test_divider(self):
+        results = []
+
+        def generator(dut):
+            for a, b in [(255 << 24, 327680), (1000, 7), (5, 9)]:
+                yield dut.dividend.eq(a)
+                yield dut.divisor.eq(b)
+                yield dut.start.eq(1)
+                yield
+                yield dut.divisor.eq(0)
+                yield dut.start.eq(0)
+                yield
+                while not (yield dut.done):
+                    yield
+                results.append((yield dut.quotient))
+
+        dut = Divider(32)
+        run_simulation(dut, generator(dut))
+        self.assertEqual(results, [(255 << 24) // 327680, 1000 // 7, 0])
+
+    def test_multiplier(self):
+        cases = [(327680, 1014), (0, 12345), (1, 2**32 - 1), (2**20 - 1, 2**32 - 1), (300, 55894)]
+        results = []
+
+        def generator(dut):
+            for a, b in cases:
+                yield dut.a.eq(a)
+                yield dut.b.eq(b)
+                yield dut.start.eq(1)
+                yield
+                yield dut.a.eq(0)
+                yield dut.start.eq(0)
+                yield
+                while not (yield dut.done):
+                    yield
+                results.append((yield dut.product))
+
+        dut = Multiplier(20, 32)
+        run_simulation(dut, generator(dut))
+        self.assertEqual(results, [a * b for a, b in cases])
+
+    def vsync(self, dut):
+        yield dut.histogram.vsync.eq(1)
+        yield
+        yield dut.histogram.vsync.eq(0)
+        # Until the swap has landed
+        for _ in range(4):
+            yield
+
+    def wait_built(self, dut):
+        # Until the LUT for the frame just ended waits for the next frame
+        for _ in range(8):
+            yield
+        while not (yield dut.built):
+            yield
+
+    def stretch(self, equalize):
+        lut = {}
+
+        class DUT(Module):
+            def __init__(self):
+                self.submodules.histogram = Histogram()
+                self.submodules.agc = AGC(self.histogram)
+                self.built = self.agc.fsm.ongoing("SWAP")
+
+        def pixel(dut):
+            yield dut.agc.enable.storage.eq(1)
+            yield dut.agc.equalize.storage.eq(equalize)
+            yield dut.agc.low.storage.eq(0)
+            yield dut.agc.high.storage.eq(1024)
+            # Let the LUT for the empty frame before finish
+            yield from self.vsync(dut)
+            yield from self.wait_built(dut)
+            # A frame spread evenly over 64-191, its LUT is used from the frame after the next
+            for v in range(64, 192):
+                yield dut.agc.sink.valid.eq(1)
+                yield dut.agc.sink.data.eq(v)
+                yield
+            yield dut.agc.sink.valid.eq(0)
+            yield from self.vsync(dut)
+            yield from self.wait_built(dut)
+            yield from self.vsync(dut)
+            values = [0, 64, 128, 191, 255]
+            for v in values + [0]:
+                yield dut.agc.sink.valid.eq(1)
+                yield dut.agc.sink.data.eq(0x808000 | v)
+                yield
+                # Outputs lag the inputs set before the last clock by one clock
+                if (yield dut.agc.source.valid):
+                    lut[values[len(lut)]] = (yield dut.agc.source.data)
+
+        dut = DUT()
+        run_simulation(dut, {"pixel": pixel(dut)}, clocks={"pixel": 10, "sys": 10})
+        return lut
+
+    def test_stretch(self):
+        # 64-191 stretched over 0-255, chroma untouched
+        lut = self.stretch(equalize=0)
+        self.assertEqual(lut, {0: 0x808000, 64: 0x808000, 128: 0x808080, 191: 0x8080FF, 255: 0x8080FF})
+
+    def test_equalize(self):
+        # cdf*255/total, a pixel per level
+        lut = self.stretch(equalize=1)
+        scale = (255 << 24) // 128
+        self.assertEqual(lut, {v: 0x808000 | (min(max(v - 63, 0), 128) * scale) >> 24 for v in [0, 64, 128, 191, 255]})
+
+    def test_raw(self):
+        lut = {}
+
+        class DUT(Module):
+            def __init__(self):
+                self.submodules.histogram = Histogram(bits=10)
+                self.submodules.agc = AGC(self.histogram)
+                self.built = self.agc.fsm.ongoing("SWAP")
+
+        def frame(dut, values):
+            for v in values:
+                yield dut.agc.sink.valid.eq(1)
+                yield dut.agc.sink.data.eq(v)
+                yield
+            yield dut.agc.sink.valid.eq(0)
+            yield from self.vsync(dut)
+            yield from self.wait_built(dut)
+
+        def pixel(dut):
+            yield dut.agc.raw.eq(1)
+            yield dut.agc.enable.storage.eq(1)
+            yield dut.agc.low.storage.eq(0)
+            yield dut.agc.high.storage.eq(1024)
+            # A narrow scene, 300 raw levels above 5000: the first frame sets the window, the second
+            # is counted in it
+            yield from frame(dut, [])
+            for _ in range(2):
+                yield from frame(dut, range(5000, 5300))
+            self.assertEqual((yield dut.agc.clip_low.status), 0)
+            self.assertEqual((yield dut.agc.clip_high.status), 299)
+            yield from self.vsync(dut)
+            values = [4000, 5000, 5150, 5299, 9000]
+            for v in values + [0]:
+                yield dut.agc.sink.valid.eq(1)
+                yield dut.agc.sink.data.eq(v)
+                yield
+                if (yield dut.agc.source.valid):
+                    lut[values[len(lut)]] = (yield dut.agc.source.data)
+
+        dut = DUT()
+        run_simulation(dut, {"pixel": pixel(dut)}, clocks={"pixel": 10, "sys": 10})
+
+        # Every raw level of the scene kept, stretched over 0-255 with neutral chroma
+        self.assertEqual(lut, {4000: 0x808000, 5000: 0x808000, 5150: 0x80807F, 5299: 0x8080FF, 9000: 0x8080FF})
+
+    def test_frame_boundary(self):
+        outputs = []
+        after = []
+
+        class DUT(Module):
+            def __init__(self):
+                self.submodules.histogram = Histogram()
+                self.submodules.agc = AGC(self.histogram)
+                self.built = self.agc.fsm.ongoing("SWAP")
+
+        def pixel(dut):
+            yield dut.agc.enable.storage.eq(1)
+            yield dut.agc.low.storage.eq(0)
+            yield dut.agc.high.storage.eq(1024)
+            yield from self.vsync(dut)
+            yield from self.wait_built(dut)
+            for v in range(64, 192):
+                yield dut.agc.sink.valid.eq(1)
+                yield dut.agc.sink.data.eq(v)
+                yield
+            yield dut.agc.sink.valid.eq(0)
+            yield from self.vsync(dut)
+            # The LUT of the frame above is built while this frame streams, and not used in it
+            yield dut.agc.sink.valid.eq(1)
+            yield dut.agc.sink.data.eq(0x808080)
+            for n in range(3000):
+                yield
+                if n > 0:
+                    outputs.append((yield dut.agc.source.data))
+            self.assertTrue((yield dut.built))
+            yield dut.agc.sink.valid.eq(0)
+            yield from self.vsync(dut)
+            yield dut.agc.sink.valid.eq(1)
+            yield
+            yield
+            after.append((yield dut.agc.source.data))
+
+        dut = DUT()
+        run_simulation(dut, {"pixel": pixel(dut)}, clocks={"pixel": 10, "sys": 10})
+
+        # The empty frame's LUT throughout, then 64-191 stretched over 0-255
+        self.assertEqual(set(outputs), {0x8080FF})
+        self.assertEqual(after, [0x808080])
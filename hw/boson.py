@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import sys
 import os
+import unittest
 
 from migen import *
 from migen.genlib.cdc import MultiReg
@@ -8,12 +9,15 @@ from migen.genlib.cdc import MultiReg
 from pycrc.algorithms import Crc
 
 from litex.soc.interconnect import stream
+from litex.soc.interconnect import wishbone
 from litex.soc.interconnect.stream import EndpointDescription
 
 
-from litex.soc.cores.uart import RS232PHYTX
+from litex.soc.cores.uart import RS232PHYTX, RS232PHYRX
 
 from ecp5_dynamic_pll import period_ns
+from chroma import ChromaUpsample, CHROMA_LINEAR
+from dsp import shift_add
 
 from struct import unpack, pack_into
 
@@ -84,7 +88,7 @@ def UINT_32ToByte(inVal, outBuff, outPtr):
 
 
 
-def flirFrame(seq, fnID, payload=[]):
+def flirPayload(seq, fnID, payload=[]):
     sendPayload = bytearray(len(payload)+12)
     pyldPtr = 0
     
@@ -105,6 +109,11 @@ def flirFrame(seq, fnID, payload=[]):
         sendPayload[pyldPtr] = byte
         pyldPtr += 1
 
+    return sendPayload
+
+
+def flirFrame(seq, fnID, payload=[]):
+    sendPayload = flirPayload(seq, fnID, payload)
 
     temppayload = bytearray([0x00])
     temppayload.extend(sendPayload)
@@ -132,206 +141,526 @@ def flirFrame(seq, fnID, payload=[]):
     #debugprint("sending " + str(len(packet)) + " bytes:" + " ".join(map(lambda b: format(b, "02x"), packet)))
     packet[0] = len(packet)
 
-    return Array(packet)
+    return bytes(packet)
 
 
 # Commands to be sent on powerup
-flirInitPackets = Array([
-    flirFrame(0, 0x0006000D, [0x00, 0x00, 0x00, 0x00]), # Set Display mode Continuous
-    #flirFrame(2, 0x00100000,[0x01, 0x00,0x00,0x00,0x01]), # set test pattern?
-    #flirFrame(3, 0x00000013, [0x00,0x00,0x00,0x00]), # enable test ramp
+flirInitPackets = [
+    flirPayload(0, 0x0006000D, [0x00, 0x00, 0x00, 0x00]), # Set Display mode Continuous
+    #flirPayload(2, 0x00100000,[0x01, 0x00,0x00,0x00,0x01]), # set test pattern?
+    #flirPayload(3, 0x00000013, [0x00,0x00,0x00,0x00]), # enable test ramp
 
-    flirFrame(12, 0x0006000F,[0x00,0x00,0x00,0x00]), # colour
+    flirPayload(12, 0x0006000F,[0x00,0x00,0x00,0x00]), # colour
 
-    flirFrame(19, 0x00060004,[0x00,0x00,0x00,0x00]), # Analog off
-    flirFrame(20, 0x00060006,[0x00,0x00,0x00,0x02]), # Output format = YCbCr
+    flirPayload(19, 0x00060004,[0x00,0x00,0x00,0x00]), # Analog off
+    flirPayload(20, 0x00060006,[0x00,0x00,0x00,0x02]), # Output format = YCbCr
     
-    flirFrame(40, 0x0006000A,[0x00,0x00,0x00,0x00, 0x00,0x00,0x00,0x00]), # RGB888
-    flirFrame(41, 0x00060008,[0x00,0x00,0x00,0x00, 0x00,0x00,0x00,0x00, 0x00,0x00,0x00,0x00]), # YCBCR Muxed
+    flirPayload(40, 0x0006000A,[0x00,0x00,0x00,0x00, 0x00,0x00,0x00,0x00]), # RGB888
+    flirPayload(41, 0x00060008,[0x00,0x00,0x00,0x00, 0x00,0x00,0x00,0x00, 0x00,0x00,0x00,0x00]), # YCBCR Muxed
     
-    flirFrame(50, 0x0006000C), # Apply Settings
+    flirPayload(50, 0x0006000C), # Apply Settings
     
-    flirFrame(90, 0x000B0003,[0x00,0x00,0x00,0x00]), # LUT select Rainbow
-    flirFrame(91, 0x000B0001,[0x00,0x00,0x00,0x01]), # Enable Colouriser
+    flirPayload(90, 0x000B0003,[0x00,0x00,0x00,0x00]), # LUT select Rainbow
+    flirPayload(91, 0x000B0001,[0x00,0x00,0x00,0x00]), # Disable Colouriser, the Palette LUT colours the luminance
     
-    flirFrame(100, 0x0006000F,[0x00,0x00,0x00,0x02]), # colour
-    flirFrame(110, 0x0000000B,[0x00,0x00,0x00,0x00]), # Averager: disable (60Hz)
+    flirPayload(100, 0x0006000F,[0x00,0x00,0x00,0x02]), # colour
+    flirPayload(110, 0x0000000B,[0x00,0x00,0x00,0x00]), # Averager: disable (60Hz)
 
 
-    flirFrame(120, 0x00050007), # FFC
+    flirPayload(120, 0x00050007), # FFC
 
     
 
 
 #    [0x00, 0x06, 0x00, 0x0D, 0x00, 0x00, 0x00, 0x00],
 
-])
+]
 
 
-flirLUTPackets = Array([
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x00]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x01]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x02]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x03]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x04]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x05]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x06]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x07]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x08]), # LUT select Rainbow
-    flirFrame(100, 0x000B0003,[0x00,0x00,0x00,0x09]), # LUT select Rainbow
-])
+# Output format, sent when the capture mode changes. YCbCr: colour through the Boson's AGC and colouriser,
+# raw: 16 bit pre-AGC values (14 significant bits) on data[0:16], one pixel per clock
+flirModePackets = [
+    flirPayload(130, 0x00060006,[0x00,0x00,0x00,0x02]), # Output format = YCbCr
+    flirPayload(131, 0x0006000F,[0x00,0x00,0x00,0x02]), # colour
+    flirPayload(132, 0x0006000C), # Apply Settings
 
+    flirPayload(140, 0x00060006,[0x00,0x00,0x00,0x03]), # Output format = IR16
+    flirPayload(141, 0x0006000F,[0x00,0x00,0x00,0x00]), # mono 16 bit
+    flirPayload(142, 0x0006000C), # Apply Settings
+]
 
-class BosonConfig(Module):
-    def __init__(self, pads, clk_freq):
-        baudrate=921600
-        tuning_word = int((baudrate/clk_freq)*2**32)
 
-        self.button = button = Signal()
-        self.submodules.tx = tx = RS232PHYTX(pads, tuning_word)
-        #self.sink = self.tx.sink
+flirLUTPackets = [
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x00]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x01]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x02]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x03]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x04]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x05]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x06]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x07]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x08]), # LUT select Rainbow
+    flirPayload(100, 0x000B0003,[0x00,0x00,0x00,0x09]), # LUT select Rainbow
+]
 
-        self.submodules.fsm = fsm = FSM(reset_state="STARTUP")
 
-        fsmCounter = Signal(max=int((clk_freq)*60), reset=int((clk_freq)*(300e-3)))
-        currentPacket = Signal(max=12, reset=0)
-        currentByte = Signal(max=64, reset=1)
+# Packets preloaded into the command store, as records of a length byte and the unframed payload. The
+# CPU can place its own packets from COMMAND_USER onwards.
+COMMAND_STORE = 2048
+COMMAND_USER = 1024
+
+def flirStore():
+    store = []
+    offsets = {}
+    for name, packets in [("init", flirInitPackets), ("mode", flirModePackets), ("lut", flirLUTPackets)]:
+        offsets[name] = len(store)
+        for p in packets:
+            store += [len(p)] + list(p)
+    assert len(store) <= COMMAND_USER
+    return store, offsets
+
+
+class BosonCommand(Module, AutoCSR):
+    """Sends packets from a BRAM command store to the Boson and parses its replies. The store is on `bus`,
+       a byte per word, with the last reply at COMMAND_STORE onwards. Packets are framed in gateware: start
+       and end bytes, escaping and the CRC-16/CCITT. Writing `send` transmits `count` records from `address`.
+       After each packet the engine waits for a reply, or `timeout` seconds, before the next. The init
+       packets go out `startup` seconds after reset; changes to `raw` and pulses on `next_lut` send the
+       preloaded mode and LUT packets."""
+    def __init__(self, clk_freq, startup=4, timeout=500e-3):
+        self.bus = bus = wishbone.Interface(data_width=32)
+        self.source = source = stream.Endpoint([("data", 8)])
+        self.sink = sink = stream.Endpoint([("data", 8)])
+        self.raw = Signal()
+        self.next_lut = Signal()
+
+        self.address = CSRStorage(11, reset=COMMAND_USER)
+        self.count = CSRStorage(8, reset=1)
+        self.send = CSR()
+        self.busy = CSRStatus()
+
+        self.replies = CSRStatus(32)
+        self.crc_errors = CSRStatus(32)
+        self.reply_seq = CSRStatus(32)
+        self.reply_function = CSRStatus(32)
+        self.reply_status = CSRStatus(32)
+        self.reply_length = CSRStatus(8)
+
+        # # #
+
+        init, offsets = flirStore()
+        store = Memory(8, COMMAND_STORE, init=init)
+        reply = Memory(8, 256)
+        crc_table = Memory(16, 256, init=ccitt_16Table)
+        self.specials += store, reply, crc_table
+        busport = store.get_port(write_capable=True)
+        rdport = store.get_port()
+        reply_busport = reply.get_port()
+        reply_wrport = reply.get_port(write_capable=True)
+        tx_crc = crc_table.get_port()
+        rx_crc = crc_table.get_port()
+        self.specials += busport, rdport, reply_busport, reply_wrport, tx_crc, rx_crc
 
+        self.comb += [
+            busport.adr.eq(bus.adr[:11]),
+            busport.dat_w.eq(bus.dat_w),
+            busport.we.eq(bus.cyc & bus.stb & bus.we & ~bus.ack & ~bus.adr[11]),
+            reply_busport.adr.eq(bus.adr[:8]),
+            bus.dat_r.eq(Mux(bus.adr[11], reply_busport.dat_r, busport.dat_r)),
+        ]
+        self.sync += [
+            bus.ack.eq(0),
+            If(bus.cyc & bus.stb & ~bus.ack, bus.ack.eq(1))
+        ]
 
-        fsm.act("STARTUP",
-            NextValue(fsmCounter, int((clk_freq)*(4))),
-            NextState("WAIT"),
-        )
+        # Transmit
+        ptr = Signal(11)
+        remaining = Signal(8)
+        length = Signal(8)
+        byte = Signal(8)
+        crc = Signal(16)
+        stage = Signal(2)
+        timer = Signal(max=int(clk_freq*max(startup, timeout)) + 1, reset=int(clk_freq*startup))
+        send_pending = Signal()
+        take_send = Signal()
+        init_pending = Signal(reset=1)
+        raw_applied = Signal()
+        lut_pending = Signal()
+        take_lut = Signal()
+        lut = Signal(max=len(flirLUTPackets))
+        reply_done = Signal()
+
+        lut_stride = len(flirLUTPackets[0]) + 1
+        assert all(len(p) + 1 == lut_stride for p in flirLUTPackets)
+        mode_offsets = []
+        offset = offsets["mode"]
+        for p in flirModePackets:
+            mode_offsets.append(offset)
+            offset += len(p) + 1
 
-        fsm.act("WAIT",
-            NextValue(fsmCounter, fsmCounter - 1),
-            If(fsmCounter == 0,
-                NextState("XMIT"),
-                NextValue(fsmCounter, 0)
+        self.sync += [
+            If(self.send.re,
+                send_pending.eq(1)
+            ).Elif(take_send,
+                send_pending.eq(0)
             ),
-        )
+            If(self.next_lut,
+                lut_pending.eq(1)
+            ).Elif(take_lut,
+                lut_pending.eq(0)
+            ),
+        ]
 
+        self.submodules.fsm = fsm = FSM(reset_state="STARTUP")
+        self.comb += self.busy.status.eq(~fsm.ongoing("IDLE") | send_pending)
 
-        fsm.act("XMIT",
-            If(currentByte >= (flirInitPackets[currentPacket][0]),
-                If(currentPacket >= (len(flirInitPackets) - 1),
-                    NextValue(currentPacket,0),
-                    NextState("DONE"),
-                ).Else(
-                    NextValue(currentPacket, currentPacket + 1),
-                    NextValue(fsmCounter, int((clk_freq)*(500e-3))),
-                    NextState("WAIT"),
-                ),
-                NextValue(currentByte, 1),
+        fsm.act("STARTUP",
+            NextValue(timer, timer - 1),
+            If(timer == 0,
+                NextState("IDLE")
+            )
+        )
+        fsm.act("IDLE",
+            If(send_pending,
+                take_send.eq(1),
+                NextValue(ptr, self.address.storage),
+                NextValue(remaining, self.count.storage),
+                NextState("RECORD"),
+            ).Elif(init_pending,
+                NextValue(init_pending, 0),
+                NextValue(ptr, offsets["init"]),
+                NextValue(remaining, len(flirInitPackets)),
+                NextState("RECORD"),
+            ).Elif(self.raw != raw_applied,
+                # YCbCr packets first, then raw
+                NextValue(raw_applied, self.raw),
+                NextValue(ptr, Mux(self.raw, mode_offsets[3], mode_offsets[0])),
+                NextValue(remaining, 3),
+                NextState("RECORD"),
+            ).Elif(lut_pending,
+                take_lut.eq(1),
+                NextValue(ptr, offsets["lut"] + shift_add(lut, lut_stride)),
+                NextValue(remaining, 1),
+                NextValue(lut, Mux(lut == len(flirLUTPackets) - 1, 0, lut + 1)),
+                NextState("RECORD"),
+            )
+        )
+        fsm.act("RECORD",
+            rdport.adr.eq(ptr),
+            If(remaining == 0,
+                NextState("IDLE")
             ).Else(
-                tx.sink.data.eq(flirInitPackets[currentPacket][currentByte]),
-                tx.sink.valid.eq(1),
-                If(tx.sink.ready,
-                    NextValue(currentByte, currentByte + 1)
-                )
+                NextState("LENGTH")
             )
-        ) 
-
-        fsm.act("DONE",
-            # done
-            If(button & (fsmCounter == 0), 
-                NextState("BUTTON")
-            ),
-
-            If(fsmCounter > 0,
-                NextValue(fsmCounter, fsmCounter - 1)
+        )
+        fsm.act("LENGTH",
+            NextValue(length, rdport.dat_r),
+            NextValue(ptr, ptr + 1),
+            NextValue(crc, 0x1d0f),
+            NextValue(stage, 0),
+            # Channel
+            NextValue(byte, 0x00),
+            NextState("START"),
+        )
+        fsm.act("START",
+            source.valid.eq(1),
+            source.data.eq(0x8E),
+            If(source.ready,
+                NextState("CRC")
             )
         )
-
-        fsm.act("HOLD",
-            # done
-            If(~button, 
-                NextState("DONE"),
-                NextValue(fsmCounter, int((clk_freq)*(25e-3))),
-            ),            
+        fsm.act("CRC",
+            tx_crc.adr.eq(crc[8:16] ^ byte),
+            NextState("CRC_UPDATE"),
         )
-
-        fsm.act("BUTTON",
-            If(currentByte >= (flirLUTPackets[currentPacket][0]),
-                If(currentPacket >= (len(flirLUTPackets) - 1),
-                    NextValue(currentPacket,0),
-                    NextState("HOLD"),
-                ).Else(
-                    NextValue(currentPacket, currentPacket + 1),
-                    NextState("HOLD"),
-                ),
-                NextValue(currentByte, 1),
+        fsm.act("CRC_UPDATE",
+            NextValue(crc, Cat(C(0, 8), crc[0:8]) ^ tx_crc.dat_r),
+            NextState("ESCAPE"),
+        )
+        fsm.act("ESCAPE",
+            If((byte == 0x8E) | (byte == 0x9E) | (byte == 0xAE),
+                source.valid.eq(1),
+                source.data.eq(0x9E),
+                If(source.ready,
+                    NextValue(byte, byte - 0x0D),
+                    NextState("BYTE"),
+                )
             ).Else(
-                tx.sink.data.eq(flirLUTPackets[currentPacket][currentByte]),
-                tx.sink.valid.eq(1),
-                If(tx.sink.ready,
-                    NextValue(currentByte, currentByte + 1)
+                NextState("BYTE")
+            )
+        )
+        fsm.act("BYTE",
+            source.valid.eq(1),
+            source.data.eq(byte),
+            If(source.ready,
+                NextState("NEXT")
+            )
+        )
+        fsm.act("NEXT",
+            rdport.adr.eq(ptr),
+            If(stage == 0,
+                If(length != 0,
+                    NextState("LOAD")
+                ).Else(
+                    NextValue(stage, 1),
+                    NextValue(byte, crc[8:16]),
+                    NextState("ESCAPE"),
                 )
+            ).Elif(stage == 1,
+                NextValue(stage, 2),
+                NextValue(byte, crc[0:8]),
+                NextState("ESCAPE"),
+            ).Else(
+                NextState("END")
+            )
+        )
+        fsm.act("LOAD",
+            NextValue(byte, rdport.dat_r),
+            NextValue(ptr, ptr + 1),
+            NextValue(length, length - 1),
+            NextState("CRC"),
+        )
+        fsm.act("END",
+            source.valid.eq(1),
+            source.data.eq(0xAE),
+            If(source.ready,
+                NextValue(remaining, remaining - 1),
+                NextValue(timer, int(clk_freq*timeout)),
+                NextState("REPLY"),
+            )
+        )
+        fsm.act("REPLY",
+            NextValue(timer, timer - 1),
+            If(reply_done | (timer == 0),
+                NextState("RECORD")
             )
-        ) 
+        )
 
+        # Receive, replies are framed the same way: channel, sequence, function, status, data and CRC
+        in_frame = Signal()
+        escape = Signal()
+        index = Signal(8)
+        rx_byte = Signal(8)
+        rx = Signal()
+        rx_update = Signal()
+        rx_c = Signal(16)
+        seq = Signal(32)
+        function = Signal(32)
+        status = Signal(32)
+        replies = Signal(32)
+        crc_errors = Signal(32)
 
+        self.comb += [
+            sink.ready.eq(1),
+            rx.eq(sink.valid & in_frame & (sink.data != 0x8E) & (sink.data != 0x9E) & (sink.data != 0xAE)),
+            rx_byte.eq(Mux(escape, sink.data + 0x0D, sink.data)),
+            rx_crc.adr.eq(rx_c[8:16] ^ rx_byte),
+            reply_wrport.adr.eq(index),
+            reply_wrport.dat_w.eq(rx_byte),
+            reply_wrport.we.eq(rx),
+        ]
 
+        self.sync += [
+            reply_done.eq(0),
+            rx_update.eq(rx),
+            If(rx_update,
+                rx_c.eq(Cat(C(0, 8), rx_c[0:8]) ^ rx_crc.dat_r)
+            ),
+            If(sink.valid,
+                If(sink.data == 0x8E,
+                    in_frame.eq(1),
+                    escape.eq(0),
+                    index.eq(0),
+                    rx_c.eq(0x1d0f),
+                ).Elif(in_frame & (sink.data == 0xAE),
+                    in_frame.eq(0),
+                    reply_done.eq(1),
+                    # The CRC over the reply and its own CRC comes out as zero
+                    If(rx_c == 0,
+                        replies.eq(replies + 1),
+                        self.reply_seq.status.eq(seq),
+                        self.reply_function.status.eq(function),
+                        self.reply_status.status.eq(status),
+                        self.reply_length.status.eq(index),
+                    ).Else(
+                        crc_errors.eq(crc_errors + 1)
+                    )
+                ).Elif(in_frame & (sink.data == 0x9E),
+                    escape.eq(1)
+                ).Elif(in_frame,
+                    escape.eq(0),
+                    If(index != 255,
+                        index.eq(index + 1)
+                    ),
+                    If((index >= 1) & (index <= 4),
+                        seq.eq(Cat(rx_byte, seq[0:24]))
+                    ),
+                    If((index >= 5) & (index <= 8),
+                        function.eq(Cat(rx_byte, function[0:24]))
+                    ),
+                    If((index >= 9) & (index <= 12),
+                        status.eq(Cat(rx_byte, status[0:24]))
+                    ),
+                )
+            )
+        ]
 
+        self.comb += [
+            self.replies.status.eq(replies),
+            self.crc_errors.status.eq(crc_errors),
+        ]
 
 
 class boson_rx(Module):
     def __init__(self, pads):
         self.source = source = stream.Endpoint(EndpointDescription([("data", 24)]))
+        # Raw capture, two 16 bit pixels per word, the first in the low half
+        self.raw_source = raw_source = stream.Endpoint(EndpointDescription([("data", 32)]))
+        self.raw = Signal()
+        self.chroma_filter = Signal(2)
         
 
         vsync_ = Signal()
         vsync_falling = Signal()
 
-        data = Signal(24)
-        
-        luminance_delay = Signal(8)
-        
-        valid = Signal(2)
-
+        # 4:2:2 Y and muxed CbCr on data[0:16]
+        self.submodules.chroma = chroma = ChromaUpsample()
+        self.comb += [
+            chroma.sink.valid.eq(pads.valid),
+            chroma.sink.data.eq(pads.data[0:16]),
+            chroma.filter.eq(self.chroma_filter),
+        ]
 
-        pixel_counter = Signal(20)
+        # Capture mode, changes between frames
+        self.raw_active = raw = Signal()
+        raw_valid = Signal()
+        raw_pixel = Signal(16)
+        raw_low = Signal(16)
+        raw_half = Signal()
+
+        # Frame markers: `first` on the first pixel after vsync, `last` on the final pixel of each line,
+        # the frame's last pixel included. A line ends where valid drops after the pixel.
+        frame_first = Signal()
+        raw_first = Signal()
         
         self.sync += [
-            source.data.eq(data),
-            source.valid.eq(valid[1]),
+            If(raw,
+                # The 14 significant bits, for the AGC to window into luminance
+                source.data.eq(raw_pixel[0:14]),
+                source.valid.eq(raw_valid),
+                source.first.eq(raw_valid & frame_first),
+                source.last.eq(raw_valid & ~pads.valid),
+                If(raw_valid,
+                    frame_first.eq(0)
+                ),
+            ).Else(
+                source.data.eq(chroma.source.data),
+                source.valid.eq(chroma.source.valid),
+                source.first.eq(chroma.source.valid & frame_first),
+                source.last.eq(chroma.source.last),
+                If(chroma.source.valid,
+                    frame_first.eq(0)
+                ),
+            ),
+            If(vsync_falling,
+                frame_first.eq(1),
+            ),
+        ]
+
+        self.sync += [
+            raw_valid.eq(pads.valid),
+            raw_pixel.eq(pads.data[0:16]),
+            raw_source.valid.eq(0),
+            If(raw_valid,
+                raw_half.eq(~raw_half),
+                If(raw_half,
+                    raw_source.data.eq(Cat(raw_low, raw_pixel)),
+                    raw_source.valid.eq(raw),
+                    raw_source.first.eq(raw_first),
+                    raw_source.last.eq(~pads.valid),
+                    raw_first.eq(0),
+                ).Else(
+                    raw_low.eq(raw_pixel),
+                )
+            ),
+            If(vsync_falling,
+                raw.eq(self.raw),
+                raw_half.eq(0),
+                raw_first.eq(1),
+            ),
         ]
 
         self.comb += [
             vsync_falling.eq(~pads.vsync & vsync_),
         ]
 
+        self.sync += vsync_.eq(pads.vsync)
 
-        self.sync += [
-        #    source.data.eq(pads.data),
-        #    source.valid.eq(pads.valid)
-
-            luminance_delay.eq(pads.data[0:8]),
-            data[0:8].eq(luminance_delay),
-            If(~pixel_counter[0],        
-                 data[8:16].eq(pads.data[8:16]),
-            #    data[0:12].eq(pads.data[0:12]),
-            ).Else (
-                 data[16:24].eq(pads.data[8:16]),
-            #    data[12:24].eq(pads.data[0:12]),
-            ),
-            #pixel_en.eq(Cat(pads.valid, valid)
-            #data.eq(pads.data[0:15]),
-            
-            valid.eq(Cat(pads.valid, valid[0]))
+
+
+class SyncWatchdog(Module, AutoCSR):
+    """Checks the `pixel` domain frames from the Boson against the expected `width` and `height`. A line
+       of the wrong length or a frame with the wrong number of lines pulses `error`, once per frame, and
+       counts in `resyncs`. Checking starts after the first vsync."""
+    def __init__(self, vsync, valid):
+        self.error = Signal()
+
+        self.width = CSRStorage(16, reset=640)
+        self.height = CSRStorage(16, reset=512)
+        self.resyncs = CSRStatus(32)
+
+        # # #
+
+        width = Signal(16)
+        height = Signal(16)
+        self.specials += [
+            MultiReg(self.width.storage, width, "pixel"),
+            MultiReg(self.height.storage, height, "pixel"),
         ]
 
-        self.sync += [
-            vsync_.eq(pads.vsync),
+        x = Signal(16)
+        y = Signal(16)
+        valid_ = Signal()
+        vsync_ = Signal()
+        line_end = Signal()
+        frame_end = Signal()
+        started = Signal()
+        reported = Signal()
+        resyncs = Signal(32)
 
-            If(vsync_falling,
-                pixel_counter.eq(0),
-            ).Else(
-                pixel_counter.eq(pixel_counter + 1)
+        self.comb += [
+            line_end.eq(valid_ & ~valid),
+            frame_end.eq(vsync_ & ~vsync),
+        ]
+
+        self.sync.pixel += [
+            valid_.eq(valid),
+            vsync_.eq(vsync),
+            self.error.eq(0),
+
+            If(valid,
+                x.eq(x + 1)
+            ),
+            If(line_end,
+                x.eq(0),
+                y.eq(y + 1)
+            ),
+
+            If(started & ~reported & ((line_end & ((x != width) | (y >= height))) | (frame_end & (y != height))),
+                self.error.eq(1),
+                reported.eq(1),
+                resyncs.eq(resyncs + 1),
+            ),
+
+            If(frame_end,
+                started.eq(1),
+                reported.eq(0),
+                x.eq(0),
+                y.eq(0),
             ),
-           
         ]
 
+        self.specials += MultiReg(resyncs, self.resyncs.status)
 
 
 # Convert the Boson clock pin Signal into a clock domain
@@ -350,28 +679,177 @@ class Boson(Module, AutoCSR):
         self.submodules.clk = boson_clk(pads.clk, platform)
         self.submodules.rx = ClockDomainsRenamer("boson_rx")(boson_rx(pads))
         self.source = self.rx.source
+        self.raw_source = self.rx.raw_source
+        self.raw_active = self.rx.raw_active
+
+        # Pulses in the boson_rx domain when the capture has lost alignment, the pipeline should be
+        # flushed. It re-arms on the next frame.
+        self.submodules.watchdog = ClockDomainsRenamer({"pixel":"boson_rx"})(SyncWatchdog(pads.vsync, pads.valid))
+        self.resync = self.watchdog.error
         
         self.hsync = pads.hsync
         self.vsync = pads.vsync
         self.data_valid = pads.valid
 
         self.mode = CSR()
+        # 0: YCbCr, 1: 16 bit raw on raw_source. The Boson is reconfigured to match
+        self.raw = CSRStorage()
+        # Chroma between samples, CHROMA_HOLD, CHROMA_LINEAR or CHROMA_CUBIC
+        self.chroma_filter = CSRStorage(2, reset=CHROMA_LINEAR)
 
-        self.next_mode = Signal()
         #self.data = Signal(24)
         #self.comb += [
         #    self.data.eq(pads.data)
         #]
         
       
-        self.submodules.conf = ClockDomainsRenamer("sys")(BosonConfig(pads, clk_freq))
+        # Camera control over the Boson's UART
+        tuning_word = int((921600/clk_freq)*2**32)
+        self.submodules.uart_tx = RS232PHYTX(pads, tuning_word)
+        self.submodules.uart_rx = RS232PHYRX(pads, tuning_word)
+        self.submodules.command = command = BosonCommand(clk_freq)
+        self.specials += [
+            MultiReg(self.raw.storage, self.rx.raw, "boson_rx"),
+            MultiReg(self.chroma_filter.storage, self.rx.chroma_filter, "boson_rx"),
+        ]
 
         #button = platform.request("button")
 
         
         self.comb += [
-            self.conf.button.eq(self.mode.re),
+            command.source.connect(self.uart_tx.sink),
+            self.uart_rx.source.connect(command.sink),
+            command.next_lut.eq(self.mode.re),
+            command.raw.eq(self.raw.storage),
             #self.sync_out.eq(button.b),
         ]
 
-    
+
+## Unit tests
+
+class Pads:
+    def __init__(self):
+        self.vsync = Signal()
+        self.valid = Signal()
+        self.data = Signal(24)
+
+class TestBosonCommand(unittest.TestCase):
+
+    def test_command(self):
+        packets = []
+
+        def sender(dut):
+            # Queue a packet that needs escaping, it goes out ahead of the init packets
+            payload = flirPayload(0x8E, 0x0006000C)
+            for i, b in enumerate([len(payload)] + list(payload)):
+                yield from dut.bus.write(COMMAND_USER + i, b)
+            yield from dut.send.write(1)
+
+        def transmit(dut):
+            yield dut.source.ready.eq(1)
+            packet = []
+            while len(packets) < len(flirInitPackets) + 1:
+                yield
+                if (yield dut.source.valid):
+                    packet.append((yield dut.source.data))
+                    if packet[-1] == 0xAE:
+                        packets.append(packet)
+                        packet = []
+
+        def receive(dut):
+            # The packet looped back as the reply, then with a corrupt byte
+            while not packets:
+                yield
+            reply = packets[0]
+            for packet in [reply, reply[:9] + [reply[9] ^ 1] + reply[10:]]:
+                for b in packet:
+                    yield dut.sink.valid.eq(1)
+                    yield dut.sink.data.eq(b)
+                    yield
+                    yield dut.sink.valid.eq(0)
+                    yield
+            yield
+            self.assertEqual((yield dut.replies.status), 1)
+            self.assertEqual((yield dut.crc_errors.status), 1)
+            self.assertEqual((yield dut.reply_seq.status), 0x8E)
+            self.assertEqual((yield dut.reply_function.status), 0x0006000C)
+            self.assertEqual((yield dut.reply_status.status), 0xFFFFFFFF)
+            self.assertEqual((yield from dut.bus.read(COMMAND_STORE + 8)), 0x0C)
+
+        dut = BosonCommand(clk_freq=100, timeout=1)
+        run_simulation(dut, [sender(dut), transmit(dut), receive(dut)])
+
+        self.assertEqual(packets[0], list(flirFrame(0x8E, 0x0006000C)[1:]))
+        self.assertEqual(packets[1], list(flirFrame(0, 0x0006000D, [0x00, 0x00, 0x00, 0x00])[1:]))
+        self.assertEqual(packets[-1], list(flirFrame(120, 0x00050007)[1:]))
+
+class TestBosonRx(unittest.TestCase):
+
+    def capture(self, raw):
+        # A frame of two 4 pixel lines, returns (data, first, last) from the raw or YCbCr source
+        out = []
+
+        def generator(dut, pads):
+            source = dut.raw_source if raw else dut.source
+            yield dut.raw.eq(raw)
+            yield pads.vsync.eq(1)
+            yield
+            yield pads.vsync.eq(0)
+            yield
+            for line in range(2):
+                for i in range(4):
+                    yield pads.valid.eq(1)
+                    yield pads.data.eq(0x1000 + 16*line + i)
+                    yield
+                    if (yield source.valid):
+                        out.append(((yield source.data), (yield source.first), (yield source.last)))
+                for _ in range(8):
+                    yield pads.valid.eq(0)
+                    yield
+                    if (yield source.valid):
+                        out.append(((yield source.data), (yield source.first), (yield source.last)))
+
+        pads = Pads()
+        dut = boson_rx(pads)
+        run_simulation(dut, generator(dut, pads))
+        return out
+
+    def test_raw(self):
+        self.assertEqual(self.capture(True), [
+            (0x10011000, 1, 0), (0x10031002, 0, 1),
+            (0x10111010, 0, 0), (0x10131012, 0, 1),
+        ])
+
+    def test_watchdog(self):
+        errors = []
+
+        def generator(dut):
+            yield dut.width.storage.eq(4)
+            yield dut.height.storage.eq(2)
+            # A partial frame before the first vsync, good, short line, missing line, good
+            for lines in [[3], [4, 4], [4, 3], [4], [4, 4]]:
+                for n in lines:
+                    for i in range(n + 2):
+                        yield valid.eq(i < n)
+                        yield
+                        errors.append((yield dut.error))
+                yield vsync.eq(1)
+                for _ in range(3):
+                    yield
+                    errors.append((yield dut.error))
+                yield vsync.eq(0)
+                for _ in range(3):
+                    yield
+                    errors.append((yield dut.error))
+            yield
+            self.assertEqual((yield dut.resyncs.status), 2)
+
+        vsync = Signal()
+        valid = Signal()
+        dut = SyncWatchdog(vsync, valid)
+        run_simulation(dut, {"pixel": generator(dut)}, clocks={"pixel": 10, "sys": 10})
+        self.assertEqual(sum(errors), 2)
+
+    def test_markers(self):
+        markers = [(first, last) for _, first, last in self.capture(False)]
+        self.assertEqual(markers, [(1, 0), (0, 0), (0, 0), (0, 1), (0, 0), (0, 0), (0, 0), (0, 1)])
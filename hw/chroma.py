@@ -0,0 +1,183 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import unittest
+
+import numpy as np
+
+from migen import *
+
+from litex.soc.interconnect.stream import Endpoint
+
+# Filters for the chroma between samples
+CHROMA_HOLD = 0     # Repeat the sample to the left
+CHROMA_LINEAR = 1   # (a + b + 1) >> 1
+CHROMA_CUBIC = 2    # (-a + 9b + 9c - d + 8) >> 4, clamped
+
+class ChromaUpsample(Module):
+    """4:2:2 to 4:4:4 for a muxed YCbCr stream, one pixel per clock. Each pixel carries Y in data[0:8] and
+       a chroma sample in data[8:16], Cb on the even pixels of a line and Cr on the odd, both sited on the
+       even pixel. Even pixels take the pair as is, odd pixels the chroma interpolated between pairs by
+       `filter`, samples past either end of the line repeat the end sample.
+       Pixels of a line must arrive on consecutive clocks, lines with at least one clock between them.
+       The line shifts through every clock, the output follows the input by 6 clocks and carries `last`
+       on the final pixel of each line."""
+    def __init__(self):
+        self.sink = sink = Endpoint([("data", 16)])
+        self.source = source = Endpoint([("data", 24)])
+        self.filter = Signal(2)
+
+        # # #
+
+        # Taps are numbered by position in the line relative to the output pixel, 0
+        taps = range(-4, 4)
+        y = {i: Signal(8) for i in taps}
+        c = {i: Signal(8) for i in taps}
+        valid = {i: Signal() for i in taps}
+        even = {i: Signal() for i in taps}
+
+        # Cb on the first pixel of each line
+        phase = Signal()
+        self.comb += sink.ready.eq(1)
+        self.sync += [
+            y[-4].eq(sink.data[0:8]),
+            c[-4].eq(sink.data[8:16]),
+            valid[-4].eq(sink.valid),
+            even[-4].eq(~phase),
+            If(sink.valid,
+                phase.eq(~phase)
+            ).Else(
+                phase.eq(0)
+            ),
+        ]
+        for i in range(-3, 4):
+            self.sync += [
+                y[i].eq(y[i - 1]),
+                c[i].eq(c[i - 1]),
+                valid[i].eq(valid[i - 1]),
+                even[i].eq(even[i - 1]),
+            ]
+
+        # A tap belongs to the output pixel's line if every pixel between is valid, otherwise it falls
+        # back to the nearest tap of the same component that does
+        inline = {0: valid[0]}
+        for i in range(1, 4):
+            inline[i] = Signal()
+            self.comb += inline[i].eq(inline[i - 1] & valid[i])
+        for i in range(-1, -5, -1):
+            inline[i] = Signal()
+            self.comb += inline[i].eq(inline[i + 1] & valid[i])
+        def sample(i, fallback):
+            s = Signal(8)
+            self.comb += s.eq(Mux(inline[i], c[i], fallback))
+            return s
+
+        def interpolate(a, b, cc, d):
+            linear = Signal(9)
+            cubic = Signal((14, True))
+            out = Signal(8)
+            self.comb += [
+                linear.eq(b + cc + 1),
+                cubic.eq(((b + cc) << 3) + b + cc - a - d + 8),
+                Case(self.filter, {
+                    CHROMA_LINEAR: out.eq(linear[1:9]),
+                    CHROMA_CUBIC: out.eq(Mux(cubic < 0, 0, Mux(cubic[4:] > 255, 255, cubic[4:12]))),
+                    "default": out.eq(b),
+                })
+            ]
+            return out
+
+        # Even output pixel: Cb here, Cr on the next pixel
+        even_cr = sample(-1, 0x80)
+
+        # Odd output pixel: Cr(k) here, Cb(k) one back, the next pair two on
+        cb_k = sample(1, 0x80)
+        cb_prev = sample(3, cb_k)
+        cb_next = sample(-1, cb_k)
+        cb_next2 = sample(-3, cb_next)
+        cr_k = c[0]
+        cr_prev = sample(2, cr_k)
+        cr_next = sample(-2, cr_k)
+        cr_next2 = sample(-4, cr_next)
+        odd_cb = interpolate(cb_prev, cb_k, cb_next, cb_next2)
+        odd_cr = interpolate(cr_prev, cr_k, cr_next, cr_next2)
+
+        self.sync += [
+            source.valid.eq(valid[0]),
+            source.last.eq(valid[0] & ~valid[-1]),
+            If(even[0],
+                source.data.eq(Cat(y[0], c[0], even_cr)),
+            ).Else(
+                source.data.eq(Cat(y[0], odd_cb, odd_cr)),
+            )
+        ]
+
+
+def chroma_model(y, c, filter=CHROMA_LINEAR):
+    """Bit exact NumPy model of ChromaUpsample for one line, `y` and `c` as received. Returns Y, Cb, Cr"""
+    y = np.asarray(y, dtype=np.int32)
+    c = np.asarray(c, dtype=np.int32)
+    n = len(y)
+    cb = np.empty(n, dtype=np.int32)
+    cr = np.empty(n, dtype=np.int32)
+
+    # Chroma pairs, sited on the even pixels. An odd length line has no Cr for its last pair
+    cb_s = c[0::2]
+    cr_s = c[1::2]
+    cb[0::2] = cb_s
+    cr[0::2] = np.concatenate([cr_s, [0x80]]) if n % 2 else cr_s
+
+    # Neighbouring pairs, repeating the ends
+    k = np.arange(n//2)
+    def interpolate(s):
+        a, b, cc, d = [s[np.clip(k + i, 0, len(s) - 1)] for i in range(-1, 3)]
+        if filter == CHROMA_LINEAR:
+            return (b + cc + 1) >> 1
+        if filter == CHROMA_CUBIC:
+            return np.clip((9*b + 9*cc - a - d + 8) >> 4, 0, 255)
+        return b
+    cb[1::2] = interpolate(cb_s)
+    cr[1::2] = interpolate(cr_s)
+    return y, cb, cr
+
+
+## Unit tests
+
+class TestChromaUpsample(unittest.TestCase):
+
+    def test_model(self):
+        # An edge in Cb and Cr
+        c = [100, 50, 100, 50, 200, 250, 200, 250]
+        _, cb, cr = chroma_model(range(8), c, CHROMA_LINEAR)
+        self.assertEqual(list(cb), [100, 100, 100, 150, 200, 200, 200, 200])
+        self.assertEqual(list(cr), [50, 50, 50, 150, 250, 250, 250, 250])
+
+    def test_upsample(self):
+        rng = np.random.RandomState(0)
+        lines = [rng.randint(0, 256, size=(2, n)) for n in [16, 2, 9, 640]]
+
+        for f in [CHROMA_HOLD, CHROMA_LINEAR, CHROMA_CUBIC]:
+            out = []
+
+            def generator(dut):
+                yield dut.filter.eq(f)
+                for y, c in lines:
+                    for i in range(len(y) + 3):
+                        yield dut.sink.valid.eq(i < len(y))
+                        yield dut.sink.data.eq(int(y[i]) | (int(c[i]) << 8) if i < len(y) else 0)
+                        yield
+                        if (yield dut.source.valid):
+                            out.append(((yield dut.source.data), (yield dut.source.last)))
+                for _ in range(8):
+                    yield
+                    if (yield dut.source.valid):
+                        out.append(((yield dut.source.data), (yield dut.source.last)))
+
+            dut = ChromaUpsample()
+            run_simulation(dut, generator(dut))
+
+            expected = []
+            for y, c in lines:
+                ym, cb, cr = chroma_model(y, c, f)
+                expected += [(int(a) | (int(b) << 8) | (int(d) << 16), int(i == len(y) - 1)) for i, (a, b, d) in enumerate(zip(ym, cb, cr))]
+            self.assertEqual(out, expected)
@@ -0,0 +1,189 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import unittest
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage
+
+from dsp import shift_add
+
+def layer_layout(ppc=1):
+    # Pixel i of each clock in bits [8*i:8*(i+1)], `valid` bit i is low where pixel i is outside the layer
+    return [("r", 8*ppc), ("g", 8*ppc), ("b", 8*ppc), ("valid", ppc)]
+
+class Compositor(Module, AutoCSR):
+    """Blends `n` layers bottom to top, one pipeline stage per layer. Layer 0 is opaque, black where it isn't
+       valid. Every other layer has a global alpha (255 is opaque) and an optional colour key (0xRRGGBB),
+       pixels matching the key are transparent, as are pixels outside the layer, so `valid` keys a layer
+       per pixel. Layers are sampled at
+       the same screen position, `hsync`/`vsync`/`blank` are delayed to line up with the output."""
+    def __init__(self, n=3, ppc=1, alpha=None, key=None, key_enable=None):
+        self.layers = layers = [Record(layer_layout(ppc)) for _ in range(n)]
+        self.hsync = Signal()
+        self.vsync = Signal()
+        self.blank = Signal()
+
+        self.out = out = Record(layer_layout(ppc) + [("hsync", 1), ("vsync", 1), ("blank", 1)])
+
+        alpha = alpha or [255]*n
+        key = key or [0]*n
+        key_enable = key_enable or [0]*n
+
+        # # #
+
+        def pixels(rec):
+            return [Cat(rec.b[8*i:8*(i+1)], rec.g[8*i:8*(i+1)], rec.r[8*i:8*(i+1)]) for i in range(ppc)]
+
+        def delay(sig, clocks):
+            for _ in range(clocks):
+                r = Signal.like(sig)
+                self.sync += r.eq(sig)
+                sig = r
+            return sig
+
+        # Stage 0, the bottom layer
+        below = Record(layer_layout(ppc))
+        for i, x in enumerate(pixels(layers[0])):
+            self.sync += Cat(*[o[8*i:8*(i+1)] for o in [below.b, below.g, below.r]]).eq(Mux(layers[0].valid[i], x, 0))
+
+        for l, layer in enumerate(layers[1:], 1):
+            _alpha = CSRStorage(8, reset=alpha[l], name="layer{}_alpha".format(l))
+            _key = CSRStorage(24, reset=key[l], name="layer{}_key".format(l))
+            _key_enable = CSRStorage(reset=key_enable[l], name="layer{}_key_enable".format(l))
+            setattr(self, "_layer{}_alpha".format(l), _alpha)
+            setattr(self, "_layer{}_key".format(l), _key)
+            setattr(self, "_layer{}_key_enable".format(l), _key_enable)
+
+            a = Signal(9)
+            key_value = Signal(24)
+            key_on = Signal()
+            a_ = Signal(8)
+            self.specials += [
+                MultiReg(_alpha.storage, a_),
+                MultiReg(_key.storage, key_value),
+                MultiReg(_key_enable.storage, key_on),
+            ]
+            # 0-255 onto 0-256, so 255 is fully opaque
+            self.comb += a.eq(a_ + a_[7])
+
+            # Line the layer up with the pipeline
+            src = Record(layer_layout(ppc))
+            self.comb += src.raw_bits().eq(delay(layer.raw_bits(), l))
+
+            result = Record(layer_layout(ppc))
+            for i, (x, y) in enumerate(zip(pixels(src), pixels(below))):
+                transparent = Signal()
+                self.comb += transparent.eq(~src.valid[i] | (key_on & (x == key_value)))
+                for ch, o in zip(range(3), [result.b, result.g, result.r]):
+                    xc = x[8*ch:8*(ch+1)]
+                    yc = y[8*ch:8*(ch+1)]
+                    diff = Signal((9, True))
+                    mix = Signal((18, True))
+                    self.comb += [
+                        diff.eq(xc - yc),
+                        mix.eq(shift_add(a, diff)),
+                    ]
+                    self.sync += o[8*i:8*(i+1)].eq(Mux(transparent, yc, yc + (mix >> 8)))
+            below = result
+
+        self.comb += [
+            out.r.eq(below.r),
+            out.g.eq(below.g),
+            out.b.eq(below.b),
+            out.valid.eq(2**ppc - 1),
+            out.hsync.eq(delay(self.hsync, n)),
+            out.vsync.eq(delay(self.vsync, n)),
+            out.blank.eq(delay(self.blank, n)),
+        ]
+
+
+## Unit tests
+
+class TestCompositor(unittest.TestCase):
+
+    def test_blend(self):
+        results = {}
+
+        def generator(dut):
+            # Terminal-like layer 0, a half transparent layer 1, keyed layer 2
+            yield dut.layers[0].valid.eq(1)
+            yield dut.layers[0].r.eq(0x10)
+            yield dut.layers[0].g.eq(0x20)
+            yield dut.layers[0].b.eq(0x30)
+            yield dut.layers[1].r.eq(0xF0)
+            yield dut.layers[1].g.eq(0x00)
+            yield dut.layers[1].b.eq(0x30)
+            yield dut.layers[2].r.eq(0x12)
+            yield dut.layers[2].g.eq(0x34)
+            yield dut.layers[2].b.eq(0x56)
+            yield dut.layers[2].valid.eq(1)
+            yield dut._layer1_alpha.storage.eq(128)
+            yield dut._layer2_key.storage.eq(0x123456)
+            yield dut._layer2_key_enable.storage.eq(1)
+            for _ in range(8):
+                yield
+            results["bottom"] = (yield dut.out.r), (yield dut.out.g), (yield dut.out.b)
+
+            yield dut.layers[1].valid.eq(1)
+            for _ in range(8):
+                yield
+            results["blend"] = (yield dut.out.r), (yield dut.out.g), (yield dut.out.b)
+
+            yield dut._layer2_key_enable.storage.eq(0)
+            for _ in range(8):
+                yield
+            results["top"] = (yield dut.out.r), (yield dut.out.g), (yield dut.out.b)
+
+            yield dut._layer1_alpha.storage.eq(255)
+            yield dut.layers[2].valid.eq(0)
+            for _ in range(8):
+                yield
+            results["opaque"] = (yield dut.out.r), (yield dut.out.g), (yield dut.out.b)
+
+        dut = Compositor(3)
+        run_simulation(dut, generator(dut))
+        self.assertEqual(results["bottom"], (0x10, 0x20, 0x30))
+        self.assertEqual(results["blend"], (0x80, 0x0F, 0x30))
+        self.assertEqual(results["top"], (0x12, 0x34, 0x56))
+        self.assertEqual(results["opaque"], (0xF0, 0x00, 0x30))
+
+    def test_pixel_valid(self):
+        # Two pixels per clock, layer 1 covers only the second
+        results = []
+
+        def generator(dut):
+            yield dut.layers[0].valid.eq(0b11)
+            yield dut.layers[0].r.eq(0x2010)
+            yield dut.layers[1].valid.eq(0b10)
+            yield dut.layers[1].r.eq(0xF0E0)
+            for _ in range(8):
+                yield
+            results.append((yield dut.out.r))
+            yield dut.layers[0].valid.eq(0b01)
+            yield dut.layers[1].valid.eq(0b00)
+            for _ in range(8):
+                yield
+            results.append((yield dut.out.r))
+
+        dut = Compositor(2, ppc=2)
+        run_simulation(dut, generator(dut))
+        self.assertEqual(results, [0xF010, 0x0010])
+
+    def test_latency(self):
+        syncs = []
+
+        def generator(dut):
+            for cycle in range(10):
+                yield dut.hsync.eq(cycle == 2)
+                yield dut.layers[0].valid.eq(1)
+                yield dut.layers[0].r.eq(0xFF*(cycle == 2))
+                yield
+                syncs.append(((yield dut.out.hsync), (yield dut.out.r)))
+
+        dut = Compositor(3)
+        run_simulation(dut, generator(dut))
+        self.assertEqual(sum(s for s, _ in syncs), 1)
+        self.assertEqual([s for s, _ in syncs], [r == 0xFF for _, r in syncs])
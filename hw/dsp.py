@@ -0,0 +1,153 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import re
+import unittest
+from math import ceil
+
+from migen import *
+from migen.fhdl.bitcontainer import value_bits_sign
+from migen.fhdl.visit import NodeVisitor
+from migen.genlib.fsm import NextValue
+
+# MULT18X18D blocks and LUT4s in the LFE5U-25F
+DSP_BLOCKS = 28
+LUT4S = 24288
+
+def shift_add(a, b):
+    """a*b as a sum of `b` shifted by each set bit of `a`, built from LUTs and carry chains so it doesn't
+       take a MULT18X18D. `a` should be the narrower operand, a signed `a` subtracts the term of its top
+       bit. The terms are summed as a balanced tree, the result carries its LUT4 count as `lut4`, a LUT4
+       per bit of each adder."""
+    n = len(a)
+    signed = value_bits_sign(a)[1]
+    terms = []
+    lut4 = 0
+    for k in range(n):
+        term = Mux(a[k], b << k, 0)
+        if signed and k == n - 1:
+            term = -term
+            lut4 += value_bits_sign(term)[0]
+        terms.append(term)
+    if n == 1:
+        lut4 += value_bits_sign(terms[0])[0]
+    while len(terms) > 1:
+        summed = []
+        for i in range(0, len(terms), 2):
+            if i + 1 < len(terms):
+                summed.append(terms[i] + terms[i + 1])
+                lut4 += value_bits_sign(summed[-1])[0]
+            else:
+                summed.append(terms[i])
+        terms = summed
+    terms[0].lut4 = lut4
+    return terms[0]
+
+
+class _Multiplies(NodeVisitor):
+    def __init__(self):
+        self.blocks = 0
+        self.lut4 = 0
+
+    def visit_Operator(self, node):
+        if node.op == "*":
+            widths = [value_bits_sign(o)[0] for o in node.operands]
+            constant = [o for o in node.operands if isinstance(o, Constant)]
+            # Powers of two are shifts
+            if not any(c.value & (c.value - 1) == 0 for c in constant):
+                self.blocks += ceil(widths[0] / 18) * ceil(widths[1] / 18)
+        self.lut4 += getattr(node, "lut4", 0)
+        NodeVisitor.visit_Operator(self, node)
+
+    def visit_unknown(self, node):
+        if isinstance(node, NextValue):
+            self.visit(node.target)
+            self.visit(node.value)
+
+
+def multiplier_estimate(*modules):
+    """(MULT18X18D blocks, LUT4s) the multiplies in `modules` and their submodules take. `*` operators
+       are split into 18 bit pieces the way yosys' mul2dsp does, `shift_add` multiplies count their
+       adders. Walks the statements before finalization, FSM states included, so it can run before the
+       SoC is built. A first guess, the nextpnr report of the build is the real figure."""
+    visitor = _Multiplies()
+
+    def walk(m):
+        visitor.visit(m._fragment.comb)
+        visitor.visit(m._fragment.sync)
+        for statements in getattr(m, "actions", {}).values():
+            visitor.visit(statements)
+        for _, s in m._submodules:
+            if isinstance(s, Module):
+                walk(s)
+
+    for m in modules:
+        walk(m)
+    return visitor.blocks, visitor.lut4
+
+
+def nextpnr_utilisation(log):
+    """{cell: (used, available)} from the last device utilisation report in a nextpnr log"""
+    cells = {}
+    with open(log) as f:
+        for line in f:
+            if "Device utilisation" in line:
+                cells = {}
+            m = re.match(r"Info:\s+(\w+):\s+(\d+)/\s*(\d+)", line)
+            if m:
+                cells[m.group(1)] = (int(m.group(2)), int(m.group(3)))
+    return cells
+
+
+## Unit tests
+
+class TestDSP(unittest.TestCase):
+
+    def test_shift_add(self):
+        results = []
+        cases = [(0, 0), (255, -2048), (200, 2047), (-256, 100), (-1, -7), (17, 93)]
+
+        class DUT(Module):
+            def __init__(self):
+                self.pixel = Signal(8)
+                self.coeff = Signal((12, True))
+                self.x = Signal((9, True))
+                self.product = Signal((20, True))
+                self.signed_product = Signal((21, True))
+                self.comb += [
+                    self.product.eq(shift_add(self.pixel, self.coeff)),
+                    self.signed_product.eq(shift_add(self.x, self.coeff)),
+                ]
+
+        def generator(dut):
+            for a, b in cases:
+                yield dut.pixel.eq(a & 0xFF)
+                yield dut.x.eq(a)
+                yield dut.coeff.eq(b)
+                yield
+                results.append(((yield dut.product), (yield dut.signed_product)))
+
+        dut = DUT()
+        run_simulation(dut, generator(dut))
+        self.assertEqual(results, [((a & 0xFF) * b, a * b) for a, b in cases])
+
+    def test_estimate(self):
+        class Child(Module):
+            def __init__(self):
+                a, b, c = Signal(8), Signal((12, True)), Signal(32)
+                self.sync += [
+                    a.eq(a * b),
+                    c.eq(c * a),
+                    # Shifts aren't counted, LUT multiplies only count LUTs
+                    c.eq(4 * c),
+                    b.eq(shift_add(a[:2], b)),
+                ]
+                self.submodules.fsm = fsm = FSM()
+                fsm.act("IDLE", NextValue(c, c * 9))
+
+        class Parent(Module):
+            def __init__(self):
+                self.submodules.child = ClockDomainsRenamer("pixel")(Child())
+
+        # Two terms, one 14 bit adder
+        self.assertEqual(multiplier_estimate(Parent()), (1 + 2 + 2, 14))
@@ -9,6 +9,7 @@ import logging
 
 from migen import *
 from migen.genlib.resetsync import AsyncResetSynchronizer
+from migen.genlib.cdc import MultiReg
 
 from litex.build.io import DifferentialInput
 
@@ -99,7 +100,7 @@ class ECP5PLL(Module):
         self.clkin_freq = freq
         register_clkin_log(self.logger, clkin, freq)
 
-    def create_clkout(self, cd, freq, phase=0, margin=1e-2):
+    def create_clkout(self, cd, freq, phase=0, margin=5e-3):
         (clko_freq_min, clko_freq_max) = self.clko_freq_range
         assert freq >= clko_freq_min
        # assert freq <= clko_freq_max
@@ -142,8 +143,8 @@ class ECP5PLL(Module):
 
     def do_finalize(self):
         config = self.compute_config()
-        clkfb  = Signal()
-        self.params.update(
+        # Parameters already in self.params override the defaults below
+        params = dict(
             attr=[
                 ("ICP_CURRENT",            "6"),
                 ("LPF_RESISTOR",          "16"),
@@ -166,6 +167,8 @@ class ECP5PLL(Module):
             i_PHASESTEP=   self.phase_step,
             i_PHASELOADREG=self.phase_load,
         )
+        params.update(self.params)
+        self.params = params
         for n, (clk, f, p, m) in sorted(self.clkouts.items()):
             n_to_l = {0: "P", 1: "S", 2: "S2"}
             div    = config["clko{}_div".format(n)]
@@ -176,3 +179,175 @@ class ECP5PLL(Module):
             self.params["p_CLKO{}_CPHASE".format(n_to_l[n])] = p
             self.params["o_CLKO{}".format(n_to_l[n])]        = clk
         self.specials += Instance("EHXPLLL", **self.params)
+
+
+class ECP5MultiModePLL(ECP5PLL):
+    """ECP5PLL with one set of output frequencies per mode, selectable at runtime with `mode`.
+
+    The EHXPLLL dividers are fixed in the bitstream, so the reference and the feedback are divided in
+    fabric by per-mode ratios instead: CLKOS3 is divided down and fed back through CLKFB, and a single
+    set of output dividers is solved for every mode. Mode `n` scales all of the clkouts by `scales[n]`,
+    clkouts are created with their mode 0 frequencies. The PLL drops lock while it retunes to a new
+    mode."""
+    ref_div_range = (2, 15+1)   # Keeps the PFD above 3.125MHz from a 48MHz reference
+    fb_div_range  = (2, 63+1)
+    fb_freq_max   = 100e6       # Feedback divider clock, CLKOS3
+
+    def __init__(self, scales):
+        ECP5PLL.__init__(self)
+        self.scales = scales
+        self.mode   = Signal(max=max(len(scales), 2))
+
+    def register_clkin(self, clkin, freq):
+        ECP5PLL.register_clkin(self, clkin, freq)
+        self.clock_domains.cd_pll_ref = ClockDomain(reset_less=True)
+        self.comb += self.cd_pll_ref.clk.eq(self.clkin)
+        # The EHXPLLL is fed from the fabric divider
+        self.clkin = Signal()
+
+    def compute_config(self):
+        (vco_freq_min, vco_freq_max) = self.vco_freq_range
+        clkouts = sorted(self.clkouts.items())
+        (_, (_, f0, _, m0)) = clkouts[0]
+        for d0 in range(*self.clko_div_range):
+            targets = [f0*s*d0 for s in self.scales]
+            if min(targets) < vco_freq_min or max(targets) > vco_freq_max:
+                continue
+            for clkos3_div in range(*self.clko_div_range):
+                if max(targets)/clkos3_div > self.fb_freq_max:
+                    continue
+                # Closest reference and feedback division for each mode, from the first clkout
+                ref_divs = []
+                fb_divs = []
+                vcos = []
+                for target in targets:
+                    best = None
+                    for ref_div in range(*self.ref_div_range):
+                        fb_div = round(target*ref_div/(self.clkin_freq*clkos3_div))
+                        if fb_div not in range(*self.fb_div_range):
+                            continue
+                        vco_freq = self.clkin_freq/ref_div*fb_div*clkos3_div
+                        if vco_freq < vco_freq_min or vco_freq > vco_freq_max:
+                            continue
+                        if best is None or abs(vco_freq - target) < abs(best[2] - target):
+                            best = (ref_div, fb_div, vco_freq)
+                    if best is None or abs(best[2] - target) > target*m0:
+                        break
+                    ref_divs.append(best[0])
+                    fb_divs.append(best[1])
+                    vcos.append(best[2])
+                else:
+                    config = {"clki_div": 1, "clkfb_div": 1, "clkos3_div": clkos3_div}
+                    for n, (clk, f, p, m) in clkouts:
+                        for d in range(*self.clko_div_range):
+                            if all(abs(vco/d - f*s) <= f*s*m for vco, s in zip(vcos, self.scales)):
+                                config["clko{}_freq".format(n)]  = vcos[0]/d
+                                config["clko{}_div".format(n)]   = d
+                                config["clko{}_phase".format(n)] = p
+                                break
+                        else:
+                            break
+                    else:
+                        for i, (ref_div, fb_div, vco) in enumerate(zip(ref_divs, fb_divs, vcos)):
+                            config["ref_div{}".format(i)] = ref_div
+                            config["fb_div{}".format(i)]  = fb_div
+                            config["vco{}".format(i)]     = vco
+                        compute_config_log(self.logger, config)
+                        self.config = config
+                        return config
+        raise ValueError("No PLL config found")
+
+    def do_finalize(self):
+        config = self.compute_config()
+        ref_divs = [config["ref_div{}".format(i)] for i in range(len(self.scales))]
+        fb_divs  = [config["fb_div{}".format(i)] for i in range(len(self.scales))]
+
+        # CLKOS3 through the fabric feedback divider into CLKFB
+        self.clock_domains.cd_pll_fb = ClockDomain(reset_less=True)
+        clkfb = Signal()
+        self.params.update(
+            p_FEEDBK_PATH = "USERCLOCK",
+            p_CLKOS3_DIV  = config["clkos3_div"],
+            o_CLKOS3      = self.cd_pll_fb.clk,
+            i_CLKFB       = clkfb,
+        )
+        ECP5PLL.do_finalize(self)
+
+        self.submodules.ref_divider = ClockDomainsRenamer("pll_ref")(ModeDivider(ref_divs, self.mode))
+        self.submodules.fb_divider  = ClockDomainsRenamer("pll_fb")(ModeDivider(fb_divs, self.mode))
+        self.comb += [
+            self.clkin.eq(self.ref_divider.clk),
+            clkfb.eq(self.fb_divider.clk),
+        ]
+
+
+class ModeDivider(Module):
+    """Divides its clock by `divs[mode]`, `clk` is high for the first half of each period. `mode` is
+       resynchronised, the ratio changes within a period of the new one."""
+    def __init__(self, divs, mode):
+        self.clk = Signal()
+
+        # # #
+
+        div   = Signal(max=max(divs) + 1)
+        count = Signal(max=max(divs) + 1)
+        self.specials += MultiReg(Array(divs)[mode], div)
+        self.sync += [
+            count.eq(count + 1),
+            If(count >= div - 1,
+                count.eq(0)
+            ),
+            self.clk.eq(count < div[1:])
+        ]
+
+
+## Unit tests
+
+import unittest
+
+class TestMultiModePLL(unittest.TestCase):
+
+    def test_video_modes(self):
+        pix_clks = [40e6, 65e6, 74.25e6]
+        pll = ECP5MultiModePLL([f/pix_clks[0] for f in pix_clks])
+        pll.register_clkin(Signal(), 48e6)
+        pll.create_clkout(ClockDomain("shift"), pix_clks[0]*5)
+        pll.create_clkout(ClockDomain("video"), pix_clks[0]/2)
+        config = pll.compute_config()
+
+        for i, f in enumerate(pix_clks):
+            ref_div = config["ref_div{}".format(i)]
+            fb_div  = config["fb_div{}".format(i)]
+            vco = 48e6/ref_div*fb_div*config["clkos3_div"]
+            self.assertEqual(vco, config["vco{}".format(i)])
+            self.assertTrue(400e6 <= vco <= 800e6)
+            self.assertTrue(48e6/ref_div >= 3.125e6)
+            self.assertTrue(vco/config["clkos3_div"] <= pll.fb_freq_max)
+            # Within the +-0.5% VESA pixel clock tolerance
+            self.assertAlmostEqual(vco/config["clko0_div"]/(f*5), 1, delta=5e-3)
+            self.assertAlmostEqual(vco/config["clko1_div"]/(f/2), 1, delta=5e-3)
+
+    def test_divider(self):
+        periods = []
+
+        def generator(dut):
+            for mode in [0, 1, 2, 0]:
+                yield dut.mode.eq(mode)
+                for _ in range(64):
+                    yield
+                edges = []
+                for n in range(64):
+                    clk = (yield dut.divider.clk)
+                    yield
+                    if (yield dut.divider.clk) and not clk:
+                        edges.append(n)
+                periods.append(edges[-1] - edges[-2])
+
+        class DUT(Module):
+            def __init__(self):
+                self.mode = Signal(2)
+                self.submodules.divider = ModeDivider([14, 3, 12], self.mode)
+
+        dut = DUT()
+        run_simulation(dut, generator(dut))
+        self.assertEqual(periods, [14, 3, 12, 14])
@@ -4,6 +4,8 @@ from migen import *
 
 from migen.genlib.cdc import PulseSynchronizer
 
+from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus
+
 class EdgeDetect(Module):
     """A module to detect edges on a signal line
 
@@ -50,3 +52,42 @@ class EdgeDetect(Module):
             ]
         else:
             self.comb += o.eq(pulse)
+
+
+class FrameCommit(Module, AutoCSR):
+    """Applies a group of settings together between frames. Writing `commit` arms it, the next `frame`
+       pulse then pulses `load`, and `load_out` in `output_cd`. `pending` reads 1 until then, settings
+       written while it is set may land with the group."""
+    def __init__(self, output_cd="sys"):
+        self.frame = Signal()
+        self.load = Signal()
+        self.load_out = Signal()
+
+        self.commit = CSR()
+        self.pending = CSRStatus()
+
+        # # #
+
+        pending = Signal()
+        self.comb += [
+            self.load.eq(self.frame & pending),
+            self.pending.status.eq(pending),
+        ]
+        self.sync += [
+            If(self.load,
+                pending.eq(0)
+            ),
+            If(self.commit.re,
+                pending.eq(1)
+            )
+        ]
+
+        if output_cd != "sys":
+            ps = PulseSynchronizer("sys", output_cd)
+            self.submodules += ps
+            self.comb += [
+                ps.i.eq(self.load),
+                self.load_out.eq(ps.o)
+            ]
+        else:
+            self.comb += self.load_out.eq(self.load)
@@ -3,22 +3,21 @@
 
 from migen import *
 from litex.soc.interconnect.stream import Endpoint
-from edge_detect import EdgeDetect
 
 from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus, CSRStorage
 from litex.soc.interconnect.stream import Endpoint, EndpointDescription, AsyncFIFO
 
 class Framer(Module, AutoCSR):
-    def __init__(self):
-        self.sink = sink = Endpoint([("data", 32)])
-        self.hsync = hsync = Signal()
-        self.vsync = vsync = Signal()
+    """Places the video stream in the output, x/y are relative to the top left of the active area
+       and follow `timing` (a VideoTimingGenerator). New values are picked up at frame end."""
+    def __init__(self, timing, ppc=1):
+        self.sink = sink = Endpoint([("data", 32*ppc)])
 
 
-        # VGA output
-        self.red   = red   = Signal(8)
-        self.green = green = Signal(8)
-        self.blue  = blue  = Signal(8)
+        # VGA output, pixel i of each clock in bits [8*i:8*(i+1)]
+        self.red   = red   = Signal(8*ppc)
+        self.green = green = Signal(8*ppc)
+        self.blue  = blue  = Signal(8*ppc)
         self.data_valid = data_valid = Signal()
 
         # CSR control
@@ -45,24 +44,20 @@ class Framer(Module, AutoCSR):
             fifo.sink.valid.eq(1)
         ]
 
-        pixel_counter = Signal(14)
-        line_counter  = Signal(14)
+        pixel_counter = Signal(16)
+        line_counter  = Signal(16)
 
         x_start = Signal(16)
         y_start = Signal(16)
         x_stop = Signal(16)
         y_stop = Signal(16)
-        
-
 
-        h_det = EdgeDetect(mode="fall", input_cd="video", output_cd="video")
-        v_det = EdgeDetect(mode="fall", input_cd="video", output_cd="video")
-        self.submodules += h_det, v_det
         self.comb += [
-            h_det.i.eq(hsync),
-            v_det.i.eq(vsync),
+            # Position within the active area
+            pixel_counter.eq(timing.hcount - timing.h_start),
+            line_counter.eq(timing.vcount - timing.v_start),
 
-            fifo.source.ready.eq(v_det.o),
+            fifo.source.ready.eq(timing.frame_end),
         ]
 
         self.comb += [
@@ -86,31 +81,22 @@ class Framer(Module, AutoCSR):
                 If((pixel_counter >= x_start) & (pixel_counter < x_stop),
                     data_valid.eq(1),
                     If(sink.valid,
-                        red.eq(sink.data[0:8]),
-                        green.eq(sink.data[8:16]),
-                        blue.eq(sink.data[16:24])
+                        [red[8*i:8*(i+1)].eq(sink.data[32*i+0:32*i+8]) for i in range(ppc)],
+                        [green[8*i:8*(i+1)].eq(sink.data[32*i+8:32*i+16]) for i in range(ppc)],
+                        [blue[8*i:8*(i+1)].eq(sink.data[32*i+16:32*i+24]) for i in range(ppc)],
                     ).Else( 
-                        red.eq(0xFF),
-                        green.eq(0x77),
-                        blue.eq(0xFF)
+                        [red[8*i:8*(i+1)].eq(0xFF) for i in range(ppc)],
+                        [green[8*i:8*(i+1)].eq(0x77) for i in range(ppc)],
+                        [blue[8*i:8*(i+1)].eq(0xFF) for i in range(ppc)],
                     )
                 )
             ),
 
-            # Horizontal timing for one line
-            pixel_counter.eq(pixel_counter + 1),
-
-            If(h_det.o,
-                pixel_counter.eq(0),
-                line_counter.eq(line_counter + 1),
-            ),
-            If(v_det.o,
-                line_counter.eq(0),
-
-                
-                x_stop.eq(fifo.source.x_start + fifo.source.width),
+            If(timing.frame_end,
+                # Horizontal positions are in pixels, the counter runs in clocks
+                x_stop.eq((fifo.source.x_start + fifo.source.width) >> log2_int(ppc)),
                 y_stop.eq(fifo.source.y_start + fifo.source.height),
-                x_start.eq(fifo.source.x_start),
+                x_start.eq(fifo.source.x_start >> log2_int(ppc)),
                 y_start.eq(fifo.source.y_start),
             )
         ]
\ No newline at end of file
@@ -1,51 +1,122 @@
+import unittest
+
 from migen import *
+from migen.genlib.cdc import MultiReg
 
-class HDMI(Module):
-    def __init__(self, platform, pins):
+from tmds import TMDSEncoder, control_tokens
 
-        platform.add_source('hdl/fake_differential.v')
-        platform.add_source('hdl/vga2dvid.v')
-        platform.add_source('hdl/vga.v')
-        platform.add_source('hdl/tmds_encoder.v')
+class HDMI(Module):
+    """DVI output, `ppc` pixels per video clock. TMDS symbols are serialized from the video_shift clock
+       (5x video) with ODDRX1F at 1ppc, or with ODDRX2F from the video_shift2x edge clock at 2ppc.
+       `lanes` holds the bits shifted out each video_shift clock, pins are optional for simulation."""
+    def __init__(self, platform, pins, ppc=1):
 
-        self.r = vga_r = Signal(8)
-        self.g = vga_g = Signal(8)
-        self.b = vga_b = Signal(8)
+        self.r = vga_r = Signal(8*ppc)
+        self.g = vga_g = Signal(8*ppc)
+        self.b = vga_b = Signal(8*ppc)
         self.hsync = vga_hsync = Signal()
         self.vsync = vga_vsync = Signal()
         self.blank = vga_blank = Signal()
 
-        tmds = [Signal(2) for i in range(4)]
-        self.specials += Instance(
-            'vga2dvid',
-            p_C_ddr=1,
-            i_clk_pixel=ClockSignal('video'),
-            i_clk_shift=ClockSignal('video_shift'),
-            i_in_red=vga_r,
-            i_in_green=vga_g,
-            i_in_blue=vga_b,
-            i_in_hsync=vga_hsync,
-            i_in_vsync=vga_vsync,
-            i_in_blank=vga_blank,
-            o_out_clock=tmds[3],
-            o_out_red=tmds[2],
-            o_out_green=tmds[1],
-            o_out_blue=tmds[0]
-        )
-
-
-        self.specials += Instance(
-            'fake_differential',
-            p_C_ddr=1,
-            i_clk_shift=ClockSignal('video_shift'),
-            i_in_clock=tmds[3],
-            i_in_red=tmds[2],
-            i_in_green=tmds[1],
-            i_in_blue=tmds[0],
-            o_out_p=pins.p,
-            #o_out_n=pins.n,
-
-            i_move=0,
-            i_loadn=0,
-            i_dir=1,
-        )
\ No newline at end of file
+        bits = 2*ppc
+        self.lanes = lanes = [Signal(bits) for _ in range(4)]
+
+        encoders = [ClockDomainsRenamer("video")(TMDSEncoder(ppc)) for _ in range(3)]
+        self.submodules += encoders
+
+        for enc, colour in zip(encoders, [vga_b, vga_g, vga_r]):
+            self.comb += [
+                [enc.d[i].eq(colour[8*i:8*(i+1)]) for i in range(ppc)],
+                enc.de.eq(~vga_blank),
+            ]
+        self.comb += encoders[0].c.eq(Cat(vga_hsync, vga_vsync))
+
+        clock_symbol = 0b0000011111
+        words = [Cat(*enc.out) for enc in encoders] + [Replicate(C(clock_symbol, 10), ppc)]
+
+        # Lane order [blue, green, red, clock], the board swaps polarity on all but green
+        invert = [1, 0, 1, 1]
+
+        # Reload the shift registers once per video clock
+        toggle = Signal()
+        toggle_s = Signal()
+        toggle_r = Signal()
+        load = Signal()
+        self.sync.video += toggle.eq(~toggle)
+        self.specials += MultiReg(toggle, toggle_s, odomain="video_shift")
+        self.sync.video_shift += toggle_r.eq(toggle_s)
+        self.comb += load.eq(toggle_r != toggle_s)
+
+        for word, inv, lane in zip(words, invert, lanes):
+            shift = Signal(10*ppc)
+            self.sync.video_shift += [
+                If(load,
+                    shift.eq(~word if inv else word)
+                ).Else(
+                    shift.eq(shift[bits:])
+                ),
+                # Register stage ahead of the IO
+                lane.eq(shift[:bits]),
+            ]
+
+        if pins is None:
+            return
+
+        for i, lane in enumerate(lanes):
+            if ppc == 1:
+                self.specials += Instance("ODDRX1F",
+                    i_D0=lane[0],
+                    i_D1=lane[1],
+                    i_SCLK=ClockSignal("video_shift"),
+                    i_RST=0,
+                    o_Q=pins.p[i]
+                )
+            else:
+                self.specials += Instance("ODDRX2F",
+                    i_D0=lane[0],
+                    i_D1=lane[1],
+                    i_D2=lane[2],
+                    i_D3=lane[3],
+                    i_SCLK=ClockSignal("video_shift"),
+                    i_ECLK=ClockSignal("video_shift2x"),
+                    i_RST=ResetSignal("video_shift"),
+                    o_Q=pins.p[i]
+                )
+
+
+## Unit tests
+
+class TestHDMI(unittest.TestCase):
+
+    def test_serializer(self):
+        for ppc in [1, 2]:
+            serial = [[] for _ in range(4)]
+
+            def video(dut):
+                yield dut.blank.eq(1)
+                yield dut.hsync.eq(1)
+                for _ in range(40):
+                    yield
+
+            def shift(dut):
+                for _ in range(200):
+                    for lane, bits in zip(dut.lanes, serial):
+                        v = (yield lane)
+                        bits += [(v >> i) & 1 for i in range(2*ppc)]
+                    yield
+
+            dut = HDMI(None, None, ppc)
+            run_simulation(dut, {"video": video(dut), "video_shift": shift(dut)},
+                clocks={"video": 50, "video_shift": 10})
+
+            def symbol(bits, expected, invert):
+                # Find the symbol boundary, then check the following symbols
+                stream = "".join(str(b ^ invert) for b in bits[200:])
+                token = "".join(str((expected >> i) & 1) for i in range(10))
+                offset = stream.index(token)
+                return stream[offset:offset + 50] == token*5
+
+            self.assertTrue(symbol(serial[0], control_tokens[1], 1))
+            self.assertTrue(symbol(serial[1], control_tokens[0], 0))
+            self.assertTrue(symbol(serial[2], control_tokens[0], 1))
+            self.assertTrue(symbol(serial[3], 0b0000011111, 1))
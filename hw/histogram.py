@@ -0,0 +1,234 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import unittest
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.stream import Endpoint
+from litex.soc.interconnect.csr import AutoCSR, CSRStatus, CSRStorage
+
+class Histogram(Module, AutoCSR):
+    """Counts the luminance in data[0:bits] of a `pixel` domain stream into 2**bits bins, one pixel per clock.
+       Frames end on the falling edge of `vsync`. Bins rotate through three banks, counting, complete and
+       clearing: wishbone reads return the last complete frame, bin i at word i. While `freeze` is set the
+       complete bank is held and later frames are counted in the other two in turn.
+       The clearing bank is zeroed a bin at a time on the clocks without a pixel, so a frame needs 2**bits
+       clocks of blanking."""
+    def __init__(self, bits=8, count_width=20):
+        self.bus = bus = wishbone.Interface(data_width=32)
+        self.sink = sink = Endpoint([("data", 24)])
+        self.vsync = Signal()
+
+        self.freeze = CSRStorage()
+        self.frames = CSRStatus(32)
+
+        # Last complete frame, in the pixel domain. `done` pulses at vsync, `total` is its pixel count
+        # and `scan_dat` the count in bin `scan_adr`, a clock later.
+        self.done = Signal()
+        self.bank_done = Signal(2, reset=1)
+        self.total = Signal(count_width)
+        self.scan_adr = Signal(bits)
+        self.scan_dat = Signal(count_width)
+
+        # # #
+
+        bins = 2**bits
+        mem = Memory(width=count_width, depth=3*bins)
+        self.specials += mem
+        rdport = mem.get_port(clock_domain="pixel")
+        wrport = mem.get_port(write_capable=True, clock_domain="pixel")
+        busport = mem.get_port(clock_domain="sys")
+        scanport = mem.get_port(clock_domain="pixel")
+        self.specials += rdport, wrport, busport, scanport
+
+        freeze = Signal()
+        bank = Signal(2)
+        clear = Signal(2, reset=2)
+        sweep = Signal(bits + 1)
+        vsync_ = Signal()
+        frames = Signal(32)
+        pixels = Signal(count_width)
+        self.specials += MultiReg(self.freeze.storage, freeze, "pixel")
+
+        # Read the bin, then write it back incremented the next clock. A bin written the clock before
+        # hasn't landed in the read yet, so its count is forwarded.
+        valid = Signal()
+        bin = Signal(bits)
+        count = Signal(count_width)
+        wr_valid = Signal()
+        wr_bin = Signal(bits)
+        wr_count = Signal(count_width)
+        self.comb += [
+            sink.ready.eq(1),
+            rdport.adr.eq(Cat(sink.data[0:bits], bank)),
+            If(wr_valid & (wr_bin == bin),
+                count.eq(wr_count + 1)
+            ).Else(
+                count.eq(rdport.dat_r + 1)
+            ),
+            # Zero the clearing bank while no pixel is written
+            If(valid,
+                wrport.adr.eq(Cat(bin, bank)),
+                wrport.dat_w.eq(count),
+                wrport.we.eq(1),
+            ).Else(
+                wrport.adr.eq(Cat(sweep[:bits], clear)),
+                wrport.dat_w.eq(0),
+                wrport.we.eq(~sweep[bits]),
+            ),
+        ]
+
+        self.sync.pixel += [
+            valid.eq(sink.valid),
+            bin.eq(sink.data[0:bits]),
+            wr_valid.eq(valid),
+            wr_bin.eq(bin),
+            wr_count.eq(count),
+            self.done.eq(0),
+            If(sink.valid,
+                pixels.eq(pixels + 1)
+            ),
+            If(~valid & ~sweep[bits],
+                sweep.eq(sweep + 1)
+            ),
+
+            vsync_.eq(self.vsync),
+            If(vsync_ & ~self.vsync,
+                self.done.eq(1),
+                pixels.eq(0),
+                # The cleared bank counts the next frame, the bank it replaces is cleared
+                bank.eq(clear),
+                sweep.eq(0),
+                If(~freeze,
+                    clear.eq(self.bank_done),
+                    self.bank_done.eq(bank),
+                    self.total.eq(pixels),
+                    frames.eq(frames + 1),
+                ).Else(
+                    clear.eq(bank),
+                ),
+                # Nothing carries over into the next frame
+                wr_valid.eq(0),
+                valid.eq(0),
+            ),
+        ]
+
+        self.comb += [
+            scanport.adr.eq(Cat(self.scan_adr, self.bank_done)),
+            self.scan_dat.eq(scanport.dat_r),
+        ]
+
+        # Wishbone reads from the complete bank
+        bank_done = Signal(2)
+        self.specials += [
+            MultiReg(self.bank_done, bank_done),
+            MultiReg(frames, self.frames.status),
+        ]
+        self.comb += [
+            busport.adr.eq(Cat(bus.adr[:bits], bank_done)),
+            bus.dat_r.eq(busport.dat_r),
+        ]
+        self.sync += [
+            bus.ack.eq(0),
+            If(bus.cyc & bus.stb & ~bus.ack, bus.ack.eq(1))
+        ]
+
+
+## Unit tests
+
+class TestHistogram(unittest.TestCase):
+
+    def test_histogram(self):
+        frames = [
+            [1, 1, 1, 2, 1, 2, 2, 3],
+            [5, 5, 7, 1],
+            [9, 9, 9],
+            # Counted while frozen, never shown
+            [4, 4],
+        ]
+        results = []
+
+        def pixel(dut):
+            for f in frames + [[]]:
+                yield dut.vsync.eq(1)
+                for _ in range(4):
+                    yield
+                yield dut.vsync.eq(0)
+                # Leave time to read the frame before, and to clear a bank
+                for _ in range(300):
+                    yield
+                for i, v in enumerate(f + [0, 0]):
+                    yield dut.sink.data.eq(v)
+                    yield dut.sink.valid.eq(i < len(f))
+                    yield
+
+        def sys(dut):
+            for n in range(1, 5):
+                while (yield dut.frames.status) != n:
+                    yield
+                if n == 4:
+                    yield dut.freeze.storage.eq(1)
+                bins = []
+                for i in range(10):
+                    bins.append((yield from dut.bus.read(i)))
+                results.append(bins)
+            # Two more vsyncs while frozen
+            for _ in range(1000):
+                yield
+            bins = []
+            for i in range(10):
+                bins.append((yield from dut.bus.read(i)))
+            results.append(bins)
+            results.append((yield dut.frames.status))
+
+        dut = Histogram()
+        run_simulation(dut, {"pixel": pixel(dut), "sys": sys(dut)}, clocks={"pixel": 10, "sys": 10})
+
+        # The first complete frame is the empty one before the first vsync
+        self.assertEqual(results[0], [0]*10)
+        self.assertEqual(results[1], [0, 4, 3, 1, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(results[2], [0, 1, 0, 0, 0, 2, 0, 1, 0, 0])
+        self.assertEqual(results[3], [0, 0, 0, 0, 0, 0, 0, 0, 0, 3])
+        self.assertEqual(results[4], results[3])
+        self.assertEqual(results[5], 4)
+
+    def test_reuse(self):
+        # Bin 5 is only counted in the first frame, each bank is reused more than twice after it
+        frames = [[5, 5, 5]] + [[1]]*6
+        results = []
+        scans = []
+
+        def pixel(dut):
+            for f in frames + [[]]:
+                yield dut.vsync.eq(1)
+                yield
+                yield dut.vsync.eq(0)
+                yield
+                yield dut.scan_adr.eq(5)
+                yield
+                yield
+                scans.append((yield dut.scan_dat))
+                for _ in range(300):
+                    yield
+                for i, v in enumerate(f + [0, 0]):
+                    yield dut.sink.data.eq(v)
+                    yield dut.sink.valid.eq(i < len(f))
+                    yield
+
+        def sys(dut):
+            for n in range(2, len(frames) + 2):
+                while (yield dut.frames.status) != n:
+                    yield
+                bins = []
+                for i in range(6):
+                    bins.append((yield from dut.bus.read(i)))
+                results.append(bins)
+
+        dut = Histogram()
+        run_simulation(dut, {"pixel": pixel(dut), "sys": sys(dut)}, clocks={"pixel": 10, "sys": 10})
+
+        self.assertEqual(results, [[0, 0, 0, 0, 0, 3]] + [[0, 1, 0, 0, 0, 0]]*6)
+        self.assertEqual(scans, [0, 3] + [0]*6)
@@ -0,0 +1,107 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import unittest
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.stream import Endpoint
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage
+
+class Palette(Module, AutoCSR):
+    """False colour LUT on the luminance in data[0:bits] of a `pixel` domain stream. Each palette entry is
+       written over wishbone as 0x00BBGGRR, matching the RGB stream. There are two banks of 2**bits
+       entries, `bank` selects the one displayed. `enable` and `bank` are picked up on the falling edge
+       of `vsync`, so a palette can be loaded into the other bank and swapped in between frames."""
+    def __init__(self, bits=8):
+        self.bus = bus = wishbone.Interface(data_width=32)
+        self.sink = sink = Endpoint([("data", 24)])
+        self.source = source = Endpoint([("data", 24)])
+        self.vsync = Signal()
+        self.enabled = enabled = Signal()
+
+        self.enable = CSRStorage()
+        self.bank = CSRStorage()
+
+        # # #
+
+        entries = 2**bits
+        mem = Memory(width=24, depth=2*entries)
+        self.specials += mem
+        wrport = mem.get_port(write_capable=True, clock_domain="sys")
+        rdport = mem.get_port(clock_domain="pixel")
+        self.specials += wrport, rdport
+
+        # Acknowledge immediately, write only
+        self.sync += [
+            bus.ack.eq(0),
+            wrport.we.eq(0),
+            If(bus.cyc & bus.stb & ~bus.ack,
+                bus.ack.eq(1),
+                wrport.we.eq(bus.we),
+            ),
+            wrport.adr.eq(bus.adr),
+            wrport.dat_w.eq(bus.dat_w),
+        ]
+
+        enable = Signal()
+        bank = Signal()
+        bank_shown = Signal()
+        vsync_ = Signal()
+        self.specials += [
+            MultiReg(self.enable.storage, enable, "pixel"),
+            MultiReg(self.bank.storage, bank, "pixel"),
+        ]
+
+        self.comb += [
+            rdport.adr.eq(Cat(sink.data[0:bits], bank_shown)),
+            source.data.eq(rdport.dat_r),
+            sink.ready.eq(1),
+        ]
+
+        self.sync.pixel += [
+            vsync_.eq(self.vsync),
+            If(vsync_ & ~self.vsync,
+                enabled.eq(enable),
+                bank_shown.eq(bank),
+            ),
+            source.valid.eq(sink.valid),
+            source.first.eq(sink.first),
+            source.last.eq(sink.last),
+        ]
+
+
+## Unit tests
+
+class TestPalette(unittest.TestCase):
+
+    def test_bank_swap(self):
+        out = {}
+
+        def sys(dut):
+            for i in range(4):
+                yield from dut.bus.write(i, 0x010101*i)
+                yield from dut.bus.write(256 + i, 0x112233 + i)
+            yield dut.enable.storage.eq(1)
+
+        def pixel(dut):
+            for cycle in range(120):
+                yield dut.vsync.eq(cycle not in [40, 80])
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(cycle % 4)
+                if cycle == 50:
+                    yield dut.bank.storage.eq(1)
+                yield
+                if (yield dut.source.valid):
+                    out[cycle] = (yield dut.enabled), (yield dut.source.data)
+
+        dut = Palette()
+        run_simulation(dut, {"sys": sys(dut), "pixel": pixel(dut)}, clocks={"sys": 10, "pixel": 10})
+
+        # Entries follow the luminance of the previous clock
+        self.assertEqual(out[45][1], 0x010101*((45 - 1) % 4))
+        self.assertEqual(out[85][1], 0x112233 + ((85 - 1) % 4))
+        self.assertEqual(out[30][0], 0)
+        self.assertEqual(out[45][0], 1)
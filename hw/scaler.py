@@ -5,9 +5,12 @@ from migen import *
 from litex.soc.interconnect.stream import Endpoint
 from migen.genlib.cdc import MultiReg
 from edge_detect import EdgeDetect
+from dsp import shift_add, multiplier_estimate
 
 from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus, CSRStorage
-from litex.soc.interconnect.stream import Endpoint, EndpointDescription, AsyncFIFO
+from litex.soc.interconnect.stream import Endpoint, EndpointDescription, AsyncFIFO, SyncFIFO
+
+from math import sin, pi
 
 @ResetInserter()
 class ScalerWidth(Module, AutoCSR):
@@ -312,6 +315,587 @@ class ScalerHeight(Module, AutoCSR):
 
 
 
+# Polyphase scaler --------------------------------------------------------------------------------
+#
+# Separable N-tap FIR scaler. Coefficients are computed here at elaboration time for the configured
+# ratio and stored in a BRAM ROM indexed by phase. The MACs are plain signed multiplies which yosys
+# maps onto the ECP5 MULT18X18D blocks, taps * 3 per filter, one filter per pixel per direction. The
+# LFE5U-25 only has 28 of them, filters without a `dsp` flag use shift-add multiplies in LUTs instead.
+
+POLYPHASE_ACC_BITS   = 16
+POLYPHASE_COEFF_BITS = 12
+POLYPHASE_COEFF_FRAC = 10
+
+def _lanczos(x, a):
+    if x == 0:
+        return 1.0
+    if abs(x) >= a:
+        return 0.0
+    px = pi * x
+    return a * sin(px) * sin(px / a) / (px * px)
+
+def _bicubic(x, a=-0.5):
+    x = abs(x)
+    if x < 1:
+        return (a + 2)*x**3 - (a + 3)*x**2 + 1
+    if x < 2:
+        return a*x**3 - 5*a*x**2 + 8*a*x - 4*a
+    return 0.0
+
+def polyphase_coefficients(taps=4, phases=32, kernel="lanczos", frac_bits=POLYPHASE_COEFF_FRAC):
+    """Fixed point filter bank, one row of `taps` coefficients per phase, each row summing to 1.0.
+       Tap `taps//2 - 1` is the pixel at floor(position)."""
+    rows = []
+    for p in range(phases):
+        f = p / phases
+        weights = []
+        for t in range(taps):
+            x = (t - (taps//2 - 1)) - f
+            if kernel == "lanczos":
+                weights.append(_lanczos(x, taps//2))
+            elif kernel == "bicubic":
+                weights.append(_bicubic(x))
+            else:
+                raise ValueError("Unknown kernel {}".format(kernel))
+        s = sum(weights)
+        row = [int(round(w / s * 2**frac_bits)) for w in weights]
+        # Put the rounding error into the nearest tap, so flat areas stay flat
+        row[taps//2 - 1 + (f >= 0.5)] += 2**frac_bits - sum(row)
+        rows.append(row)
+    return rows
+
+def polyphase_step(size_in, size_out):
+    """Source position increment per output pixel"""
+    return int(2**POLYPHASE_ACC_BITS * size_in / size_out)
+
+def _pack_coefficients(rows, width=POLYPHASE_COEFF_BITS):
+    init = []
+    for row in rows:
+        word = 0
+        for t, c in enumerate(row):
+            word |= (c & (2**width - 1)) << (t*width)
+        init.append(word)
+    return init
+
+
+class PolyphaseFilter(Module):
+    """Sum of `taps` RGB pixels weighted by signed coefficients. Two cycle latency, advances on ce.
+       Without `dsp` the multiplies are built from LUTs."""
+    def __init__(self, taps=4, coeff_width=POLYPHASE_COEFF_BITS, coeff_frac=POLYPHASE_COEFF_FRAC, dsp=True):
+        self.ce = ce = Signal()
+        self.pixels = pixels = [Signal(24) for _ in range(taps)]
+        self.coeffs = coeffs = [Signal((coeff_width, True)) for _ in range(taps)]
+        self.out = out = Signal(24)
+
+        for c in range(3):
+            products = []
+            for t in range(taps):
+                pixel = Signal((9, True))
+                product = Signal((9 + coeff_width, True))
+                self.comb += pixel.eq(pixels[t][8*c:8*(c+1)])
+                if dsp:
+                    self.sync += If(ce, product.eq(pixel * coeffs[t]))
+                else:
+                    self.sync += If(ce, product.eq(shift_add(pixels[t][8*c:8*(c+1)], coeffs[t])))
+                products.append(product)
+
+            acc = Signal((9 + coeff_width + bits_for(taps), True))
+            self.sync += If(ce, acc.eq(sum(products) + 2**(coeff_frac - 1)))
+
+            # Clamp to 0..255
+            self.comb += [
+                If(acc[-1],
+                    out[8*c:8*(c+1)].eq(0)
+                ).Elif((acc >> coeff_frac) > 255,
+                    out[8*c:8*(c+1)].eq(255)
+                ).Else(
+                    out[8*c:8*(c+1)].eq(acc[coeff_frac:coeff_frac+8])
+                )
+            ]
+
+
+@ResetInserter()
+class ScalerPolyphaseWidth(Module):
+    """Upscales a line, output is `ppc` pixels per word. With ppc > 1 the window carries one extra
+       pixel, when a word needs more than one new input pixel the extra ones are shifted in
+       before it is output. `length_in` and `step` can be lowered at runtime to zoom in on a
+       narrower source line, `line_in` is the maximum. `dsp` flags which pixels' filters use DSP blocks,
+       by default all."""
+    def __init__(self, line_in=640, line_out=800, taps=4, phases=32, kernel="lanczos", ppc=1, dsp=None):
+        self.sink = sink = Endpoint([("data", 32)])
+        self.source = source = Endpoint([("data", 32*ppc)])
+        self.length_in = length_in = Signal(max=line_in + 1, reset=line_in)
+        self.step = step = Signal(POLYPHASE_ACC_BITS + 1, reset=polyphase_step(line_in, line_out))
+
+        assert line_out >= line_in, "Only upscaling is supported"
+        assert line_out % ppc == 0
+        assert taps % 2 == 0
+        phase_bits = log2_int(phases)
+        words_out = line_out // ppc
+        window_len = taps + ppc - 1
+        prime_len = taps//2 + ppc - 1
+
+        rom = Memory(taps*POLYPHASE_COEFF_BITS, phases,
+            init=_pack_coefficients(polyphase_coefficients(taps, phases, kernel)), name="coefficients")
+        rom_ports = [rom.get_port(has_re=True) for _ in range(ppc)]
+        self.specials += rom, rom_ports
+
+        self.firs = firs = [PolyphaseFilter(taps, dsp=d) for d in dsp or [True]*ppc]
+        self.submodules += firs
+
+        window = [Signal(24, name="window{}".format(i)) for i in range(window_len)]
+        new_pixel = Signal(24)
+
+        acc = Signal(POLYPHASE_ACC_BITS)
+        acc_next = Signal(POLYPHASE_ACC_BITS + bits_for(ppc))
+        # Position of each pixel in the output word, relative to floor(acc)
+        pos = [Signal(POLYPHASE_ACC_BITS + 1, name="pos{}".format(j)) for j in range(ppc)]
+        primed = Signal(max=prime_len + 2)
+        in_count = Signal(max=line_in + 1)
+        out_count = Signal(max=words_out + 1)
+        # Input pixels still to be shifted in before the next word
+        debt = Signal(max=max(ppc, 2))
+
+        advance = Signal()
+        in_avail = Signal()
+        carry = Signal()
+        fire = Signal()
+        shift = Signal()
+        broadcast = Signal()
+
+        self.comb += [
+            advance.eq(source.ready),
+            in_avail.eq(in_count < length_in),
+            acc_next.eq(acc + ppc*step),
+            carry.eq(acc_next[POLYPHASE_ACC_BITS:] != 0),
+            [p.eq(acc + j*step) for j, p in enumerate(pos)],
+        ]
+
+        self.comb += [
+            If(out_count == words_out,
+                # Drop anything left over from the line
+                sink.ready.eq(in_avail),
+            ).Elif(primed <= prime_len,
+                # First pixel fills the whole window, then half a window of lookahead
+                sink.ready.eq(in_avail),
+                shift.eq(sink.valid | ~in_avail),
+                broadcast.eq(primed == 0),
+            ).Elif(debt != 0,
+                sink.ready.eq(in_avail),
+                shift.eq(sink.valid | ~in_avail),
+            ).Else(
+                sink.ready.eq(advance & carry & in_avail),
+                fire.eq(advance & (~(carry & in_avail) | sink.valid)),
+                shift.eq(fire & carry),
+            ),
+            # Replicate the last pixel past the end of the line
+            new_pixel.eq(Mux(in_avail, sink.data[0:24], window[-1])),
+        ]
+
+        self.sync += [
+            If(sink.valid & sink.ready,
+                in_count.eq(in_count + 1)
+            ),
+            If(shift,
+                If(broadcast,
+                    [w.eq(new_pixel) for w in window]
+                ).Else(
+                    [window[i].eq(window[i+1]) for i in range(window_len-1)],
+                    window[-1].eq(new_pixel)
+                ),
+                If(primed <= prime_len,
+                    primed.eq(primed + 1)
+                )
+            ),
+            If(fire,
+                acc.eq(acc_next),
+                out_count.eq(out_count + 1),
+                If(carry,
+                    debt.eq(acc_next[POLYPHASE_ACC_BITS:] - 1)
+                )
+            ).Elif(shift & (debt != 0) & (primed > prime_len),
+                debt.eq(debt - 1)
+            ),
+            If((out_count == words_out) & ~in_avail,
+                acc.eq(0),
+                debt.eq(0),
+                primed.eq(0),
+                in_count.eq(0),
+                out_count.eq(0),
+            )
+        ]
+
+        # Pipeline: coefficient/window fetch -> multiply -> accumulate
+        s1_window = [Signal(24, name="s1_window{}".format(i)) for i in range(window_len)]
+        s1_offset = [Signal(name="s1_offset{}".format(j)) for j in range(ppc)]
+        valid = Signal(3)
+        last = Signal(3)
+        for p, port in zip(pos, rom_ports):
+            self.comb += [
+                port.adr.eq(p[POLYPHASE_ACC_BITS - phase_bits:POLYPHASE_ACC_BITS]),
+                port.re.eq(advance),
+            ]
+        self.sync += If(advance,
+            [s.eq(w) for s, w in zip(s1_window, window)],
+            [o.eq(p[-1]) for o, p in zip(s1_offset, pos)],
+            valid.eq(Cat(fire, valid[0:2])),
+            last.eq(Cat(fire & (out_count == words_out - 1), last[0:2])),
+        )
+
+        for j, (fir, port) in enumerate(zip(firs, rom_ports)):
+            if j == 0:
+                pixels = s1_window[:taps]
+            else:
+                pixels = [Mux(s1_offset[j], s1_window[t+1], s1_window[t]) for t in range(taps)]
+            self.comb += [
+                fir.ce.eq(advance),
+                [p.eq(s) for p, s in zip(fir.pixels, pixels)],
+                [c.eq(port.dat_r[t*POLYPHASE_COEFF_BITS:(t+1)*POLYPHASE_COEFF_BITS])
+                    for t, c in enumerate(fir.coeffs)],
+            ]
+
+        self.comb += [
+            source.data.eq(Cat(*[Cat(fir.out, C(0, 8)) for fir in firs])),
+            source.valid.eq(valid[2]),
+            source.last.eq(last[2]),
+        ]
+
+
+@ResetInserter()
+class ScalerPolyphaseHeight(Module):
+    """Vertical stage, sink and source carry `ppc` pixels per word. `length_in` and `step` can be
+       lowered at runtime, `height_in` is the maximum. `dsp` flags which pixels' filters use DSP blocks,
+       by default all."""
+    def __init__(self, line_length=800, height_in=512, height_out=600, taps=4, phases=32, kernel="lanczos", ppc=1,
+                 dsp=None):
+        self.sink = sink = Endpoint([("data", 32*ppc)])
+        self.source = source = Endpoint([("data", 32*ppc)])
+        self.length_in = length_in = Signal(max=height_in + 1, reset=height_in)
+        self.step = step = Signal(POLYPHASE_ACC_BITS + 1, reset=polyphase_step(height_in, height_out))
+
+        assert height_out >= height_in, "Only upscaling is supported"
+        assert taps % 2 == 0
+        assert line_length % ppc == 0
+        line_length //= ppc
+        phase_bits = log2_int(phases)
+
+        # One more line than taps, so the next line can be filled while the window is output
+        n_buffers = taps + 1
+
+        rom = Memory(taps*POLYPHASE_COEFF_BITS, phases,
+            init=_pack_coefficients(polyphase_coefficients(taps, phases, kernel)), name="coefficients")
+        rom_port = rom.get_port(has_re=True)
+        self.specials += rom, rom_port
+
+        self.firs = firs = [PolyphaseFilter(taps, dsp=d) for d in dsp or [True]*ppc]
+        self.submodules += firs
+
+        advance = Signal()
+        self.comb += advance.eq(source.ready)
+
+        # Input: fill line buffers in turn, `line_length` words of `ppc` pixels
+        wr_buf = Signal(max=n_buffers)
+        in_x = Signal(max=line_length)
+        lines_in = Signal(max=height_in + 1)
+        pending = Signal()
+        pending_buf = Signal(max=n_buffers)
+        clear_pending = Signal()
+
+        out_x = Signal(max=line_length)
+        read_ports = []
+        for i in range(n_buffers):
+            linebuffer = Memory(24*ppc, line_length, name="linebuffer{}".format(i))
+            wr = linebuffer.get_port(write_capable=True)
+            rd = linebuffer.get_port(has_re=True)
+            self.specials += linebuffer, wr, rd
+            self.comb += [
+                wr.adr.eq(in_x),
+                wr.dat_w.eq(Cat(*[sink.data[32*j:32*j+24] for j in range(ppc)])),
+                wr.we.eq(sink.valid & sink.ready & (lines_in < length_in) & (wr_buf == i)),
+                rd.adr.eq(out_x),
+                rd.re.eq(advance),
+            ]
+            read_ports.append(rd.dat_r)
+
+        self.comb += sink.ready.eq(~pending | (lines_in == length_in))
+
+        self.sync += [
+            If(sink.valid & sink.ready & (lines_in < length_in),
+                in_x.eq(in_x + 1),
+                If(in_x == line_length - 1,
+                    in_x.eq(0),
+                    lines_in.eq(lines_in + 1),
+                    pending.eq(1),
+                    pending_buf.eq(wr_buf),
+                    wr_buf.eq(wr_buf + 1),
+                    If(wr_buf == n_buffers - 1,
+                        wr_buf.eq(0)
+                    )
+                )
+            ),
+            If(clear_pending,
+                pending.eq(0)
+            )
+        ]
+
+        # Window: which line buffer feeds each tap
+        tap_buf = [Signal(max=n_buffers, name="tap_buf{}".format(i)) for i in range(taps)]
+        primed = Signal(max=taps//2 + 2)
+        acc = Signal(POLYPHASE_ACC_BITS)
+        acc_next = Signal(POLYPHASE_ACC_BITS + 1)
+        lines_out = Signal(max=height_out + 1)
+        fire = Signal()
+
+        self.comb += acc_next.eq(acc + step)
+
+        def shift_window(new_buf, broadcast=False):
+            if broadcast:
+                return [NextValue(t, new_buf) for t in tap_buf]
+            return [NextValue(tap_buf[i], tap_buf[i+1]) for i in range(taps-1)] + \
+                   [NextValue(tap_buf[-1], new_buf)]
+
+        self.submodules.fsm = fsm = FSM(reset_state="PRIME")
+        fsm.act("PRIME",
+            If(primed > taps//2,
+                NextState("LINE")
+            ).Elif(pending,
+                clear_pending.eq(1),
+                NextValue(primed, primed + 1),
+                If(primed == 0,
+                    shift_window(pending_buf, broadcast=True)
+                ).Else(
+                    shift_window(pending_buf)
+                )
+            )
+        )
+        fsm.act("LINE",
+            fire.eq(advance),
+            If(advance,
+                NextValue(out_x, out_x + 1),
+                If(out_x == line_length - 1,
+                    NextValue(out_x, 0),
+                    NextValue(lines_out, lines_out + 1),
+                    NextValue(acc, acc_next),
+                    If(lines_out == height_out - 1,
+                        NextState("DONE")
+                    ).Elif(acc_next[-1],
+                        NextState("ADVANCE")
+                    )
+                )
+            )
+        )
+        fsm.act("ADVANCE",
+            If(pending,
+                clear_pending.eq(1),
+                shift_window(pending_buf),
+                NextState("LINE")
+            ).Elif(lines_in == length_in,
+                # Replicate the bottom line
+                shift_window(tap_buf[-1]),
+                NextState("LINE")
+            )
+        )
+        fsm.act("DONE",
+            # Hold until reset at the next frame
+            NextState("DONE")
+        )
+
+        # Pipeline: line buffer/coefficient fetch -> multiply -> accumulate
+        s1_tap_buf = [Signal(max=n_buffers, name="tap_buf{}".format(i)) for i in range(taps)]
+        valid = Signal(3)
+        last = Signal(3)
+        self.comb += [
+            rom_port.adr.eq(acc[POLYPHASE_ACC_BITS - phase_bits:]),
+            rom_port.re.eq(advance),
+        ]
+        self.sync += If(advance,
+            [s.eq(t) for s, t in zip(s1_tap_buf, tap_buf)],
+            valid.eq(Cat(fire, valid[0:2])),
+            last.eq(Cat(fire & (out_x == line_length - 1), last[0:2])),
+        )
+
+        read_data = Array(read_ports)
+        tap_data = [Signal(24*ppc, name="tap_data{}".format(i)) for i in range(taps)]
+        self.comb += [d.eq(read_data[s]) for d, s in zip(tap_data, s1_tap_buf)]
+        for j, fir in enumerate(firs):
+            self.comb += [
+                fir.ce.eq(advance),
+                [p.eq(d[24*j:24*(j+1)]) for p, d in zip(fir.pixels, tap_data)],
+                [c.eq(rom_port.dat_r[t*POLYPHASE_COEFF_BITS:(t+1)*POLYPHASE_COEFF_BITS])
+                    for t, c in enumerate(fir.coeffs)],
+            ]
+
+        self.comb += [
+            source.data.eq(Cat(*[Cat(fir.out, C(0, 8)) for fir in firs])),
+            source.valid.eq(valid[2]),
+            source.last.eq(last[2]),
+        ]
+
+
+class PolyphaseScaler(Module, AutoCSR):
+    """Drop-in replacement for the ScalerWidth -> SyncFIFO -> ScalerHeight chain.
+       Takes one pixel per clock, outputs `ppc` pixels per clock.
+
+       For zoom the source size can be reduced to a crop of the frame, with the matching
+       step = (size_in << 16) / size_out. These are picked up together on `load`.
+
+       Filters get MULT18X18D blocks while `dsp` of them are left, horizontal ones first, the rest
+       multiply in LUTs. By default they all use them."""
+    def __init__(self, width_in=640, height_in=512, width_out=800, height_out=600,
+                 taps=4, phases=32, kernel="lanczos", ppc=1, dsp=None):
+        self.sink = sink = Endpoint([("data", 32)])
+        self.source = source = Endpoint([("data", 32*ppc)])
+        self.reset = Signal()
+        self.load = Signal()
+
+        self.enable = CSRStorage(1)
+        self.width_in = CSRStorage(bits_for(width_in), reset=width_in)
+        self.height_in = CSRStorage(bits_for(height_in), reset=height_in)
+        self.step_x = CSRStorage(POLYPHASE_ACC_BITS + 1, reset=polyphase_step(width_in, width_out))
+        self.step_y = CSRStorage(POLYPHASE_ACC_BITS + 1, reset=polyphase_step(height_in, height_out))
+
+        blocks = 3*taps
+        flags = [dsp is None or blocks*(n + 1) <= dsp for n in range(2*ppc)]
+        self.submodules.width = width = ScalerPolyphaseWidth(width_in, width_out, taps, phases, kernel, ppc, dsp=flags[:ppc])
+        self.submodules.fifo = fifo = ResetInserter()(SyncFIFO([("data", 32*ppc)], depth=16))
+        self.submodules.height = height = ScalerPolyphaseHeight(width_out, height_in, height_out, taps, phases, kernel, ppc,
+            dsp=flags[ppc:])
+
+        # Shadow the source geometry, so a change only lands between frames
+        for csr, target in [(self.width_in, width.length_in), (self.step_x, width.step),
+                            (self.height_in, height.length_in), (self.step_y, height.step)]:
+            value = Signal(len(csr.storage))
+            active = Signal(len(target), reset=target.reset.value)
+            self.specials += MultiReg(csr.storage, value)
+            self.sync += If(self.load, active.eq(value))
+            self.comb += target.eq(active)
+
+        self.comb += [
+            sink.connect(width.sink),
+            width.source.connect(fifo.sink),
+            fifo.source.connect(height.sink),
+            height.source.connect(source),
+
+            width.reset.eq(self.reset),
+            fifo.reset.eq(self.reset),
+            height.reset.eq(self.reset),
+        ]
+
+
+
+class ScalerInteger(Module, AutoCSR):
+    """Nearest-neighbour integer scaler. Each pixel is emitted `factor` times, the first pass of a
+       line is taken straight from the sink and the repeats are replayed from a single line buffer.
+       Output is clipped to width_out x height_out, so the sink should only carry the crop that is
+       seen, `width_in` pixels a line, at most ceil(width_out/factor). Wider lines still take
+       `factor` clocks an input pixel and overrun the output line.
+
+       `factor` and `width_in` are picked up together on `load`, a `factor` of 0 counts as 1 and
+       anything over `max_factor` as `max_factor`, a `width_in` of 0 or over `line_in` as `line_in`."""
+    def __init__(self, line_in=640, width_out=800, height_out=600, max_factor=4):
+        self.sink = sink = Endpoint([("data", 32)])
+        self.source = source = Endpoint([("data", 32)])
+        self.reset = Signal()
+        self.load = Signal()
+
+        self.factor = CSRStorage(bits_for(max_factor), reset=1)
+        self.width_in = CSRStorage(bits_for(line_in), reset=line_in)
+
+        factor = Signal(bits_for(max_factor))
+        width = Signal(bits_for(line_in))
+        n = Signal(bits_for(max_factor), reset=1)
+        w = Signal(max=line_in + 1, reset=line_in)
+        self.specials += [
+            MultiReg(self.factor.storage, factor),
+            MultiReg(self.width_in.storage, width),
+        ]
+
+        linebuffer = Memory(24, line_in, name="linebuffer")
+        wr = linebuffer.get_port(write_capable=True)
+        rd = linebuffer.get_port()
+        self.specials += linebuffer, wr, rd
+
+        x = Signal(max=line_in)
+        x_next = Signal(max=line_in)
+        rep_x = Signal(max=max_factor)
+        rep_y = Signal(max=max_factor)
+        out_x = Signal(max=width_out + 1)
+        out_y = Signal(max=height_out + 1)
+
+        live = Signal()
+        visible = Signal()
+        pixel_valid = Signal()
+        step = Signal()
+        last_rep = Signal()
+
+        self.comb += [
+            live.eq(rep_y == 0),
+            last_rep.eq(rep_x == n - 1),
+            visible.eq((out_x < width_out) & (out_y < height_out)),
+            pixel_valid.eq(Mux(live, sink.valid, 1)),
+            step.eq(pixel_valid & (source.ready | ~visible)),
+
+            source.valid.eq(pixel_valid & visible),
+            source.data.eq(Mux(live, sink.data, rd.dat_r)),
+            source.last.eq((x == w - 1) & last_rep),
+
+            # Only the first pass of a line comes from the sink
+            sink.ready.eq(live & last_rep & (source.ready | ~visible)),
+
+            wr.adr.eq(x),
+            wr.dat_w.eq(sink.data),
+            wr.we.eq(live & sink.valid & (rep_x == 0)),
+
+            # Look ahead one pixel, so replayed data is ready when it is needed
+            x_next.eq(x),
+            If(step & last_rep,
+                If(x == w - 1,
+                    x_next.eq(0)
+                ).Else(
+                    x_next.eq(x + 1)
+                )
+            ),
+            If(self.reset,
+                x_next.eq(0)
+            ),
+            rd.adr.eq(x_next),
+        ]
+
+        self.sync += [
+            x.eq(x_next),
+            If(step,
+                rep_x.eq(rep_x + 1),
+                If(out_x < width_out,
+                    out_x.eq(out_x + 1)
+                ),
+                If(last_rep,
+                    rep_x.eq(0),
+                    If(x == w - 1,
+                        out_x.eq(0),
+                        If(out_y < height_out,
+                            out_y.eq(out_y + 1)
+                        ),
+                        rep_y.eq(rep_y + 1),
+                        If(rep_y == n - 1,
+                            rep_y.eq(0)
+                        )
+                    )
+                )
+            ),
+            If(self.reset,
+                rep_x.eq(0),
+                rep_y.eq(0),
+                out_x.eq(0),
+                out_y.eq(0),
+            ),
+            If(self.load,
+                n.eq(Mux(factor == 0, 1, Mux(factor > max_factor, max_factor, factor))),
+                w.eq(Mux((width == 0) | (width > line_in), line_in, width))
+            )
+        ]
+
+
+
 ## Unit tests 
 
 
@@ -390,6 +974,245 @@ class Test1(unittest.TestCase):
         run_simulation(dut, [generator(dut), logger(dut)], vcd_name='test1.vcd')
     
 
+def polyphase_reference(pixels, size_out, taps=4, phases=32, kernel="lanczos"):
+    coeffs = polyphase_coefficients(taps, phases, kernel)
+    step = polyphase_step(len(pixels), size_out)
+    out = []
+    for k in range(size_out):
+        pos = k * step
+        base = pos >> POLYPHASE_ACC_BITS
+        phase = (pos & (2**POLYPHASE_ACC_BITS - 1)) >> (POLYPHASE_ACC_BITS - log2_int(phases))
+        value = 0
+        for c in range(3):
+            acc = 2**(POLYPHASE_COEFF_FRAC - 1)
+            for t in range(taps):
+                i = min(max(base + t - (taps//2 - 1), 0), len(pixels) - 1)
+                acc += coeffs[phase][t] * ((pixels[i] >> 8*c) & 0xFF)
+            value |= min(max(acc >> POLYPHASE_COEFF_FRAC, 0), 255) << 8*c
+        out.append(value)
+    return out
+
+class TestPolyphase(unittest.TestCase):
+
+    def test_width(self):
+        line = [(i*37 & 0xFF) | ((255 - i*11) & 0xFF) << 8 | (i*i & 0xFF) << 16 for i in range(16)]
+        expected = polyphase_reference(line, 20) * 2
+        d = []
+
+        def generator(dut):
+            for _ in range(2):
+                for i in line:
+                    yield from write_stream(dut.sink, i)
+
+        def logger(dut):
+            yield dut.source.ready.eq(1)
+            while len(d) < len(expected):
+                if (yield dut.source.valid):
+                    d.append((yield dut.source.data))
+                yield
+
+        dut = ScalerPolyphaseWidth(16, 20)
+        run_simulation(dut, [generator(dut), logger(dut)])
+        self.assertEqual(d, expected)
+
+    def test_height(self):
+        width, height_in, height_out = 4, 8, 10
+        column = [(i*29 & 0xFF) | (i*7 & 0xFF) << 8 | (200 - i*13) << 16 for i in range(height_in)]
+        expected = []
+        for v in polyphase_reference(column, height_out):
+            expected += [v] * width
+        d = []
+
+        def generator(dut):
+            for v in column:
+                for _ in range(width):
+                    yield from write_stream(dut.sink, v)
+
+        def logger(dut):
+            for n in range(400):
+                yield dut.source.ready.eq(n % 3 != 0)
+                yield
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    d.append((yield dut.source.data))
+
+        dut = ScalerPolyphaseHeight(width, height_in, height_out)
+        run_simulation(dut, [generator(dut), logger(dut)])
+        self.assertEqual(d, expected)
+
+    def test_zoom(self):
+        # 16 pixel maximum, cropped down to 8 at runtime
+        line = [(i*37 & 0xFF) | ((255 - i*11) & 0xFF) << 8 | (i*i & 0xFF) << 16 for i in range(8)]
+        expected = polyphase_reference(line, 20) * 2
+        d = []
+
+        def generator(dut):
+            yield dut.length_in.eq(8)
+            yield dut.step.eq(polyphase_step(8, 20))
+            for _ in range(2):
+                for i in line:
+                    yield from write_stream(dut.sink, i)
+
+        def logger(dut):
+            yield dut.source.ready.eq(1)
+            while len(d) < len(expected):
+                yield
+                if (yield dut.source.valid):
+                    d.append((yield dut.source.data))
+
+        dut = ScalerPolyphaseWidth(16, 20)
+        run_simulation(dut, [generator(dut), logger(dut)])
+        self.assertEqual(d, expected)
+
+    def test_ppc(self):
+        line = [(i*37 & 0xFF) | ((255 - i*11) & 0xFF) << 8 | (i*i & 0xFF) << 16 for i in range(16)]
+        expected = polyphase_reference(line, 24) * 2
+        d = []
+
+        def generator(dut):
+            for _ in range(2):
+                for i in line:
+                    yield from write_stream(dut.sink, i)
+
+        def logger(dut):
+            for n in range(400):
+                yield dut.source.ready.eq(n % 4 != 0)
+                yield
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    data = (yield dut.source.data)
+                    d.extend([data & 0xFFFFFFFF, data >> 32])
+
+        # One lane on DSP blocks, one in LUTs
+        dut = ScalerPolyphaseWidth(16, 24, ppc=2, dsp=[True, False])
+        run_simulation(dut, [generator(dut), logger(dut)])
+        self.assertEqual(d, expected)
+
+        # Each lane of the height stage filters independently
+        columns = [line[0:8], line[8:16]]
+        expected = []
+        for a, b in zip(*[polyphase_reference(c, 10) for c in columns]):
+            expected += [a | b << 32] * 2
+        d = []
+
+        def generator(dut):
+            for a, b in zip(*columns):
+                for _ in range(2):
+                    yield from write_stream(dut.sink, a | b << 32)
+
+        def logger(dut):
+            for n in range(200):
+                yield dut.source.ready.eq(n % 3 != 0)
+                yield
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    d.append((yield dut.source.data))
+
+        dut = ScalerPolyphaseHeight(4, 8, 10, ppc=2, dsp=[False, False])
+        run_simulation(dut, [generator(dut), logger(dut)])
+        self.assertEqual(d, expected)
+
+    def test_dsp(self):
+        # Whole filters of 12 multiplies, horizontal first
+        for ppc, dsp, blocks in [(1, None, 24), (2, None, 48), (2, 19, 12), (1, 19, 12), (2, 24, 24)]:
+            dut = PolyphaseScaler(16, 8, 24, 10, ppc=ppc, dsp=dsp)
+            self.assertEqual(multiplier_estimate(dut)[0], blocks)
+
+
+from framer import Framer
+from video_timing import VideoTimingGenerator
+
+class TestInteger(unittest.TestCase):
+
+    def test_integer(self):
+        lines = [[y*16 + x for x in range(4)] for y in range(3)]
+        expected = []
+        for line in lines:
+            for _ in range(2):
+                expected += [[p for p in line for _ in range(2)][:6]]
+        expected = expected[:5]
+
+        # A factor over max_factor is clamped
+        for factor, max_factor in [(2, 4), (3, 2)]:
+            d = []
+
+            def generator(dut):
+                yield dut.factor.storage.eq(factor)
+                for _ in range(4):
+                    yield
+                yield dut.reset.eq(1)
+                yield dut.load.eq(1)
+                yield
+                yield dut.reset.eq(0)
+                yield dut.load.eq(0)
+                for line in lines:
+                    for p in line:
+                        yield from write_stream(dut.sink, p)
+
+            def logger(dut):
+                for n in range(200):
+                    yield dut.source.ready.eq(n % 4 != 0)
+                    yield
+                    if (yield dut.source.valid) and (yield dut.source.ready):
+                        d.append((yield dut.source.data))
+
+            dut = ScalerInteger(line_in=4, width_out=6, height_out=5, max_factor=max_factor)
+            run_simulation(dut, [generator(dut), logger(dut)])
+            self.assertEqual(d, sum(expected, []))
+
+    def test_framer(self):
+        # A 12x9 output with 4 clocks of horizontal blanking, the sink always has data like the DMA
+        t = {"h_active": 12, "h_front_porch": 1, "h_sync": 1, "h_back_porch": 2,
+             "v_active": 9, "v_front_porch": 1, "v_sync": 1, "v_back_porch": 1}
+        frames = []
+
+        class DUT(Module):
+            def __init__(self):
+                self.submodules.timing = timing = ClockDomainsRenamer({"sys":"video"})(VideoTimingGenerator(t))
+                self.submodules.framer = framer = Framer(timing)
+                self.submodules.scaler = scaler = ClockDomainsRenamer({"sys":"video"})(
+                    ScalerInteger(line_in=8, width_out=12, height_out=9))
+                self.count = Signal(16)
+                self.comb += [
+                    scaler.sink.valid.eq(1),
+                    scaler.sink.data.eq(self.count),
+                    scaler.source.connect(framer.sink),
+                    scaler.reset.eq(timing.frame_end),
+                    scaler.load.eq(timing.frame_end),
+                ]
+                self.sync.video += [
+                    If(scaler.sink.ready,
+                        self.count.eq(self.count + 1)
+                    ),
+                    If(timing.frame_end,
+                        self.count.eq(0)
+                    )
+                ]
+
+        def sys(dut):
+            # The crop that is seen, ceil(12/3) x ceil(9/3) at factor 3
+            yield dut.framer.width.storage.eq(12)
+            yield dut.framer.height.storage.eq(9)
+            yield dut.scaler.factor.storage.eq(3)
+            yield dut.scaler.width_in.storage.eq(4)
+            for _ in range(8):
+                yield
+
+        def video(dut):
+            frame = []
+            for cycle in range(3*16*12):
+                if (yield dut.timing.frame_end):
+                    frames.append(frame)
+                    frame = []
+                if (yield dut.framer.data_valid):
+                    frame.append(((yield dut.framer.red), (yield dut.framer.green), (yield dut.framer.blue)))
+                yield
+
+        dut = DUT()
+        run_simulation(dut, {"sys": sys(dut), "video": video(dut)}, clocks={"sys": 10, "video": 10})
+
+        # Every visible pixel has data, none of the framer's fill
+        expected = [((y//3)*4 + x//3, 0, 0) for y in range(9) for x in range(12)]
+        self.assertEqual(frames[2], expected)
+
+
 from litex.soc.interconnect.stream_sim import PacketStreamer, PacketLogger, Packet, Randomizer
 from litex.soc.interconnect.stream import Pipeline
 
@@ -0,0 +1,448 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+# Golden models and regression harness for ScalerWidth / ScalerHeight -----------------------------
+#
+# The models are bit exact, quirks included. Neither scaler's schedule depends on pixel values, only
+# on flow control, so each model steps the control logic cycle by cycle to record which input words
+# end up in each output word, then does the arithmetic on whole arrays with NumPy.
+#
+# Stream convention shared by the models and the backends: cycle 0 is idle. From cycle 1 sink.valid
+# is held high until every input word is accepted, sink.data is 0 while not valid. source.ready
+# follows the `ready` pattern, and a word is logged on every cycle with source valid & ready.
+
+import os
+import shutil
+import argparse
+import unittest
+import subprocess
+import tempfile
+
+import numpy as np
+
+from migen import *
+from migen.fhdl.verilog import convert
+
+from scaler import ScalerWidth, ScalerHeight
+
+
+# Flow control patterns ---------------------------------------------------------------------------
+
+def ready_always(cycles):
+    return np.ones(cycles, dtype=bool)
+
+def ready_framer(cycles, active=800, total=1056):
+    """Back pressure from the Framer, ready only during the active part of each line"""
+    return (np.arange(cycles) % total) < active
+
+
+# Models ------------------------------------------------------------------------------------------
+
+def _word_table(words):
+    # Index 0 is the value on sink.data while it isn't valid
+    return np.concatenate([np.zeros(1, dtype=np.uint32), np.asarray(words, dtype=np.uint32).ravel()])
+
+def _channel(words, c):
+    return (words.astype(np.int32) >> 8*c) & 0xFF
+
+def scaler_width_model(pixels, ready):
+    """ScalerWidth output for the input words `pixels` with per cycle source.ready `ready`"""
+    table = _word_table(pixels)
+    n = table.size - 1
+
+    # Data registers hold indices into `table`
+    counter, overflow, ce = 0, 1, 0
+    r_next = r_last = 0
+    slope = (0, 0)
+    offset_r = offset_r0 = 0
+    stage3 = (0, (0, 0))
+    output = (0, 0, (0, 0))
+    p = 0
+    log = []
+
+    for t in range(len(ready)):
+        rdy = t > 0 and bool(ready[t])
+        valid = t > 0 and p < n
+        data = p + 1 if valid else 0
+        accepted = valid and overflow and rdy
+
+        if (ce >> 3) & 1 and rdy:
+            log.append(output)
+
+        counter_old = counter
+        if valid and rdy:
+            total = counter + int(2**8 * (4/5)) + (counter > 0)
+            counter, overflow = total & 0xFF, total >> 8 & 1
+        ce = (ce << 1 | valid) & 0xF
+        if rdy:
+            output = (r_last, stage3[0], stage3[1])
+            stage3 = (offset_r0, slope)
+            offset_r0 = offset_r
+            offset_r = (256 - counter_old) & 0xFF
+            slope = (data, r_next)
+            r_last = r_next
+            if accepted:
+                r_next = data
+        p += accepted
+
+    if not log:
+        return np.zeros(0, dtype=np.uint32)
+    base, offset, a, b = (np.array(x) for x in zip(*[(r, o, a, b) for r, o, (a, b) in log]))
+    out = np.zeros(len(log), dtype=np.uint32)
+    for c in range(3):
+        r = _channel(table[base], c)
+        sa = _channel(table[a], c)
+        sb = _channel(table[b], c)
+        step = ((offset * np.abs(sa - sb)) >> 8) & 0xFF
+        value = np.where(sa < sb, r + step, r - step) & 0xFF
+        value = np.where((step > 0) & (step < 255), value, r)
+        out |= value.astype(np.uint32) << 8*c
+    return out
+
+def scaler_height_model(pixels, ready, line_length=800):
+    """ScalerHeight output for the input words `pixels` with per cycle source.ready `ready`"""
+    table = _word_table(pixels)
+    n = table.size - 1
+    step = int(2**12 * (64/75))
+
+    # Line buffer contents and the write data registers are indices into `table`
+    buffers = [np.zeros(line_length + 10, dtype=np.int64) for _ in range(2)]
+    dat_w = [0, 0]
+    dat_r = [0, 0]
+    state_in, state_out = "WAIT", "WAIT"
+    line_counter = out_counter = 0
+    counter, overflow = 0, 0
+    repeat = last_ready = 0
+    full = [0, 0]
+    p = 0
+    log = []
+
+    for t in range(len(ready)):
+        rdy = t > 0 and bool(ready[t])
+        valid = t > 0 and p < n
+        data = p + 1 if valid else 0
+
+        adr = [0, 0]
+        we = [0, 0]
+        sink_ready = 0
+        sets, clrs = [0, 0], [0, 0]
+        repeat_set = repeat_clr = 0
+        next_in, next_out = state_in, state_out
+        n_line_counter, n_out_counter = line_counter, out_counter
+        n_counter, n_overflow = counter, overflow
+        n_last_ready = last_ready
+        n_dat_w = list(dat_w)
+
+        if state_in == "WAIT":
+            n_line_counter = 0
+            if not full[0] and state_out != "OUT0":
+                next_in = "FILL0"
+            elif not full[1] and state_out != "OUT1":
+                next_in = "FILL1"
+        else:
+            i = int(state_in[-1])
+            adr[i] = line_counter
+            we[i] = valid
+            sink_ready = 1
+            n_dat_w[i] = data
+            n_line_counter = (line_counter + valid) & 0xFFF
+            if line_counter >= line_length - 1:
+                next_in = "WAIT"
+                n_line_counter = 0
+                sets[i] = 1
+                total = counter + step
+                n_counter, n_overflow = total & 0xFFF, total >> 12 & 1
+                if not overflow:
+                    repeat_set = 1
+                    n_counter = (counter + 2*step) & 0xFFF
+                    n_overflow = 1
+
+        source_valid = 0
+        source_data = 0
+        if state_out == "WAIT":
+            n_last_ready = 0
+            if full[0]:
+                n_out_counter = 0
+                next_out = "OUT0"
+            elif full[1]:
+                n_out_counter = 0
+                next_out = "OUT1"
+        else:
+            i = int(state_out[-1])
+            n_last_ready = 1
+            adr[i] = (out_counter + rdy) & 0xFFF
+            source_data = dat_r[i]
+            source_valid = last_ready
+            if rdy:
+                n_out_counter = (out_counter + 1) & 0xFFF
+            if out_counter > line_length - 1:
+                n_last_ready = 0
+                n_out_counter = 0
+                repeat_clr = 1
+                if not repeat:
+                    clrs[i] = 1
+                    next_out = "WAIT"
+
+        if source_valid and rdy:
+            log.append(source_data)
+
+        # Clock edge, memories are write first
+        for i in range(2):
+            if we[i]:
+                buffers[i][adr[i] % (line_length + 10)] = dat_w[i]
+            dat_r[i] = buffers[i][adr[i] % (line_length + 10)]
+        for i in range(2):
+            if sets[i]:
+                full[i] = 1
+            if clrs[i]:
+                full[i] = 0
+        if repeat_set:
+            repeat = 1
+        if repeat_clr:
+            repeat = 0
+        state_in, state_out = next_in, next_out
+        line_counter, out_counter = n_line_counter, n_out_counter
+        counter, overflow = n_counter, n_overflow
+        last_ready = n_last_ready
+        dat_w = n_dat_w
+        p += valid and sink_ready
+
+    return table[np.array(log, dtype=np.int64)]
+
+
+# Backends ----------------------------------------------------------------------------------------
+
+class Result:
+    def __init__(self, output, cycles, accepted, out_cycles):
+        self.output = np.asarray(output, dtype=np.uint32)
+        self.cycles = cycles
+        # Cycles with words accepted on the sink, and cycles with words leaving the source
+        self.accepted = accepted
+        self.out_cycles = out_cycles
+
+    def report(self, ready):
+        """Throughput summary, a bubble is a cycle where the sink was ready but no word came out"""
+        out = np.flatnonzero(self.out_cycles)
+        if out.size == 0:
+            return {"pixels_in": int(self.accepted.sum()), "pixels_out": 0}
+        window = slice(out[0], out[-1] + 1)
+        bubbles = int((ready[window] & ~self.out_cycles[window]).sum())
+        return {
+            "cycles"                : self.cycles,
+            "pixels_in"             : int(self.accepted.sum()),
+            "pixels_out"            : int(out.size),
+            "latency"               : int(out[0]),
+            "out_pixels_per_clock"  : float(out.size / (out[-1] + 1 - out[0])),
+            "bubbles"               : bubbles,
+        }
+
+def _dut(scaler, line_length):
+    if scaler == "width":
+        return ScalerWidth()
+    return ScalerHeight(line_length)
+
+def run_migen(scaler, pixels, ready, line_length=800):
+    """Cycle accurate run in the migen simulator, only practical for small frames"""
+    dut = _dut(scaler, line_length)
+    pixels = np.asarray(pixels, dtype=np.uint32).ravel()
+    n = len(pixels)
+    cycles = len(ready)
+    output = []
+    accepted = np.zeros(cycles, dtype=bool)
+    out_cycles = np.zeros(cycles, dtype=bool)
+
+    def driver():
+        p = 0
+        # Inputs written here become visible after the next clock edge, cycle 0 is idle
+        yield dut.sink.valid.eq(n > 0)
+        yield dut.sink.data.eq(int(pixels[0]) if n else 0)
+        yield dut.source.ready.eq(cycles > 1 and bool(ready[1]))
+        yield
+        for t in range(1, cycles):
+            if (yield dut.source.valid) and (yield dut.source.ready):
+                output.append((yield dut.source.data))
+                out_cycles[t] = True
+            if (yield dut.sink.valid) and (yield dut.sink.ready):
+                accepted[t] = True
+                p += 1
+            yield dut.sink.valid.eq(p < n)
+            yield dut.sink.data.eq(int(pixels[p]) if p < n else 0)
+            yield dut.source.ready.eq(t + 1 < cycles and bool(ready[t + 1]))
+            yield
+
+    run_simulation(dut, driver())
+    return Result(output, cycles, accepted, out_cycles)
+
+
+_verilator_driver = r"""
+#include <cstdio>
+#include <cstdint>
+#include <vector>
+#include "Vtop.h"
+#include "verilated.h"
+
+static std::vector<uint8_t> load(const char *name) {
+    std::vector<uint8_t> d;
+    FILE *f = fopen(name, "rb");
+    if (!f) return d;
+    fseek(f, 0, SEEK_END);
+    d.resize(ftell(f));
+    fseek(f, 0, SEEK_SET);
+    if (fread(d.data(), 1, d.size(), f) != d.size()) d.clear();
+    fclose(f);
+    return d;
+}
+
+int main(int argc, char **argv) {
+    if (argc != 5) return 2;
+    std::vector<uint8_t> in = load(argv[1]);
+    std::vector<uint8_t> ready = load(argv[2]);
+    const uint32_t *pixels = (const uint32_t *)in.data();
+    size_t n = in.size() / 4, p = 0;
+
+    FILE *out = fopen(argv[3], "wb");
+    FILE *trace = fopen(argv[4], "wb");
+
+    Vtop top;
+    top.sys_clk = 0;
+    top.sys_rst = 0;
+    top.reset = 0;
+    for (size_t t = 0; t < ready.size(); t++) {
+        bool valid = t > 0 && p < n;
+        top.sink_valid = valid;
+        top.sink_payload_data = valid ? pixels[p] : 0;
+        top.source_ready = t > 0 && ready[t];
+        top.eval();
+
+        // bit 0: word accepted on the sink, bit 1: word out of the source
+        uint8_t flags = 0;
+        if (top.source_valid && top.source_ready) {
+            uint32_t d = top.source_payload_data;
+            fwrite(&d, 4, 1, out);
+            flags |= 2;
+        }
+        if (valid && top.sink_ready) {
+            flags |= 1;
+            p++;
+        }
+        fputc(flags, trace);
+
+        top.sys_clk = 1;
+        top.eval();
+        top.sys_clk = 0;
+        top.eval();
+    }
+    fclose(out);
+    fclose(trace);
+    top.final();
+    return 0;
+}
+"""
+
+def build_verilator(scaler, line_length=800, build_dir=None):
+    """Compiles the scaler with Verilator, returns the path of the executable"""
+    if shutil.which("verilator") is None:
+        raise OSError("verilator not found")
+    build_dir = build_dir or os.path.join("build", "scaler_{}".format(scaler))
+    os.makedirs(build_dir, exist_ok=True)
+
+    dut = _dut(scaler, line_length)
+    ios = {dut.sink.valid, dut.sink.ready, dut.sink.data, dut.sink.last,
+           dut.source.valid, dut.source.ready, dut.source.data, dut.source.last, dut.reset}
+    convert(dut, ios=ios, name="top").write(os.path.join(build_dir, "top.v"))
+    with open(os.path.join(build_dir, "driver.cpp"), "w") as f:
+        f.write(_verilator_driver)
+
+    subprocess.check_call(["verilator", "--cc", "--exe", "--build", "-O3", "-Wno-fatal",
+        "--top-module", "top", "top.v", "driver.cpp", "-o", "Vtop"], cwd=build_dir)
+    return os.path.join(build_dir, "obj_dir", "Vtop")
+
+def run_verilator(executable, pixels, ready):
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [os.path.join(tmp, f) for f in ["in.bin", "ready.bin", "out.bin", "trace.bin"]]
+        np.asarray(pixels, dtype=np.uint32).ravel().tofile(files[0])
+        np.asarray(ready, dtype=np.uint8).tofile(files[1])
+        subprocess.check_call([executable] + files)
+        output = np.fromfile(files[2], dtype=np.uint32)
+        trace = np.fromfile(files[3], dtype=np.uint8)
+    return Result(output, len(ready), (trace & 1) != 0, (trace & 2) != 0)
+
+
+# Harness -----------------------------------------------------------------------------------------
+
+def check(scaler, frame, ready, backend="migen", line_length=800, executable=None):
+    """Runs a frame through the hardware and the model, returns (mismatches, throughput report)"""
+    if backend == "verilator":
+        result = run_verilator(executable or build_verilator(scaler, line_length), frame, ready)
+    else:
+        result = run_migen(scaler, frame, ready, line_length)
+
+    if scaler == "width":
+        expected = scaler_width_model(frame, ready)
+    else:
+        expected = scaler_height_model(frame, ready, line_length)
+
+    size = min(expected.size, result.output.size)
+    mismatches = int(np.count_nonzero(expected[:size] != result.output[:size]))
+    mismatches += abs(expected.size - result.output.size)
+    return mismatches, result.report(np.asarray(ready, dtype=bool))
+
+def make_frame(width, height, seed=0):
+    """Random pixels with smooth regions mixed in, so both large and small slopes are exercised"""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 2**24, size=(height, width), dtype=np.uint32)
+    x, y = np.meshgrid(np.arange(width), np.arange(height))
+    ramp = ((x * 255 // max(width - 1, 1)) | (y * 255 // max(height - 1, 1)) << 8 | ((x + y) & 0xFF) << 16)
+    return np.where((x // 8 + y // 8) % 2 == 0, noise, ramp.astype(np.uint32))
+
+
+## Unit tests
+
+class TestModel(unittest.TestCase):
+
+    def test_width(self):
+        frame = make_frame(64, 4)
+        for ready in [ready_always(400), ready_framer(500, 40, 56)]:
+            mismatches, report = check("width", frame, ready)
+            self.assertEqual(mismatches, 0)
+            self.assertGreater(report["pixels_out"], 0)
+
+    def test_height(self):
+        frame = make_frame(16, 24, seed=1)
+        for ready in [ready_always(1200), ready_framer(2000, 16, 20)]:
+            mismatches, report = check("height", frame, ready, line_length=16)
+            self.assertEqual(mismatches, 0)
+            self.assertGreater(report["pixels_out"], 0)
+
+    @unittest.skipIf(shutil.which("verilator") is None, "verilator not found")
+    def test_verilator(self):
+        frame = make_frame(640, 8)
+        mismatches, report = check("width", frame, ready_framer(12000), backend="verilator")
+        self.assertEqual(mismatches, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaler regression against the NumPy models")
+    parser.add_argument("--scaler", default="width", choices=["width", "height"])
+    parser.add_argument("--backend", default="verilator", choices=["verilator", "migen"])
+    parser.add_argument("--frames", default=1, type=int)
+    parser.add_argument("--ready", default="framer", choices=["always", "framer"])
+    args = parser.parse_args()
+
+    if args.scaler == "width":
+        frame, line_length = make_frame(640, 512), 800
+    else:
+        frame, line_length = make_frame(800, 512), 800
+    cycles = int(frame.size * 2.5) + 10000
+    ready = ready_always(cycles) if args.ready == "always" else ready_framer(cycles)
+
+    executable = build_verilator(args.scaler, line_length) if args.backend == "verilator" else None
+    for i in range(args.frames):
+        mismatches, report = check(args.scaler, make_frame(*frame.shape[::-1], seed=i), ready,
+            args.backend, line_length, executable)
+        print("frame {}: {} mismatches, {}".format(i, mismatches, report))
+        if mismatches:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
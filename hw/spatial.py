@@ -0,0 +1,275 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import unittest
+
+import numpy as np
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect.stream import Endpoint
+from litex.soc.interconnect.csr import AutoCSR, CSRStorage
+
+from dsp import shift_add
+
+# Kernels, rows top to bottom, and the shift and offset applied to the sum
+SPATIAL_PRESETS = {
+    "identity": ([[0, 0, 0], [0, 1, 0], [0, 0, 0]], 0, 0),
+    # Centre plus a quarter of the Laplacian
+    "sharpen":  ([[0, -4, 0], [-4, 32, -4], [0, -4, 0]], 4, 0),
+    # Laplacian around mid grey
+    "edge":     ([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]], 0, 128),
+    # Gaussian blur
+    "denoise":  ([[1, 2, 1], [2, 4, 2], [1, 2, 1]], 4, 0),
+}
+
+class SpatialFilter(Module, AutoCSR):
+    """3x3 convolution on the luminance in data[0:8] of a `pixel` domain stream, one pixel per clock.
+       out = clamp(((sum(coef*Y) + round) >> shift) + offset), Cb/Cr in data[8:24] follow their pixel.
+       Coefficients reset to the identity, see SPATIAL_PRESETS for the others. Pixels past the edges of
+       the frame repeat the edge pixel.
+       Frames start on `first` and lines end on `last`. Two line buffers hold the lines above, so a
+       line comes out as the line below it arrives, and the last of `height` lines is replayed from the
+       line buffers after it ends. Lines need at least a clock between them, frames a line. Lines up
+       to `max_width` pixels. The stream can't be held off."""
+    def __init__(self, max_width=1024):
+        self.sink = sink = Endpoint([("data", 24)])
+        self.source = source = Endpoint([("data", 24)])
+
+        kernel, shift, offset = SPATIAL_PRESETS["identity"]
+        self.shift = CSRStorage(4, reset=shift)
+        self.offset = CSRStorage(9, reset=offset)
+        self.height = CSRStorage(16, reset=512)
+
+        # # #
+
+        coef = [[Signal((10, True)) for j in range(3)] for i in range(3)]
+        shift = Signal(4)
+        offset = Signal((9, True))
+        height = Signal(16)
+        for i in range(3):
+            for j in range(3):
+                csr = CSRStorage(10, reset=kernel[i][j] & 0x3FF, name="coef{}{}".format(i, j))
+                setattr(self, "coef{}{}".format(i, j), csr)
+                self.specials += MultiReg(csr.storage, coef[i][j], "pixel")
+        self.specials += [
+            MultiReg(self.shift.storage, shift, "pixel"),
+            MultiReg(self.offset.storage, offset, "pixel"),
+            MultiReg(self.height.storage, height, "pixel"),
+        ]
+
+        # Line above with its chroma, and the luminance of the line above that
+        above = Memory(width=24, depth=max_width)
+        above2 = Memory(width=8, depth=max_width)
+        rd_above = above.get_port(clock_domain="pixel")
+        wr_above = above.get_port(write_capable=True, clock_domain="pixel")
+        rd_above2 = above2.get_port(clock_domain="pixel")
+        wr_above2 = above2.get_port(write_capable=True, clock_domain="pixel")
+        self.specials += above, above2, rd_above, wr_above, rd_above2, wr_above2
+
+        # Columns come from the input, a `tail` column repeats the end of each line and a `replay` line
+        # repeats the last line of the frame
+        x = Signal(max=max_width + 1)
+        y = Signal(16)
+        x_in = Signal(max=max_width + 1)
+        y_in = Signal(16)
+        width = Signal(max=max_width + 1)
+        tail = Signal()
+        flush = Signal()
+        replay = Signal()
+        replay_x = Signal(max=max_width + 1)
+        bottom = Signal()
+
+        self.comb += [
+            sink.ready.eq(1),
+            x_in.eq(Mux(sink.first, 0, x)),
+            y_in.eq(Mux(sink.first, 0, y)),
+        ]
+        self.sync.pixel += [
+            tail.eq(0),
+            If(sink.valid,
+                x.eq(x_in + 1),
+                y.eq(y_in),
+                If(sink.last,
+                    x.eq(0),
+                    y.eq(y_in + 1),
+                    width.eq(x_in + 1),
+                    tail.eq(1),
+                    flush.eq(y_in + 1 == height),
+                )
+            ).Elif(tail & flush,
+                flush.eq(0),
+                replay.eq(1),
+                replay_x.eq(0),
+                bottom.eq(1),
+            ).Elif(replay,
+                replay_x.eq(replay_x + 1),
+                If(replay_x == width - 1,
+                    replay.eq(0),
+                    tail.eq(1),
+                )
+            ).Elif(tail,
+                bottom.eq(0),
+            )
+        ]
+
+        # Stage 1: the line buffers are read
+        b_valid = Signal()
+        b_x = Signal(max=max_width + 1)
+        b_y = Signal(16)
+        b_data = Signal(24)
+        b_tail = Signal()
+        b_bottom = Signal()
+        self.comb += [
+            rd_above.adr.eq(Mux(replay, replay_x, x_in)),
+            rd_above2.adr.eq(Mux(replay, replay_x, x_in)),
+        ]
+        self.sync.pixel += [
+            b_valid.eq(sink.valid | tail | replay),
+            b_x.eq(Mux(replay, replay_x, Mux(sink.valid, x_in, width))),
+            If(~tail,
+                b_y.eq(Mux(sink.valid, y_in, y)),
+            ),
+            b_data.eq(sink.data),
+            b_tail.eq(tail),
+            b_bottom.eq(bottom),
+        ]
+
+        # The column, rows above the first line and below the last repeat the edge
+        mid = rd_above.dat_r[0:8]
+        col = [Signal(8) for i in range(3)]
+        self.comb += [
+            col[0].eq(Mux(b_y == 1, mid, rd_above2.dat_r)),
+            col[1].eq(mid),
+            col[2].eq(Mux(b_bottom, mid, b_data[0:8])),
+
+            wr_above.adr.eq(b_x),
+            wr_above.dat_w.eq(b_data),
+            wr_above.we.eq(b_valid & ~b_tail & ~b_bottom),
+            wr_above2.adr.eq(b_x),
+            wr_above2.dat_w.eq(mid),
+            wr_above2.we.eq(b_valid & ~b_tail & ~b_bottom),
+        ]
+
+        # Stage 2: the window, centred on the line above, one column back. Columns left of the first
+        # repeat it, the tail column repeats the last.
+        w = [[Signal(8) for j in range(3)] for i in range(3)]
+        chroma = [Signal(16) for j in range(2)]
+        valid = Signal(3)
+        first = Signal(3)
+        last = Signal(3)
+        self.sync.pixel += [
+            If(b_valid,
+                If(b_tail,
+                    [w[i][0].eq(w[i][1]) for i in range(3)],
+                    [w[i][1].eq(w[i][2]) for i in range(3)],
+                    chroma[0].eq(chroma[1]),
+                ).Elif(b_x == 0,
+                    [w[i][j].eq(col[i]) for i in range(3) for j in range(3)],
+                    [chroma[j].eq(rd_above.dat_r[8:24]) for j in range(2)],
+                ).Else(
+                    [w[i][0].eq(w[i][1]) for i in range(3)],
+                    [w[i][1].eq(w[i][2]) for i in range(3)],
+                    [w[i][2].eq(col[i]) for i in range(3)],
+                    chroma[0].eq(chroma[1]),
+                    chroma[1].eq(rd_above.dat_r[8:24]),
+                )
+            ),
+            valid.eq(Cat(b_valid & (b_x != 0) & (b_y != 0), valid[:2])),
+            first.eq(Cat(b_valid & ~b_tail & (b_x == 1) & (b_y == 1), first[:2])),
+            last.eq(Cat(b_valid & b_tail & (b_y != 0), last[:2])),
+        ]
+
+        # Stage 3: multiply, in LUTs, stage 4: sum, round and shift, stage 5: offset and clamp
+        product = [[Signal((19, True)) for j in range(3)] for i in range(3)]
+        total = Signal((24, True))
+        shifted = Signal((24, True))
+        result = Signal((25, True))
+        half = Signal(16)
+        chroma_d = [Signal(16) for n in range(2)]
+        self.comb += [
+            half.eq((1 << shift) >> 1),
+            total.eq(sum(product[i][j] for i in range(3) for j in range(3)) + half),
+            result.eq(shifted + offset),
+        ]
+        self.sync.pixel += [
+            [product[i][j].eq(shift_add(w[i][j], coef[i][j])) for i in range(3) for j in range(3)],
+            shifted.eq(total >> shift),
+            source.data.eq(Cat(Mux(result < 0, 0, Mux(result > 255, 255, result[0:8])), chroma_d[1])),
+
+            chroma_d[0].eq(chroma[0]),
+            chroma_d[1].eq(chroma_d[0]),
+            source.valid.eq(valid[2]),
+            source.first.eq(first[2]),
+            source.last.eq(last[2]),
+        ]
+
+
+def spatial_model(y, kernel, shift=0, offset=0):
+    """Bit exact NumPy model of SpatialFilter's luminance for one frame, `y` as rows of pixels"""
+    y = np.asarray(y, dtype=np.int64)
+    h, w = y.shape
+    p = np.pad(y, 1, mode="edge")
+    total = sum(kernel[i][j] * p[i:i + h, j:j + w] for i in range(3) for j in range(3))
+    return np.clip(((total + ((1 << shift) >> 1)) >> shift) + offset, 0, 255)
+
+
+## Unit tests
+
+class TestSpatialFilter(unittest.TestCase):
+
+    def test_model(self):
+        # A step, sharpened it overshoots on both sides
+        y = [[50, 50, 100, 100]]*3
+        out = spatial_model(y, *SPATIAL_PRESETS["sharpen"])
+        self.assertEqual(list(out[1]), [50, 38, 113, 100])
+        out = spatial_model(y, *SPATIAL_PRESETS["identity"])
+        self.assertEqual(out.tolist(), y)
+
+    def test_filter(self):
+        rng = np.random.RandomState(0)
+        h, w = 5, 7
+        frames = [rng.randint(0, 256, size=(h, w, 3)) for _ in range(2)]
+
+        for preset in ["identity", "sharpen", "edge", "denoise"]:
+            kernel, shift, offset = SPATIAL_PRESETS[preset]
+            out = []
+
+            def generator(dut):
+                for i in range(3):
+                    for j in range(3):
+                        yield getattr(dut, "coef{}{}".format(i, j)).storage.eq(kernel[i][j] & 0x3FF)
+                yield dut.shift.storage.eq(shift)
+                yield dut.offset.storage.eq(offset & 0x1FF)
+                yield dut.height.storage.eq(h)
+                for _ in range(4):
+                    yield
+                for f in frames:
+                    for r in range(h):
+                        # Lines with a gap of a clock or two
+                        for c in range(w + 1 + r % 2):
+                            yield dut.sink.valid.eq(c < w)
+                            yield dut.sink.first.eq((r == 0) & (c == 0))
+                            yield dut.sink.last.eq(c == w - 1)
+                            p = f[r][c] if c < w else [0, 0, 0]
+                            yield dut.sink.data.eq(int(p[0]) | (int(p[1]) << 8) | (int(p[2]) << 16))
+                            yield
+                            if (yield dut.source.valid):
+                                out.append(((yield dut.source.data), (yield dut.source.first), (yield dut.source.last)))
+                    # Vertical blanking
+                    yield dut.sink.valid.eq(0)
+                    for _ in range(w + 10):
+                        yield
+                        if (yield dut.source.valid):
+                            out.append(((yield dut.source.data), (yield dut.source.first), (yield dut.source.last)))
+
+            dut = SpatialFilter(max_width=16)
+            run_simulation(dut, {"pixel": generator(dut)}, clocks={"pixel": 10, "sys": 10})
+
+            expected = []
+            for f in frames:
+                y = spatial_model(f[:, :, 0], kernel, shift, offset)
+                expected += [(int(y[r][c]) | (int(f[r][c][1]) << 8) | (int(f[r][c][2]) << 16), int(r == 0 and c == 0), int(c == w - 1))
+                    for r in range(h) for c in range(w)]
+            self.assertEqual(out, expected, preset)
@@ -36,6 +36,23 @@ class CSRSink(Module, AutoCSR):
 
 from math import sin,pi
 
+# Clocks lost per burst on the HyperRAMX2: command, initial latency, turnaround and the gap between bursts
+HYPERRAM_BURST_OVERHEAD = 16
+
+def hyperram_budget(sys_clk_freq, streams, limit=0.9):
+    """Checks the frame buffer streams fit the HyperRAM, which moves a word every sys clock within a burst.
+       `streams` maps a name to (words per second, burst length). Prints each stream's share of the clocks
+       and raises ValueError if the total is over `limit`."""
+    total = 0
+    for name, (rate, burst) in streams.items():
+        share = rate * (burst + HYPERRAM_BURST_OVERHEAD) / burst / sys_clk_freq
+        print("HyperRAM {:<10} {:5.1f}%".format(name, 100*share))
+        total += share
+    print("HyperRAM {:<10} {:5.1f}%".format("total", 100*total))
+    if total > limit:
+        raise ValueError("HyperRAM streams need {:.1f}% of the bandwidth, over the {:.0f}% budget".format(100*total, 100*limit))
+    return total
+
 class StreamableHyperRAM(Module, AutoCSR):
     def __init__(self, hyperram_pads, devices=[], sim=False):
         self.bus = cpu_bus = Interface()
@@ -52,6 +69,31 @@ class StreamableHyperRAM(Module, AutoCSR):
         #self.submodules.reader_boson = reader_boson = StreamReader(external_sync=True)
         
         self.submodules.arbiter = Arbiter(devices + [cpu_bus], hyperram.bus)
+
+        # Bus statistics over each `stats_window` clocks: clocks with a cycle on the HyperRAM and words moved
+        self.stats_window = CSRStorage(32, reset=2**24)
+        self.stats_busy = CSRStatus(32)
+        self.stats_words = CSRStatus(32)
+
+        window = Signal(32)
+        busy = Signal(32)
+        words = Signal(32)
+        self.sync += [
+            window.eq(window + 1),
+            If(hyperram.bus.cyc & hyperram.bus.stb,
+                busy.eq(busy + 1)
+            ),
+            If(hyperram.bus.cyc & hyperram.bus.stb & hyperram.bus.ack,
+                words.eq(words + 1)
+            ),
+            If(window == self.stats_window.storage - 1,
+                window.eq(0),
+                busy.eq(0),
+                words.eq(0),
+                self.stats_busy.status.eq(busy),
+                self.stats_words.status.eq(words),
+            )
+        ]
         
         if not sim:
             # Analyser signals for debug
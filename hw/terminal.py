@@ -4,6 +4,7 @@
 import os
 
 from migen import *
+from migen.genlib.cdc import MultiReg
 
 from litex.soc.interconnect import wishbone
 
@@ -11,29 +12,21 @@ from litex.soc.interconnect.stream import Endpoint, EndpointDescription, SyncFIF
 
 from litex.soc.interconnect.csr import AutoCSR, CSR, CSRStatus, CSRStorage
 
+from video_timing import VideoTimingGenerator
+
 # Terminal emulation with 640 x 480 pixels, 80 x 30 characters, individual foreground and background
 # color per character (VGA palette) and user definable font, with code page 437 VGA font initialized.
 # 60 Hz framerate, if vga_clk is 25.175 MHz. Independent system clock possible, internal dual-port
 # block RAM.
 #
-# Memory layout:
-# 0x0000 - 0x12bf = 2 bytes per character:
-#    character: index in VGA font
-#    color: low nibble is foreground color, and high nibble is background color, VGA palette
-# 0x12c0 - 0x22bf = VGA font, 16 lines per character, 8 bits width
-#
-# VGA timings:
-# clocks per line:
-# 1. HSync low pulse for 96 clocks
-# 2. back porch for 48 clocks
-# 3. data for 640 clocks
-# 4. front porch for 16 clocks
+# Memory layout, one 32-bit word per entry:
+# 0    - 3199 = 80 x 40 cells, 16 bits per cell:
+#    bits 0-7: character, index in VGA font
+#    bits 8-15: color, low nibble is foreground color, and high nibble is background color, VGA palette
+# 3200 - 7295 = VGA font, 16 lines per character, 8 bits width
 #
-# VSync timing per picture (800 clocks = 1 line):
-# 1. VSync low pulse for 2 lines
-# 2. back porch for 29 lines
-# 3. data for 480 lines
-# 4. front porch for 10 lines
+# VGA timings come from a VideoTimingGenerator, the Terminal only follows its counters.
+# `scroll` sets the text row shown at the top of the screen, rows wrap around the text RAM.
 
 # Helpers ------------------------------------------------------------------------------------------
 
@@ -60,10 +53,10 @@ def read_ram_init_file(filename, size):
 # Terminal -----------------------------------------------------------------------------------------
 
 class Terminal(Module, AutoCSR):
-    def __init__(self, pads=None, font_filename="util/cp437.bin"):
+    def __init__(self, timing, pads=None, font_filename="util/cp437.bin", ppc=1):
         # Wishbone interface
         self.bus = bus = wishbone.Interface(data_width=32)
-        self.source = source = Endpoint(EndpointDescription([("data", 32)]))
+        self.source = source = Endpoint(EndpointDescription([("data", 32*ppc)]))
 
         self.overrun = CSRStatus(32)
 
@@ -80,60 +73,111 @@ class Terminal(Module, AutoCSR):
         # RAM initialization
         #screen_init = read_ram_init_file(screen_init_filename, 32160)
         font = read_ram_init_file(font_filename, 4096)
-        ram_init = [0 for i in range(80 * 40)] + font
 
-        # Create RAM
-        mem = Memory(width=8, depth=(80 * 40) + 4096, init=ram_init)
-        self.specials += mem
-        wrport = mem.get_port(write_capable=True, clock_domain="sys")
-        self.specials += wrport
-        rdport = mem.get_port(write_capable=False, clock_domain="vga")
-        self.specials += rdport
+        # Create RAM, text and font are separate so a cell and a font line can be read in the same clock
+        self.text = text = Memory(width=16, depth=80 * 40)
+        self.font = font = Memory(width=8, depth=4096, init=font)
+        self.specials += text, font
+        wrport = text.get_port(write_capable=True, clock_domain="sys")
+        font_wrport = font.get_port(write_capable=True, clock_domain="sys")
+        self.specials += wrport, font_wrport
+        rdport = text.get_port(write_capable=False, clock_domain="vga")
+        font_rdport = font.get_port(write_capable=False, clock_domain="vga")
+        self.specials += rdport, font_rdport
+
+        # Offset to font data in RAM
+        FONT_ADDR = 80 * 40
+
+        # Scroll, the text row shown at the top of the screen
+        self.scroll = CSRStorage(6)
+
+        # Fill engine, writes `fill_data` over a rectangle of cells in the background. Rows are counted
+        # from the top of the screen, so they follow `scroll`. Wishbone writes take priority.
+        self.fill_x = CSRStorage(7)
+        self.fill_y = CSRStorage(6)
+        self.fill_width = CSRStorage(7)
+        self.fill_height = CSRStorage(6)
+        self.fill_data = CSRStorage(16)
+        self.fill_start = CSR()
+        self.fill_busy = CSRStatus()
+
+        filling = Signal()
+        fill_col = Signal(7)
+        fill_rows = Signal(6)
+        fill_row = Signal(6)
+        self.comb += self.fill_busy.status.eq(filling)
 
         # Memory map internal block RAM to Wishbone interface
-        self.sync += [        
+        bus_write = Signal()
+        self.comb += bus_write.eq(bus.cyc & bus.stb & bus.we & ~bus.ack)
+        self.sync += [
             wrport.we.eq(0),
-            If (bus.cyc & bus.stb & bus.we & ~bus.ack,
+            font_wrport.we.eq(0),
+            font_wrport.adr.eq(bus.adr - FONT_ADDR),
+            font_wrport.dat_w.eq(bus.dat_w),
+            If (bus_write & (bus.adr >= FONT_ADDR),
+                font_wrport.we.eq(1),
+            ),
+            If (bus_write & (bus.adr < FONT_ADDR),
                 wrport.we.eq(1),
+                wrport.adr.eq(bus.adr),
                 wrport.dat_w.eq(bus.dat_w),
+            ).Elif(filling,
+                wrport.we.eq(1),
+                wrport.adr.eq((fill_row << 6) + (fill_row << 4) + self.fill_x.storage + fill_col),
+                wrport.dat_w.eq(self.fill_data.storage),
+                fill_col.eq(fill_col + 1),
+                If(fill_col == self.fill_width.storage - 1,
+                    fill_col.eq(0),
+                    fill_rows.eq(fill_rows + 1),
+                    fill_row.eq(Mux(fill_row == 39, 0, fill_row + 1)),
+                    If(fill_rows == self.fill_height.storage - 1,
+                        filling.eq(0)
+                    )
+                )
             ),
-        ]
-        
-        self.comb += [
-            wrport.adr.eq(bus.adr),
-        #    bus.dat_r.eq(wrport.dat_r)
-        ]
-
-        # Display resolution
-        WIDTH  = 800
-        HEIGHT = 600
 
-        # Offset to font data in RAM
-        FONT_ADDR = 80 * 40
-
-        # VGA output
-        self.red   = red   = Signal(8) if pads is None else pads.red
-        self.green = green = Signal(8) if pads is None else pads.green
-        self.blue  = blue  = Signal(8) if pads is None else pads.blue
-        self.hsync = hsync = Signal()  if pads is None else pads.hsync
-        self.vsync = vsync = Signal()  if pads is None else pads.vsync
-
-        self.blank = blank = Signal()
-
-
-        # VGA timings
-        H_SYNC_PULSE  = 128
-        H_BACK_PORCH  = 88 + H_SYNC_PULSE
-        H_DATA        = WIDTH + H_BACK_PORCH
-        H_FRONT_PORCH = 40 + H_DATA
-
-        V_SYNC_PULSE  = 4
-        V_BACK_PORCH  = 23 + V_SYNC_PULSE
-        V_DATA        = HEIGHT + V_BACK_PORCH
-        V_FRONT_PORCH = 1 + V_DATA
+            If(self.fill_start.re,
+                filling.eq((self.fill_width.storage != 0) & (self.fill_height.storage != 0)),
+                fill_col.eq(0),
+                fill_rows.eq(0),
+                fill_row.eq(Mux(self.fill_y.storage + self.scroll.storage >= 40,
+                    self.fill_y.storage + self.scroll.storage - 40,
+                    self.fill_y.storage + self.scroll.storage)),
+            )
+        ]
 
-        pixel_counter = Signal(14)
-        line_counter  = Signal(14)
+        scroll = Signal(6)
+        self.specials += MultiReg(self.scroll.storage, scroll, "vga")
+
+        # VGA output, pixel i of each clock in bits [8*i:8*(i+1)]. `opaque` bit i is set where pixel i is
+        # a glyph or in a cell with a background colour other than black, to key the text over video
+        self.red   = red   = Signal(8*ppc) if pads is None else pads.red
+        self.green = green = Signal(8*ppc) if pads is None else pads.green
+        self.blue  = blue  = Signal(8*ppc) if pads is None else pads.blue
+        self.opaque = opaque = Signal(ppc)
+        self.hsync = timing.hsync
+        self.vsync = timing.vsync
+        self.blank = timing.blank
+        if pads is not None:
+            self.comb += [
+                pads.hsync.eq(timing.hsync),
+                pads.vsync.eq(timing.vsync),
+            ]
+
+        # VGA timings, horizontal values are in clocks of ppc pixels
+        H_BACK_PORCH  = timing.h_start
+        H_DATA        = timing.h_end
+        H_FRONT_PORCH = timing.h_total
+
+        V_BACK_PORCH  = timing.v_start
+        V_DATA        = timing.v_end
+
+        # Clocks per 8 pixel character
+        CPC = 8//ppc
+
+        pixel_counter = timing.hcount
+        line_counter  = timing.vcount
 
         self.comb += [
             source.ready.eq(0),
@@ -162,130 +206,228 @@ class Terminal(Module, AutoCSR):
         fbyte     = Signal(8)
         next_byte = Signal(8)
 
-        # Current foreground color
-        fgcolor      = Signal(24)
-        next_fgcolor = Signal(24)
-
-        # Current background color
+        # Current foreground and background color
+        fgcolor = Signal(24)
         bgcolor = Signal(24)
 
-        # Current fg/bg color index from RAM
-        color = Signal(8)
+        # Set while the current character is inside the text area
+        cell      = Signal()
+        next_cell = Signal()
+
+        # Current and next fg/bg color index from RAM
+        color      = Signal(8)
+        next_color = Signal(8)
 
-        # Color index and lookup
-        color_index  = Signal(4)
-        color_lookup = Signal(24)
+        # Character column and fetch pipeline state, two pixels per clock only
+        col        = Signal(7)
+        text_valid = Signal()
+        font_valid = Signal()
 
         # VGA palette
-        palette = [
+        palette = Array(C(c, 24) for c in [
             0x000000, 0x0000aa, 0x00aa00, 0x00aaaa, 0xaa0000, 0xaa00aa, 0xaa5500, 0xaaaaaa,
             0x555555, 0x5555ff, 0x55ff55, 0x55ffff, 0xff5555, 0xff55ff, 0xffff55, 0xffffff
+        ])
+        self.comb += [
+            fgcolor.eq(palette[color[0:4]]),
+            bgcolor.eq(palette[color[4:8]]),
         ]
-        cases = {}
-        for i in range(16):
-            cases[i] = color_lookup.eq(palette[i])
-        self.comb += Case(color_index, cases)
+
+        if ppc == 1:
+            fetch = [
+                If((pixel_counter < (79*8 + H_BACK_PORCH)) & (line_counter < (39*16 + V_BACK_PORCH)),
+                    # Load next character code, font line and color
+                    If(fx == 1,
+                        # schedule reading the character code and color
+                        rdport.adr.eq(text_addr),
+                        text_addr.eq(text_addr + 1)
+                    ),
+                    If(fx == 3,
+                        # Read character code and color, and set address for font line
+                        font_rdport.adr.eq(Cat(fline, rdport.dat_r[0:8])),
+                        next_color.eq(rdport.dat_r[8:16]),
+                    ),
+                    ###
+                    If(fx == 5,
+                        # Read font line
+                        next_byte.eq(font_rdport.dat_r),
+                    ),
+                    ###
+                    If(fx == 7,
+                        # Set colors and everything for the next 8 pixels
+                        color.eq(next_color),
+                        cell.eq(1),
+                        fbyte.eq(next_byte)
+                    ),
+                ).Elif(fx == 7,
+                    cell.eq(0)
+                )
+            ]
+        else:
+            # Only 4 clocks per character, so keep two characters in flight. The cell read for one
+            # overlaps the font read of the previous.
+            color_pending = Signal(8)
+            fetch = If(line_counter < (39*16 + V_BACK_PORCH),
+                If(fx == 0,
+                    text_valid.eq(col < 80),
+                    If(col < 80,
+                        rdport.adr.eq(text_addr),
+                        text_addr.eq(text_addr + 1),
+                        col.eq(col + 1)
+                    ),
+                    # Read font line of the previous character, its color follows it
+                    next_byte.eq(Mux(font_valid, font_rdport.dat_r, 0)),
+                    next_color.eq(color_pending),
+                    next_cell.eq(font_valid),
+                ),
+                If(fx == 2,
+                    # Read character code and color, and set address for font line
+                    font_valid.eq(text_valid),
+                    font_rdport.adr.eq(Cat(fline, rdport.dat_r[0:8])),
+                    color_pending.eq(rdport.dat_r[8:16]),
+                ),
+                If(fx == CPC - 1,
+                    # Set colors and everything for the next 8 pixels
+                    color.eq(next_color),
+                    cell.eq(next_cell),
+                    fbyte.eq(next_byte)
+                ),
+            ).Elif(fx == CPC - 1,
+                cell.eq(0)
+            )
 
         self.sync.vga += [
             # Default values
             red.eq(0),
             green.eq(0),
             blue.eq(0),
-            blank.eq(1),
+            opaque.eq(0),
 
             # Show pixels
             If((line_counter >= V_BACK_PORCH) & (line_counter < V_DATA),
                 If((pixel_counter >= H_BACK_PORCH) & (pixel_counter < (H_DATA)),
-                    blank.eq(0),
-                    If(fbyte[7] & self.enable.storage,
-                        red.eq(fgcolor[16:24]),
-                        green.eq(fgcolor[8:16]),
-                        blue.eq(fgcolor[0:8])
+                    [If(fbyte[7-i] & self.enable.storage,
+                        red[8*i:8*(i+1)].eq(fgcolor[16:24]),
+                        green[8*i:8*(i+1)].eq(fgcolor[8:16]),
+                        blue[8*i:8*(i+1)].eq(fgcolor[0:8]),
+                        opaque[i].eq(1)
+                    ).Elif(cell & self.enable.storage,
+                        red[8*i:8*(i+1)].eq(bgcolor[16:24]),
+                        green[8*i:8*(i+1)].eq(bgcolor[8:16]),
+                        blue[8*i:8*(i+1)].eq(bgcolor[0:8]),
+                        opaque[i].eq(color[4:8] != 0)
                     ).Else(
                         If(source.valid,
-                            red.eq(source.data[16:24]),
-                            green.eq(source.data[8:16]),
-                            blue.eq(source.data[0:8])
+                            red[8*i:8*(i+1)].eq(source.data[32*i+16:32*i+24]),
+                            green[8*i:8*(i+1)].eq(source.data[32*i+8:32*i+16]),
+                            blue[8*i:8*(i+1)].eq(source.data[32*i+0:32*i+8])
                         ).Else( 
-                            red.eq(0x33),
-                            green.eq(0x33),
-                            blue.eq(0x33)
+                            red[8*i:8*(i+1)].eq(0x33),
+                            green[8*i:8*(i+1)].eq(0x33),
+                            blue[8*i:8*(i+1)].eq(0x33)
                         )
-                    ),
-                    fbyte.eq(Cat(Signal(), fbyte[:-1])),
+                    ) for i in range(ppc)],
+                    fbyte.eq(Cat(C(0, ppc), fbyte[:-ppc])),
                 )
             ),
 
-            If((pixel_counter < (79*8 + H_BACK_PORCH)) & (line_counter < (39*16 + V_BACK_PORCH)),
-                # Load next character code, font line and color
-                If(fx == 1,
-                    # schedule reading the character code
-                    rdport.adr.eq(text_addr),
-                    text_addr.eq(text_addr + 1)
-                ),
-                If(fx == 2,
-                    # Schedule reading the color
-                    #rdport.adr.eq(text_addr),
-                    #text_addr.eq(text_addr + 1)
-                ),
-                If(fx == 3,
-                    # Read character code, and set address for font line
-                    rdport.adr.eq(FONT_ADDR + Cat(Signal(4), rdport.dat_r) + fline)
-                ),
-                ###
-                If(fx == 5,
-                    # Read font line, and set color index to get foreground color
-                    next_byte.eq(rdport.dat_r),
-                ),
-                ###
-                If(fx == 7,
-                    # Set background color and everything for the next 8 pixels
-                    bgcolor.eq(0x000000),
-                    fgcolor.eq(0xFFFFFF),
-                    fbyte.eq(next_byte)
-                ),
-            ),
+            fetch,
             fx.eq(fx + 1),
-            If(fx == 7, fx.eq(0)),
+            If(fx == CPC - 1, fx.eq(0)),
 
             # Horizontal timing for one line
-            pixel_counter.eq(pixel_counter + 1),
-            If(pixel_counter < H_SYNC_PULSE,
-                hsync.eq(0)
-            ).Elif (pixel_counter < H_BACK_PORCH,
-                hsync.eq(1)
-            ),
             If(pixel_counter == H_BACK_PORCH - 9,
                 # Prepare reading first character of next line
                 fx.eq(0),
+                col.eq(0),
                 text_addr.eq(text_addr_start)
             ),
             If(pixel_counter == (H_FRONT_PORCH - 1),
                 # Initilize next line
-                pixel_counter.eq(0),
-                line_counter.eq(line_counter + 1),
-
                 # Font height is 16 pixels
                 fline.eq(fline + 1),
                 If(fline == 15,
                     fline.eq(0),
-                    text_addr_start.eq(text_addr_start + 80)
+                    text_addr_start.eq(text_addr_start + 80),
+                    If(text_addr_start == 39*80,
+                        text_addr_start.eq(0)
+                    )
                 )
             ),
 
             # Vertical timing for one screen
-            If(line_counter < V_SYNC_PULSE,
-                vsync.eq(0)
-            ).Elif(line_counter < V_BACK_PORCH,
-                vsync.eq(1)
-            ),
-            If(line_counter == (V_FRONT_PORCH - 1),
-                # End of image
-                line_counter.eq(0)
-            ),
             If(line_counter == V_BACK_PORCH - 1,
                 # Prepare generating next image data
                 fline.eq(0),
-                text_addr_start.eq(0),
+                text_addr_start.eq((scroll << 6) + (scroll << 4)),
             )
         ]
+
+
+## Unit tests
+
+import unittest
+
+class TestTerminal(unittest.TestCase):
+
+    def test_fill(self):
+        cells = {}
+
+        def generator(dut):
+            yield dut.scroll.storage.eq(38)
+            yield dut.fill_x.storage.eq(78)
+            yield dut.fill_y.storage.eq(1)
+            yield dut.fill_width.storage.eq(2)
+            yield dut.fill_height.storage.eq(3)
+            yield dut.fill_data.storage.eq(0x1F00 | ord("#"))
+            yield dut.fill_start.re.eq(1)
+            yield
+            yield dut.fill_start.re.eq(0)
+            yield
+            while (yield dut.fill_busy.status):
+                yield
+            yield
+            for row in [38, 39, 0, 1, 2]:
+                for col in [77, 78, 79]:
+                    cells[row, col] = (yield dut.text[row*80 + col])
+
+        timing = VideoTimingGenerator()
+        dut = ClockDomainsRenamer({"vga":"sys"})(Terminal(timing))
+        dut.submodules += timing
+        run_simulation(dut, generator(dut))
+
+        # Screen rows 1-3 are text rows 39, 0 and 1
+        filled = [(39, 78), (39, 79), (0, 78), (0, 79), (1, 78), (1, 79)]
+        self.assertEqual(sorted(k for k, v in cells.items() if v == 0x1F00 | ord("#")), sorted(filled))
+
+    def test_attributes(self):
+        for ppc in [1, 2]:
+            line = []
+            opaque = []
+
+            def generator(dut, timing):
+                # Yellow on blue "A" in the top left cell
+                yield from dut.bus.write(0, 0x1E00 | ord("A"))
+                while True:
+                    if ((yield timing.vcount) == (yield timing.v_start) + 4) and not (yield timing.blank):
+                        for i in range(ppc):
+                            line.append((((yield dut.red) >> 8*i) & 0xFF, ((yield dut.blue) >> 8*i) & 0xFF))
+                            opaque.append(((yield dut.opaque) >> i) & 1)
+                    if len(line) == 800:
+                        break
+                    yield
+
+            timing = VideoTimingGenerator(ppc=ppc)
+            dut = ClockDomainsRenamer({"vga":"sys"})(Terminal(timing, ppc=ppc))
+            dut.submodules += timing
+            run_simulation(dut, generator(dut, timing))
+
+            # Font line 4 of "A" is 0x6C, blue background, and the backdrop past the 80 columns
+            fg, bg = (0xFF, 0x55), (0x00, 0xAA)
+            self.assertEqual(line[0:8], [bg, fg, fg, bg, fg, fg, bg, bg])
+            self.assertEqual(line[8:16], [(0x00, 0x00)]*8)
+            self.assertEqual(line[700], (0x33, 0x33))
+            # Only the cell with a background covers the video
+            self.assertEqual(opaque[0:16], [1]*8 + [0]*8)
+            self.assertEqual(opaque[700], 0)
+
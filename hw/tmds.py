@@ -0,0 +1,158 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+# TMDS encoding as described in the DVI 1.0 spec, section 3.2
+
+control_tokens = [0b1101010100, 0b0010101011, 0b0101010100, 0b1010101011]
+
+def _popcount(bits):
+    return sum(bits[i] for i in range(len(bits)))
+
+class TMDSEncoder(Module):
+    """Encodes `n` consecutive symbols per clock, running disparity is chained between them.
+       Two pipeline stages: transition minimisation, then DC balancing. Outputs trail inputs by 2 clocks."""
+    def __init__(self, n=1):
+        self.d = d = [Signal(8) for _ in range(n)]
+        self.c = c = Signal(2)
+        self.de = de = Signal()
+        self.out = out = [Signal(10) for _ in range(n)]
+
+        # Stage 1, transition minimised symbols, independent of the running disparity
+        q_m = [Signal(9) for _ in range(n)]
+        disparity = [Signal((6, True)) for _ in range(n)]
+        c_r = Signal(2)
+        de_r = Signal()
+        self.sync += [
+            c_r.eq(c),
+            de_r.eq(de),
+        ]
+
+        for i in range(n):
+            n1d = Signal(4)
+            q = Signal(9)
+            use_xnor = Signal()
+            self.comb += [
+                n1d.eq(_popcount(d[i])),
+                use_xnor.eq((n1d > 4) | ((n1d == 4) & ~d[i][0])),
+                q[0].eq(d[i][0]),
+                [q[j].eq(Mux(use_xnor, ~(q[j-1] ^ d[i][j]), q[j-1] ^ d[i][j])) for j in range(1, 8)],
+                q[8].eq(~use_xnor),
+            ]
+            self.sync += [
+                q_m[i].eq(q),
+                # ones - zeros
+                disparity[i].eq(2*_popcount(q[0:8]) - 8),
+            ]
+
+        # Stage 2, DC balancing, the running disparity is chained through the symbols of a clock
+        cnt = Signal((6, True))
+        cnt_in = cnt
+
+        for i in range(n):
+            cnt_out = Signal((6, True))
+            q_out = Signal(10)
+
+            self.comb += [
+                If(~de_r,
+                    q_out.eq(Array(control_tokens)[c_r]),
+                    cnt_out.eq(0)
+                ).Elif((cnt_in == 0) | (disparity[i] == 0),
+                    q_out[9].eq(~q_m[i][8]),
+                    q_out[8].eq(q_m[i][8]),
+                    If(q_m[i][8],
+                        q_out[0:8].eq(q_m[i][0:8]),
+                        cnt_out.eq(cnt_in + disparity[i])
+                    ).Else(
+                        q_out[0:8].eq(~q_m[i][0:8]),
+                        cnt_out.eq(cnt_in - disparity[i])
+                    )
+                ).Elif((~cnt_in[-1] & ~disparity[i][-1]) | (cnt_in[-1] & disparity[i][-1]),
+                    q_out.eq(Cat(~q_m[i][0:8], q_m[i][8], 1)),
+                    cnt_out.eq(cnt_in + 2*q_m[i][8] - disparity[i])
+                ).Else(
+                    q_out.eq(Cat(q_m[i][0:8], q_m[i][8], 0)),
+                    cnt_out.eq(cnt_in - Mux(q_m[i][8], 0, 2) + disparity[i])
+                )
+            ]
+
+            self.sync += out[i].eq(q_out)
+            cnt_in = cnt_out
+
+        self.sync += cnt.eq(cnt_in)
+
+
+## Unit tests
+
+def tmds_encode_reference(data, cnt=0):
+    """Encode a list of bytes, returns (symbols, running disparity)"""
+    symbols = []
+    for d in data:
+        n1d = bin(d).count("1")
+        q_m = d & 1
+        xnor = n1d > 4 or (n1d == 4 and not (d & 1))
+        for j in range(1, 8):
+            b = ((q_m >> (j - 1)) ^ (d >> j)) & 1
+            q_m |= (b ^ xnor) << j
+        q_m |= (not xnor) << 8
+        n1q = bin(q_m & 0xFF).count("1")
+        disparity = 2*n1q - 8
+        q8 = q_m >> 8
+        if cnt == 0 or disparity == 0:
+            q_out = ((1 - q8) << 9) | (q8 << 8) | (q_m & 0xFF if q8 else ~q_m & 0xFF)
+            cnt += disparity if q8 else -disparity
+        elif (cnt > 0 and disparity > 0) or (cnt < 0 and disparity < 0):
+            q_out = (1 << 9) | (q8 << 8) | (~q_m & 0xFF)
+            cnt += 2*q8 - disparity
+        else:
+            q_out = (q8 << 8) | (q_m & 0xFF)
+            cnt += -2*(1 - q8) + disparity
+        symbols.append(q_out)
+    return symbols, cnt
+
+class TestTMDS(unittest.TestCase):
+
+    def encode(self, n, data):
+        d = []
+        def generator(dut):
+            yield dut.de.eq(1)
+            for i in range(0, len(data), n):
+                for j in range(n):
+                    yield dut.d[j].eq(data[i + j])
+                yield
+                if i >= 2*n:
+                    for o in dut.out:
+                        d.append((yield o))
+            for _ in range(2):
+                yield
+                for o in dut.out:
+                    d.append((yield o))
+
+        dut = TMDSEncoder(n)
+        run_simulation(dut, generator(dut))
+        return d
+
+    def test_encoder(self):
+        data = [(i*73 + 11) & 0xFF for i in range(256)]
+        expected, cnt = tmds_encode_reference(data)
+        self.assertEqual(self.encode(1, data), expected)
+        self.assertEqual(self.encode(2, data), expected)
+
+        # Running disparity stays bounded
+        self.assertTrue(abs(cnt) <= 10)
+
+    def test_control(self):
+        def generator(dut):
+            for c in range(4):
+                yield dut.c.eq(c)
+                yield
+                yield
+                yield
+                self.assertEqual((yield dut.out[0]), control_tokens[c])
+                self.assertEqual((yield dut.out[1]), control_tokens[c])
+
+        dut = TMDSEncoder(2)
+        run_simulation(dut, generator(dut))
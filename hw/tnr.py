@@ -0,0 +1,248 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+import unittest
+
+from migen import *
+
+from litex.soc.interconnect.stream import Endpoint, SyncFIFO
+from litex.soc.interconnect.csr import AutoCSR, CSRStatus, CSRStorage
+
+from dsp import shift_add
+
+class TemporalFilter(Module, AutoCSR):
+    """Recursive temporal noise reduction on the sys domain stream of RGB words going into the frame buffer,
+       out = prev + k*(in - prev) per channel, with `prev` the same pixel of the previous output frame read
+       back from HyperRAM. k, in 1/256, is `strength` where the pixel is still and rises by `motion_gain`/16
+       for every level the largest channel difference is over `motion_threshold`, up to 256, the input.
+       On each `first` word the `prev` path is flushed and `prev_start` restarts the read, the word waits
+       for its previous pixel. Words outside a filtered frame, or with `bypass` set, pass through untouched.
+       Three register stages, the pipeline stalls with `source.ready`. Once full the `prev` FIFO takes
+       nothing more until there's room for a whole `burst`, so the HyperRAM reads stay in long bursts."""
+    def __init__(self, depth=512, burst=256):
+        self.sink = sink = Endpoint([("data", 32)])
+        self.source = source = Endpoint([("data", 32)])
+        self.prev = Endpoint([("data", 32)])
+        self.prev_start = Signal()
+        self.prev_flush = Signal()
+        self.bypass = Signal()
+
+        self.enable = CSRStorage()
+        self.strength = CSRStorage(9, reset=64)
+        self.motion_threshold = CSRStorage(8, reset=8)
+        self.motion_gain = CSRStorage(8, reset=32)
+        self.frames = CSRStatus(32)
+        self.stalls = CSRStatus(32)
+
+        # # #
+
+        self.submodules.fifo = fifo = ResetInserter()(SyncFIFO([("data", 32)], depth))
+        prev = fifo.source
+        room = Signal(reset=1)
+        self.comb += [
+            self.prev.connect(fifo.sink, omit={"valid", "ready"}),
+            fifo.sink.valid.eq(self.prev.valid & room),
+            self.prev.ready.eq(fifo.sink.ready & room),
+            fifo.reset.eq(self.prev_flush),
+        ]
+        self.sync += If(self.prev_flush | (fifo.level <= depth - burst),
+            room.eq(1)
+        ).Elif(~fifo.sink.ready,
+            room.eq(0)
+        )
+
+        # Advance while the output is free or being taken
+        ce = Signal()
+        valid = Signal(3)
+        first = Signal(3)
+        last = Signal(3)
+        in_valid = Signal()
+        in_filter = Signal()
+        self.comb += [
+            ce.eq(~source.valid | source.ready),
+            source.valid.eq(valid[2]),
+            source.first.eq(first[2]),
+            source.last.eq(last[2]),
+        ]
+        self.sync += If(ce,
+            valid.eq(Cat(in_valid, valid[:2])),
+            first.eq(Cat(sink.first, first[:2])),
+            last.eq(Cat(sink.last, last[:2])),
+        )
+
+        enable = Signal()
+        fresh = Signal()
+        frames = Signal(32)
+        stalls = Signal(32)
+        self.comb += enable.eq(self.enable.storage & ~self.bypass)
+
+        self.submodules.fsm = fsm = FSM(reset_state="SYNC")
+        fsm.act("SYNC",
+            If(sink.valid & sink.first & enable,
+                self.prev_flush.eq(1),
+                NextState("START"),
+            ).Else(
+                sink.ready.eq(ce),
+                in_valid.eq(sink.valid),
+            )
+        )
+        fsm.act("START",
+            self.prev_start.eq(1),
+            NextValue(fresh, 1),
+            NextValue(frames, frames + 1),
+            NextState("RUN"),
+        )
+        # A `first` word after the frame's own starts the next frame
+        fsm.act("RUN",
+            If(~enable | (sink.valid & sink.first & ~fresh),
+                NextState("SYNC"),
+            ).Else(
+                sink.ready.eq(ce & prev.valid),
+                prev.ready.eq(ce & sink.valid),
+                in_valid.eq(sink.valid & prev.valid),
+                in_filter.eq(1),
+                If(sink.valid & prev.valid & ce,
+                    NextValue(fresh, 0),
+                ),
+                If(sink.valid & ~prev.valid,
+                    NextValue(stalls, stalls + 1),
+                )
+            )
+        )
+        self.comb += [
+            self.frames.status.eq(frames),
+            self.stalls.status.eq(stalls),
+        ]
+
+        # Stage 1: differences, stage 2: k from the largest, stage 3: blend
+        cur = [Signal(8) for c in range(3)]
+        old = [Signal(8) for c in range(3)]
+        diff = [Signal((9, True)) for c in range(3)]
+        mag = [Signal(8) for c in range(3)]
+        filt = Signal()
+        top = Signal(8)
+
+        motion = Signal(8)
+        excess = Signal((9, True))
+        raise_k = Signal(14)
+        k_raw = Signal(15)
+        k = Signal(9)
+        old2 = [Signal(8) for c in range(3)]
+        diff2 = [Signal((9, True)) for c in range(3)]
+        top2 = Signal(8)
+
+        self.comb += [
+            [diff[c].eq(cur[c] - old[c]) for c in range(3)],
+            [mag[c].eq(Mux(diff[c] < 0, -diff[c], diff[c])) for c in range(3)],
+            motion.eq(Mux(mag[0] > mag[1], Mux(mag[0] > mag[2], mag[0], mag[2]), Mux(mag[1] > mag[2], mag[1], mag[2]))),
+            excess.eq(motion - self.motion_threshold.storage),
+            raise_k.eq(Mux(excess > 0, shift_add(excess[:8], self.motion_gain.storage) >> 4, 0)),
+            k_raw.eq(self.strength.storage + raise_k),
+        ]
+
+        self.sync += If(ce,
+            [cur[c].eq(sink.data[8*c:8*(c + 1)]) for c in range(3)],
+            [old[c].eq(prev.data[8*c:8*(c + 1)]) for c in range(3)],
+            top.eq(sink.data[24:32]),
+            filt.eq(in_filter),
+
+            k.eq(Mux(filt & (k_raw < 256), k_raw, 256)),
+            [old2[c].eq(old[c]) for c in range(3)],
+            [diff2[c].eq(diff[c]) for c in range(3)],
+            top2.eq(top),
+
+            [source.data[8*c:8*(c + 1)].eq(old2[c] + ((shift_add(k, diff2[c]) + 128) >> 8)) for c in range(3)],
+            source.data[24:32].eq(top2),
+        )
+
+
+def tnr_model(cur, prev, strength=64, threshold=8, gain=32):
+    """Reference for one filtered word of TemporalFilter"""
+    d = [((cur >> 8*c) & 0xFF) - ((prev >> 8*c) & 0xFF) for c in range(3)]
+    excess = max(abs(v) for v in d) - threshold
+    k = min(strength + ((excess * gain) >> 4 if excess > 0 else 0), 256)
+    out = cur & 0xFF000000
+    for c in range(3):
+        out |= (((prev >> 8*c) & 0xFF) + ((k * d[c] + 128) >> 8)) << 8*c
+    return out
+
+
+## Unit tests
+
+class TestTemporalFilter(unittest.TestCase):
+
+    def test_filter(self):
+        cur = [0x00404040, 0x00818181, 0x00A04020, 0x00FF0000, 0x00000000, 0x11121314, 0x000A0000]
+        old = [0x00404040, 0x00808080, 0x00202020, 0x0000FF00, 0x00FFFFFF, 0x00141312, 0x00000000]
+        frames = [cur[:4], cur[4:]]
+        results = []
+        starts = []
+
+        def sender(dut):
+            yield dut.enable.storage.eq(1)
+            yield
+            for f in frames:
+                for i, w in enumerate(f):
+                    yield dut.sink.valid.eq(1)
+                    yield dut.sink.first.eq(i == 0)
+                    yield dut.sink.data.eq(w)
+                    yield
+                    while not (yield dut.sink.ready):
+                        yield
+                yield dut.sink.valid.eq(0)
+                for _ in range(4):
+                    yield
+
+        def previous(dut):
+            # The previous frame arrives some time after the read starts
+            for f in [old[:4], old[4:]]:
+                while not (yield dut.prev_start):
+                    yield
+                starts.append(len(results))
+                for _ in range(10):
+                    yield
+                for w in f:
+                    yield dut.prev.valid.eq(1)
+                    yield dut.prev.data.eq(w)
+                    yield
+                    while not (yield dut.prev.ready):
+                        yield
+                yield dut.prev.valid.eq(0)
+
+        def receiver(dut):
+            for n in range(100):
+                yield dut.source.ready.eq(n % 7 != 3)
+                yield
+                if (yield dut.source.valid) & (yield dut.source.ready):
+                    results.append(((yield dut.source.data), (yield dut.source.first)))
+
+        dut = TemporalFilter()
+        run_simulation(dut, [sender(dut), previous(dut), receiver(dut)])
+
+        expected = [(tnr_model(c, o), int(i in [0, 4])) for i, (c, o) in enumerate(zip(cur, old))]
+        self.assertEqual(results, expected)
+        self.assertEqual(len(starts), 2)
+
+        # Still pixels blend a quarter in, large changes pass through, the top byte is untouched
+        self.assertEqual(results[1][0], 0x00808080)
+        self.assertEqual(results[3][0], 0x00FF0000)
+        self.assertEqual(results[5][0] >> 24, 0x11)
+
+    def test_bypass(self):
+        # Disabled, words pass through without waiting for a previous frame
+        words = [0x00102030, 0x00405060, 0x00708090]
+        results = []
+
+        def generator(dut):
+            yield dut.source.ready.eq(1)
+            for i, w in enumerate(words + [0]*4):
+                yield dut.sink.valid.eq(i < len(words))
+                yield dut.sink.first.eq(i == 0)
+                yield dut.sink.data.eq(w)
+                yield
+                if (yield dut.source.valid):
+                    results.append((yield dut.source.data))
+
+        dut = TemporalFilter()
+        run_simulation(dut, generator(dut))
+        self.assertEqual(results, words)
@@ -0,0 +1,318 @@
+# This file is Copyright (c) 2020 Gregory Davill <greg.davill@gmail.com>
+# License: BSD
+
+from migen import *
+from migen.genlib.cdc import MultiReg
+
+from litex.soc.interconnect.csr import AutoCSR, CSRStatus, CSRStorage
+
+# Video timings ------------------------------------------------------------------------------------
+#
+# Each line/frame is generated in the order: sync pulse, back porch, active data, front porch.
+# Horizontal values are in pixels, vertical values in lines.
+
+video_timings = {
+    "800x600@60Hz" : {
+        "pix_clk"       : 40e6,
+        "h_active"      : 800,
+        "h_front_porch" : 40,
+        "h_sync"        : 128,
+        "h_back_porch"  : 88,
+        "v_active"      : 600,
+        "v_front_porch" : 1,
+        "v_sync"        : 4,
+        "v_back_porch"  : 23,
+    },
+    "1024x768@60Hz" : {
+        "pix_clk"       : 65e6,
+        "h_active"      : 1024,
+        "h_front_porch" : 24,
+        "h_sync"        : 136,
+        "h_back_porch"  : 160,
+        "v_active"      : 768,
+        "v_front_porch" : 3,
+        "v_sync"        : 6,
+        "v_back_porch"  : 29,
+    },
+    "1280x720@60Hz" : {
+        "pix_clk"       : 74.25e6,
+        "h_active"      : 1280,
+        "h_front_porch" : 110,
+        "h_sync"        : 40,
+        "h_back_porch"  : 220,
+        "v_active"      : 720,
+        "v_front_porch" : 5,
+        "v_sync"        : 5,
+        "v_back_porch"  : 20,
+    },
+    "1920x1080@30Hz" : {
+        "pix_clk"       : 74.25e6,
+        "h_active"      : 1920,
+        "h_front_porch" : 88,
+        "h_sync"        : 44,
+        "h_back_porch"  : 148,
+        "v_active"      : 1080,
+        "v_front_porch" : 4,
+        "v_sync"        : 5,
+        "v_back_porch"  : 36,
+    },
+    "1920x1080@60Hz" : {
+        "pix_clk"       : 148.5e6,
+        "h_active"      : 1920,
+        "h_front_porch" : 88,
+        "h_sync"        : 44,
+        "h_back_porch"  : 148,
+        "v_active"      : 1080,
+        "v_front_porch" : 4,
+        "v_sync"        : 5,
+        "v_back_porch"  : 36,
+    },
+}
+
+_timing_fields = ["h_active", "h_front_porch", "h_sync", "h_back_porch",
+                  "v_active", "v_front_porch", "v_sync", "v_back_porch"]
+
+def pixels_per_clock(timings):
+    """Above 40MHz the fabric runs two pixels per video clock, with an ODDRX2F serializer"""
+    return 1 if timings["pix_clk"] <= 40e6 else 2
+
+# Mode ROM -----------------------------------------------------------------------------------------
+#
+# One entry per mode, one 32-bit word per field. pix_clk is the frequency the PLL actually generates
+# in Hz, pll_ref_div the reference divider it uses for the mode.
+
+video_mode_rom_fields = ["pix_clk"] + _timing_fields + ["pll_ref_div"]
+
+def video_mode_rom(modes, pixel_clks, pll_ref_divs):
+    rom = []
+    for t, pix_clk, ref_div in zip(modes, pixel_clks, pll_ref_divs):
+        rom += [int(pix_clk)] + [t[name] for name in _timing_fields] + [ref_div]
+    return rom
+
+# Timing generator ---------------------------------------------------------------------------------
+
+class VideoTimingGenerator(Module, AutoCSR):
+    """Generates sync/blank and line/frame counters from CSRs, horizontal CSR values are in pixels.
+       Changes are double buffered: once the fields are written, flipping `update` applies them all
+       together at the end of the current frame, `updated` follows `update` when they have landed.
+       Counters and boundaries are in clocks of `ppc` pixels, everything is registered so a consumer
+       that registers its pixels from `hcount`/`vcount` lines up with `hsync`, `vsync` and `blank`."""
+    def __init__(self, timings=video_timings["800x600@60Hz"], ppc=1):
+        shift = log2_int(ppc)
+
+        self.hsync = hsync = Signal()
+        self.vsync = vsync = Signal()
+        self.blank = blank = Signal(reset=1)
+
+        self.hcount = hcount = Signal(14)
+        self.vcount = vcount = Signal(14)
+        self.line_end = line_end = Signal()
+        self.frame_end = frame_end = Signal()
+        # Repeat the last line of the frame instead of wrapping, used by Genlock
+        self.frame_hold = frame_hold = Signal()
+
+        for name in _timing_fields:
+            setattr(self, name, CSRStorage(14, reset=int(timings[name]), name=name))
+        # A level rather than a strobe, the generator runs in the video domain
+        self.update = CSRStorage()
+        self.updated = CSRStatus()
+
+        # Sync end, active start, active end and total, for the current frame
+        def boundaries(t, prefix):
+            sync = t[prefix + "_sync"]
+            start = sync + t[prefix + "_back_porch"]
+            end = start + t[prefix + "_active"]
+            return [sync, start, end, end + t[prefix + "_front_porch"]]
+
+        h_bounds = [b >> shift for b in boundaries(timings, "h")]
+        v_bounds = boundaries(timings, "v")
+        self.h_sync_end, self.h_start, self.h_end, self.h_total = h = [Signal(14, reset=b) for b in h_bounds]
+        self.v_sync_end, self.v_start, self.v_end, self.v_total = v = [Signal(14, reset=b) for b in v_bounds]
+
+        pending = {}
+        for name in _timing_fields:
+            pending[name] = Signal(14)
+            self.specials += MultiReg(getattr(self, name).storage, pending[name])
+
+        # The fields are written before `update`, so they have crossed by the time it has
+        update = Signal()
+        updated = Signal()
+        self.specials += MultiReg(self.update.storage, update)
+        self.comb += self.updated.status.eq(updated)
+
+        self.comb += [
+            line_end.eq(hcount == self.h_total - 1),
+            frame_end.eq(line_end & (vcount == self.v_total - 1) & ~frame_hold),
+        ]
+
+        self.sync += [
+            hcount.eq(hcount + 1),
+            If(line_end,
+                hcount.eq(0),
+                If(frame_end,
+                    vcount.eq(0)
+                ).Elif(vcount != self.v_total - 1,
+                    vcount.eq(vcount + 1)
+                )
+            ),
+            If(frame_end & (update != updated),
+                [s.eq(b >> shift) for s, b in zip(h, boundaries(pending, "h"))],
+                [s.eq(b) for s, b in zip(v, boundaries(pending, "v"))],
+                updated.eq(update),
+            ),
+
+            # Syncs are active low
+            hsync.eq(hcount >= self.h_sync_end),
+            vsync.eq(vcount >= self.v_sync_end),
+            blank.eq(~((vcount >= self.v_start) & (vcount < self.v_end) &
+                       (hcount >= self.h_start) & (hcount < self.h_end))),
+        ]
+
+# Genlock ------------------------------------------------------------------------------------------
+
+class Genlock(Module, AutoCSR):
+    """Slaves the frame start of `timing` (a VideoTimingGenerator in the video domain) to `ref`, a pulse
+       in the video domain, delayed by `delay` lines. The output has to run slightly faster than the
+       reference: the last line of each frame is repeated until the delayed reference arrives, for up
+       to `max_hold` lines before the frame is let go.
+       `phase` is the number of lines held at the last frame start, or minus the number of lines the
+       reference arrived ahead of the end of the frame. `locked` is set when the frame start followed
+       the reference. `passthrough` picks what the locked output shows, the live stream or, by default,
+       a frame buffer being read out behind its writes."""
+    def __init__(self, timing, max_hold=32):
+        self.ref = ref = Signal()
+        self.locked = locked = Signal()
+
+        self.enable = CSRStorage()
+        self.delay = CSRStorage(14)
+        self.passthrough = CSRStorage()
+        self._locked = CSRStatus(name="locked")
+        self._phase = CSRStatus(16, name="phase")
+
+        # # #
+
+        enable = Signal()
+        delay = Signal(14)
+        self.specials += [
+            MultiReg(self.enable.storage, enable, "video"),
+            MultiReg(self.delay.storage, delay, "video"),
+        ]
+
+        delaying = Signal()
+        count = Signal(14)
+        pending = Signal()
+        held = Signal(max=max_hold + 1)
+        early = Signal(14)
+        phase = Signal((16, True))
+
+        self.comb += timing.frame_hold.eq(enable & ~pending & (held != max_hold))
+
+        self.sync.video += [
+            If(timing.line_end & ~timing.frame_end,
+                If(pending,
+                    early.eq(early + 1)
+                ),
+                If(timing.frame_hold,
+                    held.eq(held + 1)
+                )
+            ),
+            If(timing.frame_end,
+                pending.eq(0),
+                early.eq(0),
+                held.eq(0),
+                phase.eq(Mux(early != 0, -early, held)),
+                locked.eq(enable & pending & (early == 0)),
+            ),
+
+            # Delay the reference by whole output lines
+            If(ref,
+                delaying.eq(1),
+                count.eq(0),
+            ).Elif(delaying,
+                If(count == delay,
+                    delaying.eq(0),
+                    pending.eq(1),
+                ).Elif(timing.line_end,
+                    count.eq(count + 1)
+                )
+            ),
+        ]
+
+        self.specials += [
+            MultiReg(locked, self._locked.status),
+            MultiReg(phase, self._phase.status),
+        ]
+
+
+## Unit tests
+
+import unittest
+
+class TestVideoTiming(unittest.TestCase):
+
+    def test_double_buffer(self):
+        t = {"h_active": 16, "h_front_porch": 2, "h_sync": 4, "h_back_porch": 2,
+             "v_active": 4, "v_front_porch": 1, "v_sync": 1, "v_back_porch": 1}
+        vsync_falls = []
+        de = []
+
+        def generator(dut):
+            last = 0
+            for cycle in range(3*24*7):
+                if cycle == 30:
+                    # Lands at the end of the first frame, not part way through it
+                    yield dut.h_active.storage.eq(8)
+                if cycle == 40:
+                    yield dut.update.storage.eq(1)
+                if cycle == 200:
+                    # Not applied without an update
+                    yield dut.v_active.storage.eq(2)
+                vsync = (yield dut.vsync)
+                if last and not vsync:
+                    vsync_falls.append(cycle)
+                last = vsync
+                de.append(not (yield dut.blank))
+                yield
+
+        dut = VideoTimingGenerator(t)
+        run_simulation(dut, generator(dut))
+        # Outputs are registered, so everything trails the counters by a clock
+        self.assertEqual(vsync_falls[0], 24*7 + 1)
+        self.assertEqual(vsync_falls[1] - vsync_falls[0], 16*7)
+        self.assertEqual(vsync_falls[2] - vsync_falls[1], 16*7)
+        self.assertEqual(sum(de[:vsync_falls[0]]), 16*4)
+        self.assertEqual(sum(de[vsync_falls[0]:vsync_falls[1]]), 8*4)
+
+    def test_genlock(self):
+        t = {"h_active": 16, "h_front_porch": 2, "h_sync": 4, "h_back_porch": 2,
+             "v_active": 4, "v_front_porch": 1, "v_sync": 1, "v_back_porch": 1}
+        frame_starts = []
+        refs = []
+        locked = []
+
+        class DUT(Module):
+            def __init__(self):
+                self.submodules.timing = ClockDomainsRenamer({"sys":"video"})(VideoTimingGenerator(t))
+                self.submodules.genlock = Genlock(self.timing, max_hold=8)
+
+        def generator(dut):
+            yield dut.genlock.enable.storage.eq(1)
+            yield dut.genlock.delay.storage.eq(2)
+            # Reference frames are 9 lines, the free running output 7 lines
+            for cycle in range(12*24*9):
+                yield dut.genlock.ref.eq(cycle % (24*9) == 100)
+                if (yield dut.genlock.ref):
+                    refs.append(cycle)
+                if (yield dut.timing.frame_end):
+                    frame_starts.append(cycle + 1)
+                    locked.append((yield dut.genlock.locked))
+                yield
+
+        dut = DUT()
+        run_simulation(dut, {"video": generator(dut)}, clocks={"sys": 10, "video": 10})
+
+        self.assertTrue(all(locked[3:]))
+        # Once locked, each frame starts at the end of the line the delayed reference lands in
+        for ref in refs[3:]:
+            start = [f for f in frame_starts if f > ref][0]
+            self.assertTrue(2*24 <= start - ref <= 3*24 + 2)
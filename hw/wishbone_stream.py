@@ -95,6 +95,10 @@ class StreamWriter(Module, AutoCSR):
         self.transfer_size = CSRStorage(32)
         self.burst_size = CSRStorage(32, reset=256)
 
+        # Rectangle fetch: `line_length` words out of every `line_stride`, 0 for a linear transfer
+        self.line_length = CSRStorage(32)
+        self.line_stride = CSRStorage(32)
+
         self.done = CSRStatus()
 
         self.enable = CSR()
@@ -103,9 +107,23 @@ class StreamWriter(Module, AutoCSR):
 
         self.start = Signal()
 
+        # Abandon the transfer, words in flight are dropped
+        self.flush = Signal()
+
+        # Held low, transfers keep the settings of the last one
+        self.load = Signal(reset=1)
+
+        # Guard, while set bursts are held back until they end at or below word address `limit`. `frame`
+        # is the frame `limit` is in, once it moves past the frame this transfer started in the guard is
+        # released: the frame being read is complete, and `limit` has wrapped to the start of the next
+        self.guard = Signal()
+        self.limit = Signal(32)
+        self.frame = Signal(8)
+
         enabled = Signal()
         overflow = Signal()
         underflow = Signal()
+        stall = Signal()
         self.comb += [
             overflow.eq(source.ready & ~source.valid),
             underflow.eq(~source.ready & source.valid),
@@ -113,12 +131,23 @@ class StreamWriter(Module, AutoCSR):
             self.done.status.eq(done)
         ]
 
+        # Transfer settings are latched when a transfer starts with `load` set, so they change between
+        # frames, and only together once a group of writes is complete
+        start_address = Signal(32)
+        transfer_size = Signal(32)
+        line_length = Signal(32)
+        line_stride = Signal(32)
+        offset = Signal(32)
+        x_cnt = Signal(32)
+        line_end = Signal()
+        guard_frame = Signal(8)
+
         self.comb += [
             bus.sel.eq(0xF),
             bus.we.eq(0),
             bus.cyc.eq(active),
             bus.stb.eq(active),
-            bus.adr.eq(self.start_address.storage[:-2] + tx_cnt),
+            bus.adr.eq(start_address[:-2] + offset),
 
             source.data.eq(bus.dat_r),
             source.valid.eq(bus.ack & active),
@@ -133,16 +162,28 @@ class StreamWriter(Module, AutoCSR):
         ]
 
         self.comb += [
-            burst_end.eq(last_address | (burst_cnt == self.burst_size.storage - 1)),
-            last_address.eq(tx_cnt == self.transfer_size.storage - 1),
+            # Bursts can't cross the end of a line
+            burst_end.eq(last_address | line_end | (burst_cnt == self.burst_size.storage - 1)),
+            last_address.eq(tx_cnt == transfer_size - 1),
+            line_end.eq((line_length != 0) & (x_cnt == line_length - 1)),
+            stall.eq(self.guard & (self.frame == guard_frame) & (bus.adr + self.burst_size.storage > self.limit)),
         ]
 
         self.sync += [
             If(bus.ack & active,
                 If(last_address,
-                    tx_cnt.eq(0)
+                    tx_cnt.eq(0),
+                    offset.eq(0),
+                    x_cnt.eq(0),
                 ).Else(
-                    tx_cnt.eq(tx_cnt + 1)
+                    tx_cnt.eq(tx_cnt + 1),
+                    If(line_end,
+                        offset.eq(offset + line_stride - line_length + 1),
+                        x_cnt.eq(0)
+                    ).Else(
+                        offset.eq(offset + 1),
+                        x_cnt.eq(x_cnt + 1)
+                    )
                 )
             ),
             # Burst Counter
@@ -153,6 +194,11 @@ class StreamWriter(Module, AutoCSR):
                     burst_cnt.eq(burst_cnt + 1)
                 )
             ),
+            If(self.flush,
+                tx_cnt.eq(0),
+                offset.eq(0),
+                x_cnt.eq(0),
+            ),
             If(self.enable.re,
                 enabled.eq(self.enable.r[0])
             ),
@@ -169,11 +215,23 @@ class StreamWriter(Module, AutoCSR):
         # Main FSM
         self.submodules.fsm = fsm = FSM(reset_state="IDLE")
         fsm.act("IDLE",
-            If(busy & source.ready,
+            If(busy & source.ready & ~stall,
                 NextState("ACTIVE"),
             ),
             If((self.start & enabled & external_sync) | (~external_sync & self.enable.re),
                 NextValue(busy,1),
+                If(~busy,
+                    NextValue(guard_frame, self.frame),
+                ),
+                If(~busy & self.load,
+                    NextValue(start_address, self.start_address.storage),
+                    NextValue(transfer_size, self.transfer_size.storage),
+                    NextValue(line_length, self.line_length.storage),
+                    NextValue(line_stride, self.line_stride.storage),
+                )
+            ),
+            If(self.flush,
+                NextValue(busy, 0)
             )
         )
         fsm.act("ACTIVE",
@@ -187,7 +245,7 @@ class StreamWriter(Module, AutoCSR):
                     NextValue(busy,0),
                 )
             ),
-            If(self.reset.re,
+            If(self.reset.re | self.flush,
                 NextValue(busy, 0),
                 NextState("IDLE")
             )
@@ -196,7 +254,9 @@ class StreamWriter(Module, AutoCSR):
         self.comb += active.eq(fsm.ongoing("ACTIVE") & source.ready)
 
 class StreamReader(Module, AutoCSR):
-    def __init__(self, external_sync=False):
+    """With `sync_first` transfers start on a word marked `first`, words before it are dropped. A `first`
+       word arriving part way through a transfer restarts it."""
+    def __init__(self, external_sync=False, sync_first=False):
         self.bus  = bus = wishbone.Interface()
         self.sink = sink = Endpoint(data_stream_description(32))
 
@@ -220,15 +280,36 @@ class StreamReader(Module, AutoCSR):
         self.reset = CSR()
 
         self.start = Signal()
+        # Abandon the transfer, with `sync_first` the next one starts at the next frame
+        self.flush = Signal()
+
+        # Progress, the next word address written and whether a transfer is under way. `frame` counts
+        # the transfers started, restarts included
+        self.address = Signal(32)
+        self.busy = busy
+        self.frame = Signal(8)
 
         enabled = Signal()
         overflow = Signal()
         underflow = Signal()
+        frame_start = Signal()
+        restart = Signal()
+        drop = Signal()
+        if sync_first:
+            self.comb += [
+                frame_start.eq(sink.valid & sink.first),
+                restart.eq(frame_start & (tx_cnt != 0)),
+                drop.eq(enabled & ~busy & sink.valid & ~sink.first),
+            ]
+            start = enabled & frame_start
+        else:
+            start = (self.start & enabled & external_sync) | (~external_sync & self.enable.re)
         self.comb += [
             overflow.eq(sink.ready & ~sink.valid),
             underflow.eq(~sink.ready & sink.valid),
 
-            self.done.status.eq(done)
+            self.done.status.eq(done),
+            self.address.eq(bus.adr),
         ]
 
         self.dbg = [
@@ -253,7 +334,7 @@ class StreamReader(Module, AutoCSR):
             bus.stb.eq(active),
             bus.adr.eq(self.start_address.storage[:-2] + tx_cnt),
             bus.dat_w.eq(sink.data),
-            sink.ready.eq(bus.ack & active),
+            sink.ready.eq((bus.ack & active) | drop),
 
             If(~active,
                 bus.cti.eq(0b000) # CLASSIC_CYCLE
@@ -290,6 +371,12 @@ class StreamReader(Module, AutoCSR):
                     burst_cnt.eq(burst_cnt + 1)
                 )
             ),
+            If(restart | self.flush,
+                tx_cnt.eq(0)
+            ),
+            If(start & (~busy | restart),
+                self.frame.eq(self.frame + 1)
+            ),
             If(self.enable.re,
                 enabled.eq(self.enable.r[0])
             ),
@@ -305,15 +392,18 @@ class StreamReader(Module, AutoCSR):
         # Main FSM
         self.submodules.fsm = fsm = FSM(reset_state="IDLE")
         fsm.act("IDLE",
-            If(busy & sink.valid,
+            If(busy & sink.valid & ~restart,
                 NextState("ACTIVE"),
             ),
-            If((self.start & enabled & external_sync) | (~external_sync & self.enable.re),
+            If(start,
                 NextValue(busy,1),
+            ),
+            If(self.flush,
+                NextValue(busy,0),
             )
         )
         fsm.act("ACTIVE",
-            If(~sink.valid,
+            If(~sink.valid | restart,
                 NextState("IDLE")
             ),
             If(burst_end & bus.ack & active,
@@ -323,13 +413,13 @@ class StreamReader(Module, AutoCSR):
                     evt_done.eq(1),
                 )
             ),
-            If(self.reset.re,
+            If(self.reset.re | self.flush,
                 NextValue(busy, 0),
                 NextState("IDLE")
             )
         )
 
-        self.comb += active.eq(fsm.ongoing("ACTIVE") & sink.valid)
+        self.comb += active.eq(fsm.ongoing("ACTIVE") & sink.valid & ~restart & ~self.flush)
 
 
 # -=-=-=-= tests -=-=-=-=
@@ -382,7 +472,219 @@ class TestWriter(unittest.TestCase):
         
 
         run_simulation(dut, [write(dut), logger(dut)], vcd_name='write.vcd')
-    
+
+    def test_dma_rect(self):
+        # 3x2 word window out of a 5 word wide frame, starting at word 6
+        addresses = []
+
+        def control(dut):
+            yield from dut.start_address.write(6)
+            yield from dut.transfer_size.write(6)
+            yield from dut.line_length.write(3)
+            yield from dut.line_stride.write(5)
+            yield from dut.enable.write(1)
+
+        def bus(dut):
+            yield dut.source.ready.eq(1)
+            while len(addresses) < 6:
+                yield dut.bus.ack.eq(0)
+                yield
+                if (yield dut.bus.cyc):
+                    addresses.append((yield dut.bus.adr))
+                    yield dut.bus.ack.eq(1)
+                    yield
+
+        dut = StreamWriter()
+        run_simulation(dut, [control(dut), bus(dut)])
+        self.assertEqual(addresses, [6, 7, 8, 11, 12, 13])
+
+    def test_dma_load(self):
+        # New settings wait for a start with `load` set
+        reads = []
+
+        def control(dut):
+            yield from dut.start_address.write(6)
+            yield from dut.transfer_size.write(2)
+            yield from dut.enable.write(1)
+            for load, address in [(1, 20), (0, 30), (1, 30)]:
+                yield dut.load.eq(load)
+                yield dut.start.eq(1)
+                yield
+                yield dut.start.eq(0)
+                yield dut.load.eq(0)
+                yield from dut.start_address.write(address)
+                for _ in range(20):
+                    yield
+
+        def bus(dut):
+            yield dut.source.ready.eq(1)
+            while len(reads) < 6:
+                yield dut.bus.ack.eq(0)
+                yield
+                if (yield dut.bus.cyc):
+                    reads.append((yield dut.bus.adr))
+                    yield dut.bus.ack.eq(1)
+                    yield
+
+        dut = StreamWriter(external_sync=True)
+        run_simulation(dut, [control(dut), bus(dut)])
+        self.assertEqual(reads, [6, 7, 6, 7, 30, 31])
+
+    def test_dma_guard(self):
+        # Reads stop short of `limit`, then follow it up
+        reads = []
+
+        def control(dut):
+            yield dut.guard.eq(1)
+            yield dut.limit.eq(4)
+            yield from dut.transfer_size.write(8)
+            yield from dut.burst_size.write(2)
+            yield from dut.enable.write(1)
+            for _ in range(40):
+                yield
+            self.assertEqual(reads, [0, 1, 2, 3])
+            yield dut.limit.eq(7)
+            for _ in range(40):
+                yield
+            self.assertEqual(reads, [0, 1, 2, 3, 4, 5])
+            yield dut.guard.eq(0)
+
+        def bus(dut):
+            yield dut.source.ready.eq(1)
+            while len(reads) < 8:
+                yield dut.bus.ack.eq(0)
+                yield
+                if (yield dut.bus.cyc):
+                    reads.append((yield dut.bus.adr))
+                    yield dut.bus.ack.eq(1)
+                    yield
+
+        dut = StreamWriter()
+        run_simulation(dut, [control(dut), bus(dut)])
+        self.assertEqual(reads, list(range(8)))
+
+    def test_dma_sync_first(self):
+        # Leftovers are dropped, the second frame is short so the third restarts the transfer
+        words = [(0x10, 0), (0x11, 0), (0x20, 1), (0x21, 0), (0x22, 0), (0x30, 1), (0x31, 0), (0x40, 1), (0x41, 0), (0x42, 0)]
+        writes = []
+
+        def control(dut):
+            yield from dut.transfer_size.write(3)
+            yield from dut.burst_size.write(2)
+            yield from dut.enable.write(1)
+
+        def source(dut):
+            for _ in range(20):
+                yield
+            for data, first in words:
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(data)
+                yield dut.sink.first.eq(first)
+                yield
+                while not (yield dut.sink.ready):
+                    yield
+            yield dut.sink.valid.eq(0)
+
+        def bus(dut):
+            for _ in range(100):
+                yield dut.bus.ack.eq(0)
+                yield
+                if (yield dut.bus.cyc):
+                    writes.append(((yield dut.bus.adr), (yield dut.bus.dat_w)))
+                    yield dut.bus.ack.eq(1)
+                    yield
+
+        def frames(dut):
+            for _ in range(100):
+                yield
+            self.assertEqual((yield dut.frame), 3)
+
+        dut = StreamReader(sync_first=True)
+        run_simulation(dut, [control(dut), source(dut), bus(dut), frames(dut)])
+        self.assertEqual(writes, [(0, 0x20), (1, 0x21), (2, 0x22), (0, 0x30), (1, 0x31), (0, 0x40), (1, 0x41), (2, 0x42)])
+
+    def test_dma_guard_wrap(self):
+        # The reader writes frames back to back into one buffer and the writer reads them behind it, held
+        # back while it can't keep up. The reader wraps to the start for the next frame before the writer
+        # has finished reading the first, which is still read whole.
+        mem = {}
+        writes = []
+        reads = []
+
+        class DUT(Module):
+            def __init__(self):
+                self.submodules.reader = reader = StreamReader(sync_first=True)
+                self.submodules.writer = writer = StreamWriter(external_sync=True)
+                # As in the SoC, between transfers `frame` is the one the reader writes next
+                self.comb += [
+                    writer.guard.eq(reader.busy),
+                    writer.limit.eq(reader.address),
+                    writer.frame.eq(reader.frame + ~reader.busy),
+                ]
+
+        def control(dut):
+            for d in [dut.reader, dut.writer]:
+                yield from d.transfer_size.write(8)
+                yield from d.burst_size.write(2)
+                yield from d.enable.write(1)
+            while len(writes) < 1:
+                yield
+            yield dut.writer.start.eq(1)
+            yield
+            yield dut.writer.start.eq(0)
+
+        def source(dut):
+            # The first frame quickly, the second slowly
+            for n, pace in [(0x10, 2), (0x20, 12)]:
+                for i in range(8):
+                    yield dut.reader.sink.valid.eq(1)
+                    yield dut.reader.sink.data.eq(n + i)
+                    yield dut.reader.sink.first.eq(i == 0)
+                    yield
+                    while not (yield dut.reader.sink.ready):
+                        yield
+                    yield dut.reader.sink.valid.eq(0)
+                    for _ in range(pace):
+                        yield
+
+        def reader_bus(dut):
+            bus = dut.reader.bus
+            for _ in range(400):
+                yield bus.ack.eq(0)
+                yield
+                if (yield bus.cyc):
+                    mem[(yield bus.adr)] = (yield bus.dat_w)
+                    writes.append((yield bus.adr))
+                    yield bus.ack.eq(1)
+                    yield
+
+        def writer_bus(dut):
+            bus = dut.writer.bus
+            for _ in range(400):
+                yield bus.ack.eq(0)
+                yield
+                if (yield bus.cyc):
+                    yield bus.dat_r.eq(mem.get((yield bus.adr), 0))
+                    reads.append((yield bus.adr))
+                    yield bus.ack.eq(1)
+                    yield
+
+        def sink(dut):
+            # Stops taking words half way through, until the reader is into the second frame
+            source = dut.writer.source
+            words = []
+            yield source.ready.eq(1)
+            for _ in range(400):
+                yield
+                if (yield source.valid):
+                    words.append((yield source.data))
+                yield source.ready.eq((len(words) < 4) | (len(writes) >= 10))
+            self.assertEqual(words, [0x10 + i for i in range(8)])
+
+        dut = DUT()
+        run_simulation(dut, [control(dut), source(dut), reader_bus(dut), writer_bus(dut), sink(dut)])
+        self.assertEqual(reads, list(range(8)))
+
 
 
 if __name__ == '__main__':
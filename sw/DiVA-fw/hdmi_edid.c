@@ -1,21 +1,52 @@
+#include <stdio.h>
 #include <generated/csr.h>
 
 #include "i2c.h"
+#include "hdmi_edid.h"
 
-#if 0
+#ifdef CSR_HDMI_I2C_BASE
 
 I2C hdmi_out0_i2c;
 int hdmi_out0_debug_enabled = 0;
 
+/* The CSR accessors are 32 bits wide, the bit banging wants bytes */
+static unsigned char hdmi_out0_w_read(void) { return hdmi_i2c_w_read(); }
+static void hdmi_out0_w_write(unsigned char value) { hdmi_i2c_w_write(value); }
+static unsigned char hdmi_out0_r_read(void) { return hdmi_i2c_r_read(); }
+
 void hdmi_out0_i2c_init(void) {
     printf("hdmi_out0: Init I2C...");
-    hdmi_out0_i2c.w_read = hdmi_i2c_w_read;
-    hdmi_out0_i2c.w_write = hdmi_i2c_w_write;
-    hdmi_out0_i2c.r_read = hdmi_i2c_r_read;
+    hdmi_out0_i2c.w_read = hdmi_out0_w_read;
+    hdmi_out0_i2c.w_write = hdmi_out0_w_write;
+    hdmi_out0_i2c.r_read = hdmi_out0_r_read;
     i2c_init(&hdmi_out0_i2c);
     printf("finished.\n");
 }
 
+/* Reads the 128 byte base EDID block, returns 0 on a NACK or a bad checksum */
+int hdmi_out0_read_edid(unsigned char *edid) {
+    int eeprom_addr;
+    unsigned char sum = 0;
+
+    i2c_start_cond(&hdmi_out0_i2c);
+    if (!i2c_write(&hdmi_out0_i2c, 0xa0) || !i2c_write(&hdmi_out0_i2c, 0x00)) {
+        i2c_stop_cond(&hdmi_out0_i2c);
+        return 0;
+    }
+    i2c_start_cond(&hdmi_out0_i2c);
+    if (!i2c_write(&hdmi_out0_i2c, 0xa1)) {
+        i2c_stop_cond(&hdmi_out0_i2c);
+        return 0;
+    }
+    for (eeprom_addr = 0 ; eeprom_addr < 128 ; eeprom_addr++) {
+        edid[eeprom_addr] = i2c_read(&hdmi_out0_i2c, eeprom_addr != 127);
+        sum += edid[eeprom_addr];
+    }
+    i2c_stop_cond(&hdmi_out0_i2c);
+
+    return sum == 0;
+}
+
 void hdmi_out0_print_edid(void) {
     int eeprom_addr, e, extension_number = 0;
     unsigned char b;
@@ -69,3 +100,23 @@ void hdmi_out0_print_edid(void) {
 }
 
 #endif
+
+/* The first detailed timing descriptor holds the monitor's preferred mode, returns 0 if there is none */
+int edid_preferred_timing(const unsigned char *edid, edid_timing_t *t) {
+    const unsigned char *d = &edid[54];
+
+    t->pix_clk = (d[0] | (d[1] << 8)) * 10000;
+    if (t->pix_clk == 0)
+        return 0;
+
+    t->h_active = d[2] | ((d[4] & 0xf0) << 4);
+    t->h_blank = d[3] | ((d[4] & 0x0f) << 8);
+    t->v_active = d[5] | ((d[7] & 0xf0) << 4);
+    t->v_blank = d[6] | ((d[7] & 0x0f) << 8);
+    t->h_front_porch = d[8] | ((d[11] & 0xc0) << 2);
+    t->h_sync = d[9] | ((d[11] & 0x30) << 4);
+    t->v_front_porch = (d[10] >> 4) | ((d[11] & 0x0c) << 2);
+    t->v_sync = (d[10] & 0x0f) | ((d[11] & 0x03) << 4);
+
+    return 1;
+}
@@ -1,2 +1,18 @@
+#ifndef __HDMI_EDID_H
+#define __HDMI_EDID_H
+
+#include <stdint.h>
+
+/* Detailed timing descriptor, horizontal values in pixels and vertical values in lines */
+typedef struct {
+	uint32_t pix_clk;
+	uint16_t h_active, h_front_porch, h_sync, h_blank;
+	uint16_t v_active, v_front_porch, v_sync, v_blank;
+} edid_timing_t;
+
 void hdmi_out0_i2c_init(void);
-void hdmi_out0_print_edid(void);
\ No newline at end of file
+int hdmi_out0_read_edid(unsigned char *edid);
+void hdmi_out0_print_edid(void);
+int edid_preferred_timing(const unsigned char *edid, edid_timing_t *t);
+
+#endif /* __HDMI_EDID_H */
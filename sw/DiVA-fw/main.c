@@ -10,6 +10,9 @@
 #include <generated/csr.h>
 #include <generated/mem.h>
 #include <generated/git.h>
+#include <generated/soc.h>
+
+#include "hdmi_edid.h"
 
 void isr(void){
 
@@ -17,50 +20,490 @@ void isr(void){
 
 uint8_t x = 0;
 uint8_t y = 0;
+uint8_t scroll = 0;
+bool clearing = false;
+
+/* Cell color, low nibble foreground, high nibble background, VGA palette */
+uint8_t attr = 0x07;
+
+/* Fill a rectangle of the screen in the background, rows are screen rows */
+void terminal_fill(int col, int row, int w, int h, uint16_t c){
+	while(terminal_fill_busy_read());
+	terminal_fill_x_write(col);
+	terminal_fill_y_write(row);
+	terminal_fill_width_write(w);
+	terminal_fill_height_write(h);
+	terminal_fill_data_write(c);
+	terminal_fill_start_write(1);
+}
+
+/* Text rows on screen, 16 lines each, of the 40 in the text RAM */
+static int terminal_rows(void){
+	int rows = video_timing_v_active_read() / 16;
+	return rows < 40 ? rows : 40;
+}
+
+/* At the bottom of the screen scroll up a row and clear the new bottom row */
+void terminal_newline(void){
+	int rows = terminal_rows();
+	if(y < rows - 1){
+		y += 1;
+		return;
+	}
+	/* The next row lands on the bottom one, also after a mode with more rows */
+	scroll = (scroll + y + 2 - rows) % 40;
+	y = rows - 1;
+	terminal_scroll_write(scroll);
+	terminal_fill(0, rows - 1, 80, 1, ' ' | (attr << 8));
+	clearing = true;
+}
 
+/* ANSI SGR colors: reset, bold, 30-37 foreground and 40-47 background */
+static void terminal_sgr(int n){
+	static const uint8_t ansi_to_vga[8] = {0, 4, 2, 6, 1, 5, 3, 7};
+	if(n == 0){
+		attr = 0x07;
+	}else if(n == 1){
+		attr |= 0x08;
+	}else if((n >= 30) && (n <= 37)){
+		attr = (attr & 0xF8) | ansi_to_vga[n - 30];
+	}else if((n >= 40) && (n <= 47)){
+		attr = (attr & 0x0F) | (ansi_to_vga[n - 40] << 4);
+	}
+}
 
 void terminal_write(char c){
 	volatile uint32_t* vga = (volatile uint32_t*) (TERMINAL_BASE);
-	if(c == '\r'){
+	static int escape = 0;
+	static int param = 0;
+
+	if(escape == 1){
+		escape = (c == '[') ? 2 : 0;
+		param = 0;
+		return;
+	}
+	if(escape == 2){
+		if((c >= '0') && (c <= '9')){
+			param = param*10 + (c - '0');
+			return;
+		}
+		terminal_sgr(param);
+		param = 0;
+		if(c != ';') escape = 0;
+		return;
+	}
+
+	if(c == '\e'){
+		escape = 1;
+	}else if(c == '\r'){
 		x = 0;
 	}else if(c == '\n'){
-		y += 1;
+		terminal_newline();
 	}else{
 		if(x >= 80){
 			x = 0;
-			y += 1;
+			terminal_newline();
 		}
 
-		vga[x + y*80] = c; 
-		//vga[x*2 + y*80*2 + 1] = 14; 
+		/* Let the row clear finish before writing over it */
+		if(clearing){
+			while(terminal_fill_busy_read());
+			clearing = false;
+		}
+		vga[x + ((y + scroll) % 40)*80] = (uint8_t)c | (attr << 8);
 		x += 1;
 	}
 }
 
 
 
+/* The crop fetched from HyperRAM, and the scaler geometry, are applied together at the vsync after
+   a commit. Wait for the last one to land before writing the next. */
+void crop_begin(void){
+	while(crop_pending_read());
+}
+
+void crop_end(void){
+	crop_commit_write(1);
+}
+
+/* Fetch the whole 640x512 Boson frame from HyperRAM */
+void full_frame(void){
+	crop_begin();
+	writer_start_address_write(0);
+	writer_transfer_size_write(640*512);
+	writer_line_length_write(0);
+	crop_end();
+}
+
+/* Raw frames are stored after the displayed frame, two 16 bit pixels per word */
+#define RAW_FRAME_ADDRESS (640*512)
+/* Button polls a press is held for to toggle raw capture, a long press is over 100 */
+#define RAW_PRESS 400
+
+/* Capture the Boson's 16 bit pre-AGC output into HyperRAM instead of the colour frame. The Boson is
+   reconfigured by the gateware, which shows the AGC's preview of the raw frames through the genlocked
+   passthrough meanwhile. Until genlock locks the last colour frame stays on screen. */
+void capture_raw(bool raw){
+	reader_reset_write(1);
+	reader_start_address_write(raw ? RAW_FRAME_ADDRESS : 0);
+	reader_transfer_size_write(raw ? 640*512/2 : 640*512);
+	reader_enable_write(1);
+	boson_raw_write(raw);
+}
+
+#ifdef BOSON_COMMAND_BASE
+/* Send a command to the Boson and wait for the reply. Returns the reply's status, 0 on success, or -1
+   without a reply. The reply, from its channel byte, is at word 2048 of the command store. */
+int boson_command(uint32_t function, const uint8_t *data, int len){
+	static uint32_t seq = 0x1000;
+	volatile uint32_t* store = (volatile uint32_t*)(BOSON_COMMAND_BASE);
+	uint32_t header[] = {seq++, function, 0xFFFFFFFF};
+	uint32_t replies = boson_command_replies_read();
+	int n = 1024;
+
+	store[n++] = 12 + len;
+	for(int i = 0; i < 3; i++)
+		for(int j = 24; j >= 0; j -= 8)
+			store[n++] = (header[i] >> j) & 0xFF;
+	for(int i = 0; i < len; i++)
+		store[n++] = data[i];
+
+	boson_command_address_write(1024);
+	boson_command_count_write(1);
+	boson_command_send_write(1);
+	while(boson_command_busy_read());
+
+	if(boson_command_replies_read() == replies)
+		return -1;
+	return boson_command_reply_status_read();
+}
+#endif
+
+#ifdef CSR_CSC_BASE
+/* YCbCr to RGB matrices: rows R, G, B by columns Y, Cb, Cr with 14 fractional bits, then the offsets
+   added to Y, Cb, Cr. The gateware resets to BT.601 full range. */
+static const int32_t colour_matrices[][12] = {
+	{16384, 0, 22970, 16384, -5638, -11700, 16384, 29032, 0, 0, -128, -128}, /* BT.601 full range */
+	{19077, 0, 26149, 19077, -6419, -13320, 19077, 33050, 0, -16, -128, -128}, /* BT.601 limited range */
+	{16384, 0, 25802, 16384, -3069, -7670, 16384, 30402, 0, 0, -128, -128}, /* BT.709 full range */
+	{19077, 0, 29372, 19077, -3494, -8731, 19077, 34610, 0, -16, -128, -128}, /* BT.709 limited range */
+};
+
+void set_colour_matrix(int n){
+	const int32_t *m = colour_matrices[n];
+
+	csc_coef00_write(m[0] & 0x3FFFF);
+	csc_coef01_write(m[1] & 0x3FFFF);
+	csc_coef02_write(m[2] & 0x3FFFF);
+	csc_coef10_write(m[3] & 0x3FFFF);
+	csc_coef11_write(m[4] & 0x3FFFF);
+	csc_coef12_write(m[5] & 0x3FFFF);
+	csc_coef20_write(m[6] & 0x3FFFF);
+	csc_coef21_write(m[7] & 0x3FFFF);
+	csc_coef22_write(m[8] & 0x3FFFF);
+	csc_in_offset0_write(m[9] & 0x1FF);
+	csc_in_offset1_write(m[10] & 0x1FF);
+	csc_in_offset2_write(m[11] & 0x1FF);
+}
+#endif
+
+#ifdef CSR_SPATIAL_BASE
+/* 3x3 kernels on the luminance, rows top to bottom, then the shift and offset applied to the sum.
+   The gateware resets to the identity. */
+static const int16_t spatial_filters[][11] = {
+	{0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0}, /* Identity */
+	{0, -4, 0, -4, 32, -4, 0, -4, 0, 4, 0}, /* Sharpen */
+	{-1, -1, -1, -1, 8, -1, -1, -1, -1, 0, 128}, /* Edges */
+	{1, 2, 1, 2, 4, 2, 1, 2, 1, 4, 0}, /* Denoise */
+};
+
+void set_spatial_filter(int n){
+	const int16_t *k = spatial_filters[n];
+
+	spatial_coef00_write(k[0] & 0x3FF);
+	spatial_coef01_write(k[1] & 0x3FF);
+	spatial_coef02_write(k[2] & 0x3FF);
+	spatial_coef10_write(k[3] & 0x3FF);
+	spatial_coef11_write(k[4] & 0x3FF);
+	spatial_coef12_write(k[5] & 0x3FF);
+	spatial_coef20_write(k[6] & 0x3FF);
+	spatial_coef21_write(k[7] & 0x3FF);
+	spatial_coef22_write(k[8] & 0x3FF);
+	spatial_shift_write(k[9]);
+	spatial_offset_write(k[10] & 0x1FF);
+}
+#endif
+
+#ifdef CSR_PALETTE_BASE
+/* Gradients through evenly spaced 0xRRGGBB stops */
+static const uint32_t palette_white_hot[] = {0x000000, 0xFFFFFF};
+static const uint32_t palette_black_hot[] = {0xFFFFFF, 0x000000};
+static const uint32_t palette_ironbow[] = {0x000000, 0x20008C, 0x8C00A0, 0xE0400C, 0xFFA000, 0xFFE060, 0xFFFFFF};
+static const uint32_t palette_rainbow[] = {0x000080, 0x0000FF, 0x00FFFF, 0x00FF00, 0xFFFF00, 0xFF0000, 0xFFFFFF};
+
+static const struct {
+	const uint32_t* stops;
+	int count;
+} palettes[] = {
+	{palette_white_hot, 2},
+	{palette_black_hot, 2},
+	{palette_ironbow, 7},
+	{palette_rainbow, 7},
+};
+
+static int palette_bank = 0;
+
+/* Load a palette into the bank not being shown, then swap banks at the next Boson vsync */
+void set_palette(int index){
+	volatile uint32_t* lut = (volatile uint32_t*)(PALETTE_BASE);
+	const uint32_t* stops = palettes[index].stops;
+	int segments = palettes[index].count - 1;
+	int bank = palette_bank ^ 1;
+
+	for(int i = 0; i < 256; i++){
+		int s = (i * segments) / 256;
+		int t = (i * segments) % 256;
+		uint32_t a = stops[s], b = stops[s + 1];
+		uint32_t entry = 0;
+		for(int c = 0; c < 24; c += 8){
+			int x = (a >> c) & 0xFF;
+			int y = (b >> c) & 0xFF;
+			entry |= ((x + ((y - x) * t) / 256) & 0xFF) << c;
+		}
+		/* Entries are 0x00BBGGRR */
+		lut[bank*256 + i] = ((entry >> 16) & 0xFF) | (entry & 0xFF00) | ((entry & 0xFF) << 16);
+	}
+
+	palette_bank = bank;
+	palette_bank_write(bank);
+	palette_enable_write(1);
+}
+#endif
+
+#ifdef CSR_HISTOGRAM_BASE
+#define HISTOGRAM_BINS 1024
+
+/* Luminance below which `percent` of the last Boson frame falls, 0-255 */
+int histogram_percentile(int percent){
+	volatile uint32_t* bins = (volatile uint32_t*)(HISTOGRAM_BASE);
+	uint32_t total = 0, sum = 0;
+	int i;
+
+	/* Hold the complete frame while it's read */
+	histogram_freeze_write(1);
+	for(i = 0; i < HISTOGRAM_BINS; i++)
+		total += bins[i];
+	for(i = 0; i < HISTOGRAM_BINS - 1; i++){
+		sum += bins[i];
+		if(sum * 100 >= total * percent)
+			break;
+	}
+	histogram_freeze_write(0);
+	return i * 256 / HISTOGRAM_BINS;
+}
+#endif
+
+#ifdef CSR_COMPOSITOR_BASE
+/* Show a w*h OSD image, stored in HyperRAM at word `address`, at x/y over the video. Black pixels
+   are keyed out, `alpha` sets how much of the OSD covers what's below, 255 is opaque. */
+void osd_show(uint32_t address, int x, int y, int w, int h, uint8_t alpha){
+	writer2_reset_write(1);
+	writer2_start_address_write(address);
+	writer2_transfer_size_write(w*h);
+	writer2_burst_size_write(256);
+	writer2_enable_write(1);
+
+	framer_osd_x_start_write(x);
+	framer_osd_y_start_write(y);
+	framer_osd_width_write(w);
+	framer_osd_height_write(h);
+
+	compositor_layer2_alpha_write(alpha);
+}
+#endif
+
+#ifdef CSR_SCALER_STEP_X_ADDR
+uint32_t zoom = 16;
+int32_t pan_x = 0;
+int32_t pan_y = 0;
+
+/* Zoom steps from the button, and the pan positions cycled through while zoomed: centre, left,
+   right, top, bottom, as a fraction of the spare frame */
+static const uint32_t zoom_levels[] = {16, 24, 32, 48, 64};
+static const int8_t pan_positions[][2] = {{0, 0}, {-1, 0}, {1, 0}, {0, -1}, {0, 1}};
+#define ZOOM_LEVELS (sizeof(zoom_levels) / sizeof(zoom_levels[0]))
+#define PAN_POSITIONS (sizeof(pan_positions) / sizeof(pan_positions[0]))
+
+/* Zoom in 1/16 steps, from 16 (1x) to 128 (8x). Only the crop is fetched from HyperRAM, then
+   scaled to fill the output. Pan moves the crop centre in source pixels. Applied at vsync. */
+void set_zoom(void){
+	if(zoom < 16) zoom = 16;
+	if(zoom > 128) zoom = 128;
+
+	int32_t w = (640 * 16) / zoom;
+	int32_t h = (512 * 16) / zoom;
+
+	int32_t x = (640 - w)/2 + pan_x;
+	int32_t y = (512 - h)/2 + pan_y;
+	if(x < 0) x = 0;
+	if(y < 0) y = 0;
+	if(x > 640 - w) x = 640 - w;
+	if(y > 512 - h) y = 512 - h;
+
+	crop_begin();
+	writer_start_address_write(y*640 + x);
+	writer_transfer_size_write(w*h);
+	writer_line_length_write(w);
+	writer_line_stride_write(640);
+
+	scaler_width_in_write(w);
+	scaler_height_in_write(h);
+	scaler_step_x_write((w << 16) / SCALER_WIDTH);
+	scaler_step_y_write((h << 16) / SCALER_HEIGHT);
+	crop_end();
+}
+
+/* Pan to one of pan_positions at the current zoom */
+void set_pan(int n){
+	pan_x = pan_positions[n][0] * (int32_t)(640 - (640 * 16) / zoom) / 2;
+	pan_y = pan_positions[n][1] * (int32_t)(512 - (512 * 16) / zoom) / 2;
+	set_zoom();
+}
+#endif
+
+/* Modes built into the gateware, laid out by video_mode_rom() */
+typedef struct {
+	uint32_t pix_clk;
+	uint32_t h_active, h_front_porch, h_sync, h_back_porch;
+	uint32_t v_active, v_front_porch, v_sync, v_back_porch;
+	uint32_t pll_ref_div;
+} video_mode_t;
+
+static const video_mode_t* video_modes = (const video_mode_t*)VIDEO_MODES_BASE;
+
+#ifdef CSR_CRG_VIDEO_MODE_ADDR
+/* Retune the video PLL and retime the output to one of the modes built into the gateware.
+   The timing generator picks up the new values together at the end of the frame, call
+   switch_mode() afterwards to recentre the picture. */
+void set_video_mode(int mode){
+	const video_mode_t* m = &video_modes[mode];
+
+	video_timing_h_active_write(m->h_active);
+	video_timing_h_front_porch_write(m->h_front_porch);
+	video_timing_h_sync_write(m->h_sync);
+	video_timing_h_back_porch_write(m->h_back_porch);
+	video_timing_v_active_write(m->v_active);
+	video_timing_v_front_porch_write(m->v_front_porch);
+	video_timing_v_sync_write(m->v_sync);
+	video_timing_v_back_porch_write(m->v_back_porch);
+	/* Flipping update applies all the fields together */
+	video_timing_update_write(!video_timing_update_read());
+
+	crg_video_mode_write(mode);
+	/* Let the PLL drop lock before waiting on it */
+	msleep(1);
+	while(!crg_video_locked_read());
+	while(video_timing_updated_read() != video_timing_update_read());
+}
+
+/* Pick the mode closest to the monitor's preferred timing, so the monitor doesn't scale (and
+   buffer) the picture. An exact resolution match wins, otherwise the largest mode that fits.
+   Falls back to the power up mode without a readable EDID. */
+int select_video_mode(void){
+	unsigned char edid[128];
+	edid_timing_t t;
+	int best = 0;
+	uint32_t best_area = 0;
+
+	hdmi_out0_i2c_init();
+	if(!hdmi_out0_read_edid(edid) || !edid_preferred_timing(edid, &t)){
+		printf("No EDID, keeping %ux%u\n", video_modes[0].h_active, video_modes[0].v_active);
+		return 0;
+	}
+	printf("Monitor prefers %ux%u %u.%02uMHz\n", t.h_active, t.v_active,
+		t.pix_clk / 1000000, (t.pix_clk / 10000) % 100);
+
+	for(int i = 0; i < VIDEO_MODES; i++){
+		const video_mode_t* m = &video_modes[i];
+		if((m->h_active == t.h_active) && (m->v_active == t.v_active)){
+			best = i;
+			break;
+		}
+		uint32_t area = m->h_active * m->v_active;
+		if((m->h_active <= t.h_active) && (m->v_active <= t.v_active) && (area > best_area)){
+			best = i;
+			best_area = area;
+		}
+	}
+
+	printf("Output %ux%u\n", video_modes[best].h_active, video_modes[best].v_active);
+	set_video_mode(best);
+	return best;
+}
+#endif
+
 void switch_mode(int mode){
+#ifdef CSR_INTEGER_SCALER_BASE
 	if(mode == 0){
-		framer_x_start_write(213);
-		framer_y_start_write(27);
-
-		framer_width_write(800);
-		framer_height_write(600);
+#endif
+		framer_x_start_write((video_timing_h_active_read()-SCALER_WIDTH)/2);
+		framer_y_start_write((video_timing_v_active_read()-SCALER_HEIGHT)/2);
 
+		framer_width_write(SCALER_WIDTH);
+		framer_height_write(SCALER_HEIGHT);
 
+#ifdef CSR_SCALER_STEP_X_ADDR
+		set_zoom();
+#else
+		full_frame();
+#endif
 
 		scaler_enable_write(1);
+#ifdef CSR_INTEGER_SCALER_BASE
 	}else{
-		framer_width_write(640);
-		framer_height_write(512);
-
-		framer_x_start_write(213 + (800-640)/2);
-		framer_y_start_write(27 +  (600-512)/2);
-
+		/* Integer zoom, factor 1 shows the frame unscaled. Only the centre crop that is seen is
+		   fetched, a line of it repeated for each factor must fit the output line. */
+		int32_t h_active = video_timing_h_active_read();
+		int32_t v_active = video_timing_v_active_read();
+		int32_t w = (h_active + mode - 1) / mode;
+		int32_t h = (v_active + mode - 1) / mode;
+		if(w > 640) w = 640;
+		if(h > 512) h = 512;
+
+		/* The scaled crop overhangs the screen by less than a pixel's repeat, the scaler clips it */
+		int32_t width = w * mode;
+		int32_t height = h * mode;
+		if(width > h_active) width = h_active;
+		if(height > v_active) height = v_active;
+
+		framer_width_write(width);
+		framer_height_write(height);
+
+		framer_x_start_write((h_active - width)/2);
+		framer_y_start_write((v_active - height)/2);
+
+		crop_begin();
+		writer_start_address_write(((512 - h)/2)*640 + (640 - w)/2);
+		writer_transfer_size_write(w*h);
+		writer_line_length_write(w);
+		writer_line_stride_write(640);
+
+		integer_scaler_width_in_write(w);
+		integer_scaler_factor_write(mode);
+		crop_end();
 		scaler_enable_write(0);
 	}
+#endif
 }
 
+#ifdef CSR_INTEGER_SCALER_BASE
+/* The interpolating scaler, then integer zoom at each factor */
+#define SCALE_MODES (1 + INTEGER_SCALER_MAX_FACTOR)
+#else
+#define SCALE_MODES 1
+#endif
+
 
 
 int colour(int j){
@@ -136,17 +579,39 @@ int main(int i, char **c)
 	writer_burst_size_write(512);
 	writer_enable_write(1);
 	
-
-	framer_width_write(800);
-	framer_height_write(600);
-
-	//framer_x_start_write(213);
-	//framer_y_start_write(27);
-	framer_x_start_write(213 + (800-640)/2);
-	framer_y_start_write(27 +  (600-512)/2);
+#ifdef CSR_CRG_VIDEO_MODE_ADDR
+	select_video_mode();
+#endif
 
 	switch_mode(1);
 
+#ifdef CSR_PALETTE_BASE
+	int palette = 2;
+	set_palette(palette);
+#endif
+
+#ifdef CSR_AGC_BASE
+	/* Stretch the luminance between 1% and 99% of each frame */
+	agc_enable_write(1);
+#endif
+
+#ifdef CSR_TNR_BASE
+	/* Blend each frame with the last one stored, the filter restarts this read every frame */
+	writer3_reset_write(1);
+	writer3_start_address_write(0);
+	writer3_transfer_size_write(640*512);
+	writer3_burst_size_write(256);
+	writer3_enable_write(1);
+	tnr_enable_write(1);
+#endif
+
+	/* Lock the output frame rate to the Boson, the output frame starts a few lines after the
+	   Boson's and is read from HyperRAM right behind the writes, so the crop, zoom and TNR still
+	   apply. genlock_passthrough_write(1) would skip HyperRAM, and them. The frame buffer free
+	   runs until it locks. */
+	genlock_delay_write(4);
+	genlock_enable_write(1);
+
 	//msleep(100);
 	//switch_mode(1);
 	
@@ -157,6 +622,11 @@ int main(int i, char **c)
 	
 	uint8_t scale_mode = 1;
 	uint16_t btn_2_cnt = 0;
+	bool raw = false;
+#ifdef CSR_SCALER_STEP_X_ADDR
+	uint8_t zoom_level = 0;
+	uint8_t pan = 0;
+#endif
 
     while(1) {
 		y = _y;
@@ -168,27 +638,63 @@ int main(int i, char **c)
 		printf("vsync LOW %u  HIGH %u   \n", video_debug_vsync_low_read(), video_debug_vsync_high_read());
 		printf("hsync LOW %u  HIGH %u   \n", video_debug_hsync_low_read(), video_debug_hsync_high_read());
 		printf("lines %u   \n", video_debug_lines_read());
+#ifdef CSR_HISTOGRAM_BASE
+		printf("luminance 1%% %u  99%% %u   \n", histogram_percentile(1), histogram_percentile(99));
+#endif
+		printf("resyncs %u   \n", boson_watchdog_resyncs_read());
+#ifdef CSR_TNR_BASE
+		printf("tnr frames %u stalls %u   \n", tnr_frames_read(), tnr_stalls_read());
+#endif
+		printf("hyperram busy %u%% words %u   \n", (uint32_t)((uint64_t)hyperram_stats_busy_read() * 100 / hyperram_stats_window_read()), hyperram_stats_words_read());
+		printf("genlock %s phase %d   \n", genlock_locked_read() ? "\e[32mlocked\e[0m" : "\e[1;31mfree\e[0m  ", (int16_t)genlock_phase_read());
 
 
 
 		if((btn_in_read() & 2) == 0){
-			btn_2_cnt++;
+			if(btn_2_cnt <= RAW_PRESS)
+				btn_2_cnt++;
+			/* Held on past a long press, toggles raw capture */
+			if(btn_2_cnt == RAW_PRESS){
+				raw = !raw;
+				capture_raw(raw);
+			}
 		}else{
 			if((btn_2_cnt > 5) && (btn_2_cnt < 100)){
+#ifdef CSR_SCALER_STEP_X_ADDR
+				/* Zoomed, a short press pans instead */
+				if((scale_mode == 0) && (zoom_level != 0)){
+					pan = (pan + 1) % PAN_POSITIONS;
+					set_pan(pan);
+				}else
+#endif
+#ifdef CSR_PALETTE_BASE
+				palette = (palette + 1) % (sizeof(palettes) / sizeof(palettes[0]));
+				set_palette(palette);
+#else
 				boson_mode_write(1);
+#endif
+			}else if((btn_2_cnt > 100) && (btn_2_cnt < RAW_PRESS)){
+				/* A long press steps through the zoom levels of the interpolating scaler, then the other modes */
+#ifdef CSR_SCALER_STEP_X_ADDR
+				if((scale_mode == 0) && (zoom_level + 1 < ZOOM_LEVELS)){
+					zoom_level++;
+				}else{
+					zoom_level = 0;
+					scale_mode = (scale_mode + 1) % SCALE_MODES;
+				}
+				zoom = zoom_levels[zoom_level];
+				pan = 0;
+				pan_x = 0;
+				pan_y = 0;
+#else
+				scale_mode = (scale_mode + 1) % SCALE_MODES;
+#endif
+				switch_mode(scale_mode);
 			}
 			btn_2_cnt = 0;
 		}
 
 
-		if((btn_2_cnt > 100) && (btn_2_cnt < 150) ){
-			scale_mode ^= 1;
-			btn_2_cnt = 999;
-
-			switch_mode(scale_mode);
-		}
-
-
 
 		/*
 		printf("Button_A %u \n", btn_in_read() & 0x1);